@@ -8,25 +8,49 @@ from telebot import types
 import os
 import os.path
 from InDMDevDB import *
+from outbound import sender
+from config import BotConfig
+from utils import MessageFormatter
+from render_cache import renders, product_card
 from dotenv import load_dotenv
 load_dotenv('config.env')
 
 # Bot connection
 bot = telebot.TeleBot(f"{os.getenv('TELEGRAM_BOT_TOKEN')}", threaded=False)
+sender.install()  # rate limits and retries for every Bot API call
 StoreCurrency = f"{os.getenv('STORE_CURRENCY')}"
+MEDIA_GROUP_SIZE = 10  # Telegram's limit per send_media_group
 
 class CategoriesDatas:
-    def get_category_products(message, input_cate):
-        id = message.from_user.id
+    def category_keyboard(catnum, product_list, version, offset=0):
+        # One BUY button per product of the page; Prev/Next send the neighbouring page.
+        # Serialized once per page and catalog version (product_list read after version was taken).
+        def render():
+            keyboard = types.InlineKeyboardMarkup()
+            page_size = BotConfig.PRODUCTS_PER_PAGE
+            for product in product_list[offset:offset + page_size]:
+                keyboard.add(types.InlineKeyboardButton(text=product_card(product, version).buy_label, callback_data=f"getproduct_{product['productnumber']}"))
+            nav = []
+            if offset > 0:
+                nav.append(types.InlineKeyboardButton(text="◀️ Prev", callback_data=f"catpage_{catnum}_{max(offset - page_size, 0)}"))
+            if offset + page_size < len(product_list):
+                nav.append(types.InlineKeyboardButton(text="Next ▶️", callback_data=f"catpage_{catnum}_{offset + page_size}"))
+            if nav:
+                keyboard.row(*nav)
+            return keyboard.to_json()
+        return renders.get_or_load(f"catpage:{catnum}:{offset}:{version}", render)
+
+    def get_category_products(message, input_cate, offset=0):
+        # One page of a category: PRODUCTS_PER_PAGE products as photo albums and a text
+        # list, then their BUY keyboard
+        id = message.chat.id
         keyboard = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
         keyboard.row_width = 2
         buyer_id = message.from_user.id
         buyer_username = message.from_user.username
-        all_categories = GetDataFromDB.GetCategoryIDsInDB()
-        categories = []
-        for catnum, catname in all_categories:
-            catnames = catname.upper()
-            categories.append(catnames)
+        version = products_version()  # before the rows, see render_cache
+        # categorynumber -> categoryname, for O(1) membership checks
+        categories = {catnum: catname for catnum, catname in GetDataFromDB.GetCategoryIDsInDB()}
             
         def checkint():
             try:
@@ -36,11 +60,10 @@ class CategoriesDatas:
                 return input_cate
         input_category = checkint() 
         if isinstance(input_category, int) == True:
-            product_cate = GetDataFromDB.Get_A_CategoryName(input_category)
-            if f"{product_cate}" in f"{categories}":
+            product_cate = categories.get(input_category)
+            if product_cate is not None:
                 product_category = product_cate.upper()
                 product_list = GetDataFromDB.GetProductInfoByCTGName(product_category)
-                print(product_list)
                 if product_list == []:
                     keyboard = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
                     keyboard.row_width = 2
@@ -51,12 +74,30 @@ class CategoriesDatas:
                     keyboard.add(key2, key3)
                     bot.send_message(id, f"No Product in the store", reply_markup=keyboard)
                 else:
-                    bot.send_message(id, f"{product_cate} Gategory's Products")
-                    keyboard = types.InlineKeyboardMarkup()
-                    for productnumber, productname, productprice, productdescription, productimagelink, productdownloadlink, productquantity, productcategory in product_list:
-                        keyboard.add(types.InlineKeyboardButton(text="BUY NOW 💰", callback_data=f"getproduct_{productnumber}"))
-                        bot.send_photo(id, photo=f"{productimagelink}", caption=f"Product ID 🪪: /{productnumber}\n\nProduct Name 📦: {productname}\n\nProduct Price 💰: {productprice} {StoreCurrency}\n\nProducts In Stock 🛍: {productquantity}\n\nProduct Description 💬: {productdescription}", reply_markup=keyboard)
-                        
-                        #bot.send_message(id, "💡 Click on a Product ID to select the product purchase")
+                    if offset >= len(product_list):
+                        offset = 0  # the page emptied out meanwhile, start over
+                    page = product_list[offset:offset + BotConfig.PRODUCTS_PER_PAGE]
+                    if offset == 0:
+                        bot.send_message(id, f"{product_cate} Gategory's Products")
+                    # Photo cards go out in albums of up to 10, products without a photo as a text list
+                    media = []
+                    text_list = []
+                    for product in page:
+                        card = product_card(product, version)
+                        if card.imagelink:
+                            media.append(types.InputMediaPhoto(card.imagelink, caption=card.caption))
+                        else:
+                            text_list.append(card.line)
+                    for start in range(0, len(media), MEDIA_GROUP_SIZE):
+                        group = media[start:start + MEDIA_GROUP_SIZE]
+                        if len(group) == 1:
+                            # sendMediaGroup takes 2-10 items, a lone photo goes on its own
+                            bot.send_photo(id, group[0].media, caption=group[0].caption)
+                        else:
+                            bot.send_media_group(id, group)
+                    for chunk in MessageFormatter.chunk_lines(text_list):
+                        bot.send_message(id, chunk)
+                    keyboard = CategoriesDatas.category_keyboard(input_category, product_list, version, offset)
+                    bot.send_message(id, "💡 Select a product to buy 👇", reply_markup=keyboard)
             else:
                 print("Wrong commmand !!!")
@@ -1,39 +1,279 @@
+import os
+import re
 import sqlite3
-from datetime import datetime
+import time
+from collections import namedtuple
 import threading
 import logging
+from utils import cache
+from db_profiler import ProfiledLock, ProfiledConnection
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Loggers (handlers and sampling are set up by log_setup.setup_logging). Writes,
+# and so every money and audit record, go to `logger`, which is never sampled;
+# per-call records that repeat on every request go to `query_logger`, which is.
 logger = logging.getLogger(__name__)
+query_logger = logging.getLogger(__name__ + '.query')
 
 # Database configuration
-DB_FILE = 'InDMDevDBShop.db'
-db_connection = sqlite3.connect(DB_FILE, check_same_thread=False)
-db_connection.row_factory = sqlite3.Row
-cursor = db_connection.cursor()
-db_lock = threading.Lock()
+DB_FILE = os.getenv('DB_FILE', 'InDMDevDBShop.db')
+ID_START = 10000000  # allocated product/order numbers are 8 digits; legacy random ones are below 1000000
+ID_MAX = 99999999
+ID_BLOCK_SIZE = 100  # IDs reserved per write to IdSequenceTable
+DB_BUSY_TIMEOUT = 5000  # milliseconds to wait for a locked database
+DB_SYNCHRONOUS = 'NORMAL'  # with WAL only checkpoints fsync, commits stay durable across app crashes
+KEY_IMPORT_BATCH = 5000  # license keys inserted per transaction by UpdateData.import_keys
+KEY_MAX_LENGTH = 512
+CATALOG_VERSION_POLL = 1.0  # seconds between checks for catalog writes made by other processes
+
+# One connection per thread: in WAL mode readers never wait on the writer,
+# db_lock only serializes writers inside this process. Lock wait/hold and every
+# statement's execute/fetch/commit time go to db_profiler and metrics.
+_local = threading.local()
+db_lock = ProfiledLock()
+
+def get_connection():
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(DB_FILE, timeout=DB_BUSY_TIMEOUT / 1000, factory=ProfiledConnection)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        connection.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+        _local.connection = connection
+    return connection
+
+# Read-through cache keys. Every product write drops all "products:" entries,
+# wallet writes drop that user's entry.
+PRODUCTS_CACHE_PREFIX = 'products:'
+
+# Catalog version stamp for render_cache keys: CatalogVersionTable's counter,
+# bumped by triggers in the transaction of every product or category write, so
+# writes from other processes move it too. Re-read after each write here and at
+# most every CATALOG_VERSION_POLL seconds otherwise.
+_products_version = 0
+_version_checked = 0.0
+_version_lock = threading.Lock()
+
+def user_cache_key(user_id):
+    return f"user:{user_id}"
+
+def products_version():
+    if time.monotonic() - _version_checked >= CATALOG_VERSION_POLL:
+        refresh_products_version()
+    return _products_version
+
+def refresh_products_version():
+    global _products_version, _version_checked
+    with _version_lock:
+        _version_checked = time.monotonic()
+        version = get_connection().execute("SELECT version FROM CatalogVersionTable WHERE id = 1").fetchone()[0]
+        # Only ever move forward, and drop the cached rows before taking the new
+        # version: a renderer that reads it must never be handed a row cached
+        # before the write
+        if version > _products_version:
+            cache.invalidate_prefix(PRODUCTS_CACHE_PREFIX)
+            _products_version = version
+
+def invalidate_products():
+    # Called after a product write here has committed
+    refresh_products_version()
+
+def close_connection():
+    connection = getattr(_local, 'connection', None)
+    if connection is not None:
+        connection.close()
+        _local.connection = None
+
+# Schema migrations, applied in order on top of create_all_tables and tracked
+# with PRAGMA user_version. Only ever append: a shipped migration never changes.
+MIGRATIONS = [
+    (1, [
+        # get_orders
+        "CREATE INDEX IF NOT EXISTS idx_order_buyerid ON ShopOrderTable(buyerid)",
+        # get_categories and per-category product lookups
+        "CREATE INDEX IF NOT EXISTS idx_product_category ON ShopProductTable(productcategory)",
+        # shop listing: only in-stock rows, in productnumber order
+        "CREATE INDEX IF NOT EXISTS idx_product_instock ON ShopProductTable(productnumber) WHERE productquantity > 0",
+    ]),
+    (2, [
+        # IDAllocator sequences, seeded past every number already in use
+        """CREATE TABLE IF NOT EXISTS IdSequenceTable(
+            name TEXT PRIMARY KEY,
+            next_value INTEGER NOT NULL
+        )""",
+        f"INSERT OR IGNORE INTO IdSequenceTable (name, next_value) SELECT 'product', MAX({ID_START}, IFNULL(MAX(productnumber), 0) + 1) FROM ShopProductTable",
+        f"INSERT OR IGNORE INTO IdSequenceTable (name, next_value) SELECT 'order', MAX({ID_START}, IFNULL(MAX(ordernumber), 0) + 1) FROM ShopOrderTable",
+    ]),
+    (3, [
+        # Category names are unique regardless of case; back-fill categories that
+        # so far only existed as ShopProductTable.productcategory values
+        "DELETE FROM ShopCategoryTable WHERE id NOT IN (SELECT MIN(id) FROM ShopCategoryTable GROUP BY categoryname COLLATE NOCASE)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_category_name ON ShopCategoryTable(categoryname COLLATE NOCASE)",
+        """INSERT OR IGNORE INTO ShopCategoryTable (categorynumber, categoryname)
+            SELECT IFNULL((SELECT MAX(categorynumber) FROM ShopCategoryTable), 0) + ROW_NUMBER() OVER (ORDER BY name), name
+            FROM (SELECT MIN(productcategory) AS name FROM ShopProductTable WHERE productcategory IS NOT NULL GROUP BY productcategory COLLATE NOCASE)""",
+        "INSERT OR IGNORE INTO IdSequenceTable (name, next_value) SELECT 'category', IFNULL(MAX(categorynumber), 0) + 1 FROM ShopCategoryTable",
+        # per-category in-stock counts and listings
+        "CREATE INDEX IF NOT EXISTS idx_product_category_nocase ON ShopProductTable(productcategory COLLATE NOCASE, productquantity)",
+    ]),
+    (4, [
+        # state_store.SQLiteStateStore: one row per chat in a multi-step flow
+        """CREATE TABLE IF NOT EXISTS ConversationStateTable(
+            chat_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_conversation_updated ON ConversationStateTable(updated_at)",
+    ]),
+    (5, [
+        # get_orders pages newest-first per buyer; supersedes idx_order_buyerid
+        "CREATE INDEX IF NOT EXISTS idx_order_buyer_date ON ShopOrderTable(buyerid, orderdate, id)",
+        "DROP INDEX IF EXISTS idx_order_buyerid",
+    ]),
+    (6, [
+        # Counters kept up to date by add_order/checkout in the order's own
+        # transaction; UpdateData.rebuild_stats recomputes them from the order log
+        "ALTER TABLE ShopOrderTable ADD COLUMN quantity INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE ShopUserTable ADD COLUMN orders_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE ShopUserTable ADD COLUMN total_spent INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE ShopProductTable ADD COLUMN units_sold INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE ShopProductTable ADD COLUMN revenue INTEGER NOT NULL DEFAULT 0",
+        """UPDATE ShopUserTable SET
+            orders_count = (SELECT COUNT(*) FROM ShopOrderTable WHERE buyerid = ShopUserTable.user_id),
+            total_spent = (SELECT IFNULL(SUM(productprice), 0) FROM ShopOrderTable WHERE buyerid = ShopUserTable.user_id)""",
+        """UPDATE ShopProductTable SET
+            units_sold = (SELECT IFNULL(SUM(quantity), 0) FROM ShopOrderTable WHERE productnumber = ShopProductTable.productnumber),
+            revenue = (SELECT IFNULL(SUM(productprice), 0) FROM ShopOrderTable WHERE productnumber = ShopProductTable.productnumber)""",
+        # rebuild_stats aggregates orders per product
+        "CREATE INDEX IF NOT EXISTS idx_order_productnumber ON ShopOrderTable(productnumber)",
+    ]),
+    (7, [
+        # License keys, one row per key; checkout claims them (sets ordernumber) in
+        # the order's transaction. Products with keys have productkeysfile set and
+        # productquantity kept equal to their unclaimed key count
+        """CREATE TABLE IF NOT EXISTS ShopProductKeyTable(
+            id INTEGER PRIMARY KEY,
+            productnumber INTEGER NOT NULL,
+            productkey TEXT NOT NULL,
+            ordernumber INTEGER,
+            claimed_at TIMESTAMP,
+            FOREIGN KEY (productnumber) REFERENCES ShopProductTable(productnumber)
+        )""",
+        # re-importing a key file skips the keys already loaded
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_key_product_key ON ShopProductKeyTable(productnumber, productkey)",
+        # checkout's claim: oldest unclaimed key of a product; claimed keys drop out of the index
+        "CREATE INDEX IF NOT EXISTS idx_key_unclaimed ON ShopProductKeyTable(productnumber, id) WHERE ordernumber IS NULL",
+    ]),
+    (8, [
+        # search_products: external-content FTS5 index over the searchable text
+        # columns, kept in sync by triggers. The update trigger only fires on
+        # those columns, so stock and sales counter updates never touch it.
+        """CREATE VIRTUAL TABLE IF NOT EXISTS ShopProductSearch USING fts5(
+            productname, productdescription, productcategory,
+            content='ShopProductTable', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS trg_product_search_insert AFTER INSERT ON ShopProductTable BEGIN
+            INSERT INTO ShopProductSearch (rowid, productname, productdescription, productcategory)
+                VALUES (new.id, new.productname, new.productdescription, new.productcategory);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_product_search_delete AFTER DELETE ON ShopProductTable BEGIN
+            INSERT INTO ShopProductSearch (ShopProductSearch, rowid, productname, productdescription, productcategory)
+                VALUES ('delete', old.id, old.productname, old.productdescription, old.productcategory);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_product_search_update AFTER UPDATE OF productname, productdescription, productcategory ON ShopProductTable BEGIN
+            INSERT INTO ShopProductSearch (ShopProductSearch, rowid, productname, productdescription, productcategory)
+                VALUES ('delete', old.id, old.productname, old.productdescription, old.productcategory);
+            INSERT INTO ShopProductSearch (rowid, productname, productdescription, productcategory)
+                VALUES (new.id, new.productname, new.productdescription, new.productcategory);
+        END""",
+        "INSERT INTO ShopProductSearch (ShopProductSearch) VALUES ('rebuild')",
+    ]),
+    (9, [
+        # products_version: one counter every product or category write bumps in
+        # its own transaction, whichever process makes it
+        """CREATE TABLE IF NOT EXISTS CatalogVersionTable(
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )""",
+        "INSERT OR IGNORE INTO CatalogVersionTable (id, version) VALUES (1, 1)",
+        """CREATE TRIGGER IF NOT EXISTS trg_product_version_insert AFTER INSERT ON ShopProductTable BEGIN
+            UPDATE CatalogVersionTable SET version = version + 1 WHERE id = 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_product_version_update AFTER UPDATE ON ShopProductTable BEGIN
+            UPDATE CatalogVersionTable SET version = version + 1 WHERE id = 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_product_version_delete AFTER DELETE ON ShopProductTable BEGIN
+            UPDATE CatalogVersionTable SET version = version + 1 WHERE id = 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_category_version_insert AFTER INSERT ON ShopCategoryTable BEGIN
+            UPDATE CatalogVersionTable SET version = version + 1 WHERE id = 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_category_version_update AFTER UPDATE ON ShopCategoryTable BEGIN
+            UPDATE CatalogVersionTable SET version = version + 1 WHERE id = 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_category_version_delete AFTER DELETE ON ShopCategoryTable BEGIN
+            UPDATE CatalogVersionTable SET version = version + 1 WHERE id = 1;
+        END""",
+    ]),
+]
+
+# Stored counters that disagree with the order log, see UpdateData.rebuild_stats
+USER_STATS_DRIFT_SQL = """SELECT u.user_id, u.orders_count, u.total_spent,
+        IFNULL(o.orders_count, 0) AS actual_orders_count, IFNULL(o.total_spent, 0) AS actual_total_spent
+    FROM ShopUserTable u
+    LEFT JOIN (SELECT buyerid, COUNT(*) AS orders_count, SUM(productprice) AS total_spent FROM ShopOrderTable GROUP BY buyerid) o
+        ON o.buyerid = u.user_id
+    WHERE u.orders_count != IFNULL(o.orders_count, 0) OR u.total_spent != IFNULL(o.total_spent, 0)"""
+PRODUCT_STATS_DRIFT_SQL = """SELECT p.productnumber, p.units_sold, p.revenue,
+        IFNULL(o.units_sold, 0) AS actual_units_sold, IFNULL(o.revenue, 0) AS actual_revenue
+    FROM ShopProductTable p
+    LEFT JOIN (SELECT productnumber, SUM(quantity) AS units_sold, SUM(productprice) AS revenue FROM ShopOrderTable GROUP BY productnumber) o
+        ON o.productnumber = p.productnumber
+    WHERE p.units_sold != IFNULL(o.units_sold, 0) OR p.revenue != IFNULL(o.revenue, 0)"""
+KEY_STOCK_DRIFT_SQL = """SELECT p.productnumber, p.productquantity,
+        (SELECT COUNT(*) FROM ShopProductKeyTable k WHERE k.productnumber = p.productnumber AND k.ordernumber IS NULL) AS actual_productquantity
+    FROM ShopProductTable p
+    WHERE p.productkeysfile IS NOT NULL AND p.productquantity != actual_productquantity"""
+
+# bm25 weights of ShopProductSearch's columns: name, description, category
+SEARCH_WEIGHTS = (10.0, 1.0, 4.0)
+SEARCH_MAX_TERMS = 8
+_SEARCH_TERM = re.compile(r'\w+')
+
+def search_match_expression(terms):
+    # User text -> FTS5 query: every word must match, the last one as a prefix
+    # ("netflix prem" -> "netflix" "prem"*). Prefixes of whole-word length are
+    # not in the prefix index and cost a full doclist merge, so only the word
+    # still being typed gets one. Words are quoted: FTS5 operators are inert.
+    words = _SEARCH_TERM.findall(terms or '')[:SEARCH_MAX_TERMS]
+    return ' '.join([f'"{word}"' for word in words[:-1]] + [f'"{word}"*' for word in words[-1:]])
+
+# Column order of the product rows the category screens read
+PRODUCT_INFO_COLUMNS = "productnumber, productname, productprice, productdescription, productimagelink, productdownloadlink, productquantity, productcategory"
 
 class CreateTables:
     @staticmethod
     def create_all_tables():
         try:
             with db_lock:
-                cursor.execute("""CREATE TABLE IF NOT EXISTS ShopUserTable(
+                connection = get_connection()
+                connection.execute("""CREATE TABLE IF NOT EXISTS ShopUserTable(
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER UNIQUE NOT NULL,
                     username TEXT,
                     wallet INTEGER DEFAULT 0,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )""")
-                cursor.execute("""CREATE TABLE IF NOT EXISTS ShopAdminTable(
+                connection.execute("""CREATE TABLE IF NOT EXISTS ShopAdminTable(
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     admin_id INTEGER UNIQUE NOT NULL,
                     username TEXT,
                     wallet INTEGER DEFAULT 0,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )""")
-                cursor.execute("""CREATE TABLE IF NOT EXISTS ShopProductTable(
+                connection.execute("""CREATE TABLE IF NOT EXISTS ShopProductTable(
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     productnumber INTEGER UNIQUE NOT NULL DEFAULT (ABS(RANDOM()) % 1000000),
                     admin_id INTEGER NOT NULL,
@@ -49,7 +289,7 @@ class CreateTables:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (admin_id) REFERENCES ShopAdminTable(admin_id)
                 )""")
-                cursor.execute("""CREATE TABLE IF NOT EXISTS ShopOrderTable(
+                connection.execute("""CREATE TABLE IF NOT EXISTS ShopOrderTable(
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     buyerid INTEGER NOT NULL,
                     buyerusername TEXT,
@@ -66,13 +306,13 @@ class CreateTables:
                     FOREIGN KEY (buyerid) REFERENCES ShopUserTable(user_id),
                     FOREIGN KEY (productnumber) REFERENCES ShopProductTable(productnumber)
                 )""")
-                cursor.execute("""CREATE TABLE IF NOT EXISTS ShopCategoryTable(
+                connection.execute("""CREATE TABLE IF NOT EXISTS ShopCategoryTable(
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     categorynumber INTEGER UNIQUE NOT NULL,
                     categoryname TEXT NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )""")
-                cursor.execute("""CREATE TABLE IF NOT EXISTS PaymentMethodTable(
+                connection.execute("""CREATE TABLE IF NOT EXISTS PaymentMethodTable(
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     admin_id INTEGER,
                     username TEXT,
@@ -82,179 +322,696 @@ class CreateTables:
                     activated TEXT DEFAULT 'NO',
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )""")
-                db_connection.commit()
+                connection.commit()
                 logger.info("All database tables created successfully")
         except Exception as e:
-            logger.error(f"Error creating database tables: {e}")
-            db_connection.rollback()
+            logger.error("Error creating database tables: %s", e)
+            get_connection().rollback()
+            raise
+
+    @staticmethod
+    def run_migrations():
+        try:
+            with db_lock:
+                connection = get_connection()
+                for version, statements in MIGRATIONS:
+                    # BEGIN IMMEDIATE before reading user_version so two processes
+                    # starting together cannot both apply the same migration
+                    connection.execute("BEGIN IMMEDIATE")
+                    current = connection.execute("PRAGMA user_version").fetchone()[0]
+                    if version <= current:
+                        connection.rollback()
+                        continue
+                    for statement in statements:
+                        connection.execute(statement)
+                    connection.execute(f"PRAGMA user_version = {version}")
+                    connection.commit()
+                    logger.info("Applied database migration %s", version)
+        except Exception as e:
+            logger.error("Error applying database migrations: %s", e)
+            get_connection().rollback()
             raise
 
 CreateTables.create_all_tables()
+CreateTables.run_migrations()
+
+class IDAllocator:
+    # Hands out monotonic IDs from blocks reserved in IdSequenceTable. Each block
+    # is claimed in its own BEGIN IMMEDIATE transaction, so no two threads or
+    # processes ever get the same ID. Never call next_id() while holding db_lock.
+    def __init__(self, name, block_size=ID_BLOCK_SIZE):
+        self.name = name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._reserve_block()
+            value = self._next
+            self._next += 1
+            return value
+
+    def _reserve_block(self):
+        with db_lock:
+            connection = get_connection()
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                start = connection.execute("SELECT next_value FROM IdSequenceTable WHERE name = ?", (self.name,)).fetchone()[0]
+                end = start + self.block_size
+                if end - 1 > ID_MAX:
+                    raise OverflowError(f"ID sequence '{self.name}' exhausted")
+                connection.execute("UPDATE IdSequenceTable SET next_value = ? WHERE name = ?", (end, self.name))
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+        self._next, self._end = start, end
+
+product_ids = IDAllocator('product')
+order_ids = IDAllocator('order')
+category_ids = IDAllocator('category', block_size=1)  # categories are rare, keep their numbers dense
 
 class CreateDatas:
     @staticmethod
     def add_user(user_id, username):
         try:
             with db_lock:
-                cursor.execute(
+                connection = get_connection()
+                cursor = connection.execute(
                     "INSERT OR IGNORE INTO ShopUserTable (user_id, username, wallet) VALUES (?, ?, ?)",
                     (user_id, username, 0)
                 )
-                db_connection.commit()
-                logger.info(f"User added: {username} (ID: {user_id})")
+                connection.commit()
+                if cursor.rowcount:
+                    logger.info("User added: %s (ID: %s)", username, user_id)
+                else:
+                    # every /start of a known user
+                    query_logger.info("User already registered: %s (ID: %s)", username, user_id)
                 return True
         except Exception as e:
-            logger.error(f"Error adding user {username}: {e}")
-            db_connection.rollback()
+            logger.error("Error adding user %s: %s", username, e)
+            get_connection().rollback()
             return False
 
     @staticmethod
     def add_admin(admin_id, username):
         try:
             with db_lock:
-                cursor.execute(
+                connection = get_connection()
+                connection.execute(
                     "INSERT OR IGNORE INTO ShopAdminTable (admin_id, username, wallet) VALUES (?, ?, ?)",
                     (admin_id, username, 0)
                 )
-                db_connection.commit()
-                logger.info(f"Admin added: {username} (ID: {admin_id})")
+                connection.commit()
+                logger.info("Admin added: %s (ID: %s)", username, admin_id)
                 return True
         except Exception as e:
-            logger.error(f"Error adding admin {username}: {e}")
-            db_connection.rollback()
+            logger.error("Error adding admin %s: %s", username, e)
+            get_connection().rollback()
             return False
 
     @staticmethod
     def add_product(admin_id, username, productname, productdescription, productprice, productquantity, productcategory, productimagelink=None):
         try:
+            productnumber = product_ids.next_id()
+            categorynumber = None
+            if productcategory and GetDataFromDB.Get_A_CategoryNumber(productcategory) is None:
+                categorynumber = category_ids.next_id()
             with db_lock:
-                cursor.execute(
-                    "INSERT INTO ShopProductTable (admin_id, username, productname, productdescription, productprice, productquantity, productcategory, productimagelink) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                    (admin_id, username, productname, productdescription, productprice, productquantity, productcategory, productimagelink)
+                connection = get_connection()
+                if categorynumber is not None:
+                    connection.execute(
+                        "INSERT OR IGNORE INTO ShopCategoryTable (categorynumber, categoryname) VALUES (?, ?)",
+                        (categorynumber, productcategory)
+                    )
+                connection.execute(
+                    "INSERT INTO ShopProductTable (productnumber, admin_id, username, productname, productdescription, productprice, productquantity, productcategory, productimagelink) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (productnumber, admin_id, username, productname, productdescription, productprice, productquantity, productcategory, productimagelink)
                 )
-                db_connection.commit()
-                logger.info(f"Product added: {productname}")
+                connection.commit()
+                invalidate_products()
+                logger.info("Product added: %s", productname)
                 return True
         except Exception as e:
-            logger.error(f"Error adding product {productname}: {e}")
-            db_connection.rollback()
+            logger.error("Error adding product %s: %s", productname, e)
+            get_connection().rollback()
             return False
 
     @staticmethod
     def topup_wallet(user_id, amount):
         try:
             with db_lock:
-                cursor.execute(
+                connection = get_connection()
+                connection.execute(
                     "UPDATE ShopUserTable SET wallet = wallet + ? WHERE user_id = ?",
                     (amount, user_id)
                 )
-                db_connection.commit()
-                logger.info(f"Wallet topped up for user {user_id} by {amount}")
+                connection.commit()
+                cache.delete(user_cache_key(user_id))
+                logger.info("Wallet topped up for user %s by %s", user_id, amount)
                 return True
         except Exception as e:
-            logger.error(f"Error topping up wallet for user {user_id}: {e}")
-            db_connection.rollback()
+            logger.error("Error topping up wallet for user %s: %s", user_id, e)
+            get_connection().rollback()
             return False
 
 class GetDataFromDB:
     @staticmethod
     def get_user(user_id):
         try:
-            with db_lock:
-                cursor.execute("SELECT * FROM ShopUserTable WHERE user_id = ?", (user_id,))
-                return cursor.fetchone()
+            return cache.get_or_load(
+                user_cache_key(user_id),
+                lambda: get_connection().execute("SELECT * FROM ShopUserTable WHERE user_id = ?", (user_id,)).fetchone()
+            )
         except Exception as e:
-            logger.error(f"Error getting user {user_id}: {e}")
+            logger.error("Error getting user %s: %s", user_id, e)
             return None
 
     @staticmethod
     def get_products():
         try:
-            with db_lock:
-                cursor.execute("SELECT * FROM ShopProductTable")
-                return cursor.fetchall()
+            return cache.get_or_load(
+                PRODUCTS_CACHE_PREFIX + 'all',
+                lambda: get_connection().execute("SELECT * FROM ShopProductTable").fetchall()
+            )
         except Exception as e:
-            logger.error(f"Error getting products: {e}")
+            logger.error("Error getting products: %s", e)
             return None
 
+    @staticmethod
+    def get_products_page(after=None, before=None, limit=10, in_stock_only=True):
+        # Keyset pagination on productnumber: Next passes the last number shown as
+        # `after`, Prev the first one as `before`. Returns (rows, has_prev, has_next).
+        stock_filter = "productquantity > 0 AND " if in_stock_only else ""
+
+        def load():
+            connection = get_connection()
+            if before is not None:
+                rows = connection.execute(
+                    f"SELECT * FROM ShopProductTable WHERE {stock_filter}productnumber < ? ORDER BY productnumber DESC LIMIT ?",
+                    (before, limit + 1)
+                ).fetchall()
+                return rows[:limit][::-1], len(rows) > limit, True
+            rows = connection.execute(
+                f"SELECT * FROM ShopProductTable WHERE {stock_filter}productnumber > ? ORDER BY productnumber LIMIT ?",
+                (after if after is not None else -1, limit + 1)
+            ).fetchall()
+            return rows[:limit], after is not None, len(rows) > limit
+
+        try:
+            return cache.get_or_load(f"{PRODUCTS_CACHE_PREFIX}page:{in_stock_only}:{after}:{before}:{limit}", load)
+        except Exception as e:
+            logger.error("Error getting products page: %s", e)
+            return [], False, False
+
     @staticmethod
     def get_product_by_id(productnumber):
         try:
-            with db_lock:
-                cursor.execute("SELECT * FROM ShopProductTable WHERE productnumber = ?", (productnumber,))
-                return cursor.fetchone()
+            return cache.get_or_load(
+                f"{PRODUCTS_CACHE_PREFIX}id:{productnumber}",
+                lambda: get_connection().execute("SELECT * FROM ShopProductTable WHERE productnumber = ?", (productnumber,)).fetchone()
+            )
         except Exception as e:
-            logger.error(f"Error getting product {productnumber}: {e}")
+            logger.error("Error getting product %s: %s", productnumber, e)
             return None
 
     @staticmethod
     def get_categories():
         try:
-            with db_lock:
-                cursor.execute("SELECT DISTINCT productcategory FROM ShopProductTable")
-                return cursor.fetchall()
+            return cache.get_or_load(
+                PRODUCTS_CACHE_PREFIX + 'categories',
+                lambda: get_connection().execute("SELECT DISTINCT productcategory FROM ShopProductTable").fetchall()
+            )
         except Exception as e:
-            logger.error(f"Error getting categories: {e}")
+            logger.error("Error getting categories: %s", e)
             return None
 
+    @staticmethod
+    def GetCategoryIDsInDB():
+        try:
+            return cache.get_or_load(
+                PRODUCTS_CACHE_PREFIX + 'category_ids',
+                lambda: get_connection().execute("SELECT categorynumber, categoryname FROM ShopCategoryTable ORDER BY categoryname COLLATE NOCASE").fetchall()
+            )
+        except Exception as e:
+            logger.error("Error getting category IDs: %s", e)
+            return []
+
+    @staticmethod
+    def GetCategoriesWithProductCount():
+        # Every category with its in-stock product count in one grouped query
+        try:
+            return cache.get_or_load(
+                PRODUCTS_CACHE_PREFIX + 'category_counts',
+                lambda: get_connection().execute(
+                    """SELECT c.categorynumber, c.categoryname, COUNT(p.id) AS productcount
+                    FROM ShopCategoryTable c
+                    LEFT JOIN ShopProductTable p ON p.productcategory = c.categoryname COLLATE NOCASE AND p.productquantity > 0
+                    GROUP BY c.categoryname COLLATE NOCASE
+                    ORDER BY c.categoryname COLLATE NOCASE"""
+                ).fetchall()
+            )
+        except Exception as e:
+            logger.error("Error getting category product counts: %s", e)
+            return []
+
+    @staticmethod
+    def GetCategoryNumProduct(categoryname):
+        try:
+            return get_connection().execute(
+                "SELECT COUNT(*) FROM ShopProductTable WHERE productcategory = ? COLLATE NOCASE AND productquantity > 0",
+                (categoryname,)
+            ).fetchall()
+        except Exception as e:
+            logger.error("Error counting products in category %s: %s", categoryname, e)
+            return []
+
+    @staticmethod
+    def Get_A_CategoryName(categorynumber):
+        try:
+            row = get_connection().execute("SELECT categoryname FROM ShopCategoryTable WHERE categorynumber = ?", (categorynumber,)).fetchone()
+            return row['categoryname'] if row else None
+        except Exception as e:
+            logger.error("Error getting category %s: %s", categorynumber, e)
+            return None
+
+    @staticmethod
+    def Get_A_CategoryNumber(categoryname):
+        try:
+            row = get_connection().execute("SELECT categorynumber FROM ShopCategoryTable WHERE categoryname = ? COLLATE NOCASE", (categoryname,)).fetchone()
+            return row['categorynumber'] if row else None
+        except Exception as e:
+            logger.error("Error getting category number for %s: %s", categoryname, e)
+            return None
+
+    @staticmethod
+    def GetProductInfoByCTGName(categoryname):
+        try:
+            return cache.get_or_load(
+                f"{PRODUCTS_CACHE_PREFIX}category:{categoryname.upper()}",
+                lambda: get_connection().execute(
+                    f"SELECT {PRODUCT_INFO_COLUMNS} FROM ShopProductTable WHERE productcategory = ? COLLATE NOCASE AND productquantity > 0 ORDER BY productnumber",
+                    (categoryname,)
+                ).fetchall()
+            )
+        except Exception as e:
+            logger.error("Error getting products in category %s: %s", categoryname, e)
+            return []
+
+    @staticmethod
+    def GetProductInfo():
+        try:
+            return get_connection().execute(f"SELECT {PRODUCT_INFO_COLUMNS} FROM ShopProductTable").fetchall()
+        except Exception as e:
+            logger.error("Error getting product info: %s", e)
+            return []
+
+    @staticmethod
+    def GetProductInfoByPName(productnumber):
+        try:
+            return get_connection().execute(f"SELECT {PRODUCT_INFO_COLUMNS} FROM ShopProductTable WHERE productnumber = ?", (productnumber,)).fetchall()
+        except Exception as e:
+            logger.error("Error getting product info for %s: %s", productnumber, e)
+            return []
+
     @staticmethod
     def get_wallet_balance(user_id):
         user = GetDataFromDB.get_user(user_id)
         return user['wallet'] if user else 0
 
     @staticmethod
-    def get_orders(user_id):
+    def get_orders(user_id, cursor=None, limit=10):
+        # Keyset pagination, newest first: pass the id of the last order shown as
+        # `cursor` for the next page. Returns (rows, next_cursor or None).
         try:
-            with db_lock:
-                cursor.execute("SELECT * FROM ShopOrderTable WHERE buyerid = ?", (user_id,))
-                return cursor.fetchall()
+            connection = get_connection()
+            if cursor is None:
+                rows = connection.execute(
+                    "SELECT * FROM ShopOrderTable WHERE buyerid = ? ORDER BY orderdate DESC, id DESC LIMIT ?",
+                    (user_id, limit + 1)
+                ).fetchall()
+            else:
+                rows = connection.execute(
+                    """SELECT * FROM ShopOrderTable WHERE buyerid = ?
+                    AND (orderdate, id) < (SELECT orderdate, id FROM ShopOrderTable WHERE id = ?)
+                    ORDER BY orderdate DESC, id DESC LIMIT ?""",
+                    (user_id, cursor, limit + 1)
+                ).fetchall()
+            next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+            return rows[:limit], next_cursor
         except Exception as e:
-            logger.error(f"Error getting orders for user {user_id}: {e}")
-            return None
+            logger.error("Error getting orders for user %s: %s", user_id, e)
+            return [], None
+
+    @staticmethod
+    def search_products(terms, offset=0, limit=10):
+        # Ranked full-text search over name, description and category, in-stock
+        # products only. Every match is scored, so the oldest product is as
+        # reachable as the newest, and each row carries the number of matches
+        # (COUNT(*) OVER () over the ranked ids); full rows are read for the page
+        # only. Rank order has no stable key to seek from, so pages use OFFSET;
+        # result pages are small and cached. Returns (rows, has_next).
+        match = search_match_expression(terms)
+        if not match:
+            return [], False
+
+        def load():
+            rows = get_connection().execute(
+                f"""SELECT p.*, r.matches FROM (
+                        SELECT s.rowid, s.score, COUNT(*) OVER () AS matches FROM (
+                            SELECT rowid, bm25(ShopProductSearch, {', '.join(map(str, SEARCH_WEIGHTS))}) AS score
+                            FROM ShopProductSearch WHERE ShopProductSearch MATCH ?
+                        ) s JOIN ShopProductTable c ON c.id = s.rowid
+                        WHERE c.productquantity > 0
+                        ORDER BY s.score, s.rowid LIMIT ? OFFSET ?
+                    ) r JOIN ShopProductTable p ON p.id = r.rowid
+                    ORDER BY r.score, p.id""",
+                (match, limit, offset)
+            ).fetchall()
+            return rows, bool(rows) and rows[0]['matches'] > offset + len(rows)
+
+        try:
+            return cache.get_or_load(f"{PRODUCTS_CACHE_PREFIX}search:{match}:{offset}:{limit}", load)
+        except Exception as e:
+            logger.error("Error searching products for %r: %s", terms, e)
+            return [], False
+
+    @staticmethod
+    def iter_products(limit=1000):
+        # Whole catalog in productnumber order, fetched in keyset pages of `limit`
+        # rows, so an export never holds more than one page in memory
+        after = -1
+        while True:
+            rows = get_connection().execute(
+                "SELECT * FROM ShopProductTable WHERE productnumber > ? ORDER BY productnumber LIMIT ?",
+                (after, limit)
+            ).fetchall()
+            yield from rows
+            if len(rows) < limit:
+                return
+            after = rows[-1]['productnumber']
+
+class CheckoutStatus:
+    OK = 'ok'
+    NOT_FOUND = 'not_found'
+    OUT_OF_STOCK = 'out_of_stock'
+    INSUFFICIENT_FUNDS = 'insufficient_funds'
+    ERROR = 'error'
+
+CheckoutResult = namedtuple('CheckoutResult', ['status', 'ordernumber', 'total', 'keys'], defaults=[()])
 
 class UpdateData:
     @staticmethod
     def deduct_wallet(user_id, amount):
         try:
             with db_lock:
-                cursor.execute(
+                connection = get_connection()
+                cursor = connection.execute(
                     "UPDATE ShopUserTable SET wallet = wallet - ? WHERE user_id = ? AND wallet >= ?",
                     (amount, user_id, amount)
                 )
-                db_connection.commit()
-                logger.info(f"Wallet deducted for user {user_id} by {amount}")
+                connection.commit()
+                cache.delete(user_cache_key(user_id))
+                logger.info("Wallet deducted for user %s by %s", user_id, amount)
                 return cursor.rowcount > 0  # True if updated
         except Exception as e:
-            logger.error(f"Error deducting wallet for user {user_id}: {e}")
-            db_connection.rollback()
+            logger.error("Error deducting wallet for user %s: %s", user_id, e)
+            get_connection().rollback()
             return False
 
     @staticmethod
     def update_product_quantity(productnumber, new_quantity):
         try:
             with db_lock:
-                cursor.execute("UPDATE ShopProductTable SET productquantity = ? WHERE productnumber = ?", (new_quantity, productnumber))
-                db_connection.commit()
-                logger.info(f"Updated quantity for product {productnumber}")
-                return True
+                connection = get_connection()
+                # stock of a product with license keys is its unclaimed key count, see import_keys
+                cursor = connection.execute(
+                    "UPDATE ShopProductTable SET productquantity = ? WHERE productnumber = ? AND productkeysfile IS NULL",
+                    (new_quantity, productnumber)
+                )
+                connection.commit()
+                invalidate_products()
+                logger.info("Updated quantity for product %s", productnumber)
+                return cursor.rowcount > 0
         except Exception as e:
-            logger.error(f"Error updating quantity for product {productnumber}: {e}")
-            db_connection.rollback()
+            logger.error("Error updating quantity for product %s: %s", productnumber, e)
+            get_connection().rollback()
             return False
 
     @staticmethod
     def add_order(buyerid, buyerusername, productname, productprice, productdownloadlink, productnumber):
         try:
+            ordernumber = order_ids.next_id()
             with db_lock:
-                ordernumber = abs(hash(datetime.now().timestamp())) % 1000000  # Unique order number
-                cursor.execute(
+                connection = get_connection()
+                connection.execute(
                     "INSERT INTO ShopOrderTable (buyerid, buyerusername, productname, productprice, paidmethod, productdownloadlink, ordernumber, productnumber) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
                     (buyerid, buyerusername, productname, productprice, 'YES', productdownloadlink, ordernumber, productnumber)
                 )
-                db_connection.commit()
-                logger.info(f"Order added for {buyerusername} (ID: {buyerid}): {ordernumber}")
+                UpdateData._count_order(connection, buyerid, productnumber, 1, productprice)
+                connection.commit()
+                invalidate_products()
+                cache.delete(user_cache_key(buyerid))
+                logger.info("Order added for %s (ID: %s): %s", buyerusername, buyerid, ordernumber)
                 return True
         except Exception as e:
-            logger.error(f"Error adding order for {buyerusername}: {e}")
-            db_connection.rollback()
+            logger.error("Error adding order for %s: %s", buyerusername, e)
+            get_connection().rollback()
             return False
+
+    @staticmethod
+    def _count_order(connection, buyerid, productnumber, quantity, amount):
+        # Bump the denormalized counters inside the caller's order transaction
+        connection.execute(
+            "UPDATE ShopUserTable SET orders_count = orders_count + 1, total_spent = total_spent + ? WHERE user_id = ?",
+            (amount, buyerid)
+        )
+        connection.execute(
+            "UPDATE ShopProductTable SET units_sold = units_sold + ?, revenue = revenue + ? WHERE productnumber = ?",
+            (quantity, amount, productnumber)
+        )
+
+    @staticmethod
+    def checkout(buyerid, productnumber, quantity=1, buyerusername=None):
+        # Stock decrement, wallet debit and order insert commit together or not at all.
+        # BEGIN IMMEDIATE takes SQLite's write lock up front, so concurrent buyers
+        # (other threads or other processes) queue instead of overselling.
+        if quantity < 1:
+            return CheckoutResult(CheckoutStatus.ERROR, None, 0)
+        try:
+            ordernumber = order_ids.next_id()  # a failed checkout just leaves a gap
+            with db_lock:
+                connection = get_connection()
+                connection.execute("BEGIN IMMEDIATE")
+                product = connection.execute(
+                    "SELECT productname, productprice, productdownloadlink, productkeysfile FROM ShopProductTable WHERE productnumber = ?",
+                    (productnumber,)
+                ).fetchone()
+                if product is None:
+                    connection.rollback()
+                    return CheckoutResult(CheckoutStatus.NOT_FOUND, None, 0)
+                total = product['productprice'] * quantity
+                stock = connection.execute(
+                    "UPDATE ShopProductTable SET productquantity = productquantity - ? WHERE productnumber = ? AND productquantity >= ?",
+                    (quantity, productnumber, quantity)
+                )
+                if stock.rowcount == 0:
+                    connection.rollback()
+                    return CheckoutResult(CheckoutStatus.OUT_OF_STOCK, None, total)
+                wallet = connection.execute(
+                    "UPDATE ShopUserTable SET wallet = wallet - ? WHERE user_id = ? AND wallet >= ?",
+                    (total, buyerid, total)
+                )
+                if wallet.rowcount == 0:
+                    connection.rollback()
+                    return CheckoutResult(CheckoutStatus.INSUFFICIENT_FUNDS, None, total)
+                keys = ()
+                if product['productkeysfile'] is not None:
+                    keys = tuple(row[0] for row in connection.execute(
+                        """UPDATE ShopProductKeyTable SET ordernumber = ?, claimed_at = CURRENT_TIMESTAMP
+                            WHERE id IN (SELECT id FROM ShopProductKeyTable WHERE productnumber = ? AND ordernumber IS NULL ORDER BY id LIMIT ?)
+                            RETURNING productkey""",
+                        (ordernumber, productnumber, quantity)
+                    ).fetchall())
+                    if len(keys) < quantity:
+                        # productquantity drifted from the key table; /rebuildstats resyncs it
+                        connection.rollback()
+                        logger.warning("Product %s has fewer unclaimed keys than its stock", productnumber)
+                        return CheckoutResult(CheckoutStatus.OUT_OF_STOCK, None, total)
+                connection.execute(
+                    "INSERT INTO ShopOrderTable (buyerid, buyerusername, productname, productprice, paidmethod, productdownloadlink, productkeys, ordernumber, productnumber, quantity) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (buyerid, buyerusername, product['productname'], total, 'WALLET', product['productdownloadlink'], '\n'.join(keys) or None, ordernumber, productnumber, quantity)
+                )
+                UpdateData._count_order(connection, buyerid, productnumber, quantity, total)
+                connection.commit()
+                invalidate_products()
+                cache.delete(user_cache_key(buyerid))
+                logger.info("Checkout for %s (ID: %s): order %s, product %s x%s", buyerusername, buyerid, ordernumber, productnumber, quantity)
+                return CheckoutResult(CheckoutStatus.OK, ordernumber, total, keys)
+        except Exception as e:
+            logger.error("Error during checkout for %s (ID: %s): %s", buyerusername, buyerid, e)
+            get_connection().rollback()
+            return CheckoutResult(CheckoutStatus.ERROR, None, 0)
+
+    @staticmethod
+    def import_keys(productnumber, lines, source=None, batch_size=KEY_IMPORT_BATCH):
+        # Load license keys from any iterable of lines (an open file, a streamed
+        # download), one key per line. Keys go in batches of batch_size, each its
+        # own transaction, so memory stays flat and db_lock is released between
+        # batches. Blank, overlong and already loaded keys are skipped. Returns
+        # {'added', 'duplicates', 'invalid'}, or None if the product is unknown.
+        if GetDataFromDB.get_product_by_id(productnumber) is None:
+            return None
+        source = source or 'import'
+        result = {'added': 0, 'duplicates': 0, 'invalid': 0}
+
+        def flush(batch):
+            with db_lock:
+                connection = get_connection()
+                try:
+                    connection.execute("BEGIN IMMEDIATE")
+                    before = connection.total_changes
+                    connection.executemany(
+                        "INSERT OR IGNORE INTO ShopProductKeyTable (productnumber, productkey) VALUES (?, ?)",
+                        ((productnumber, key) for key in batch)
+                    )
+                    added = connection.total_changes - before
+                    # the first import turns a counted product into a keyed one: its stock restarts from the keys
+                    connection.execute(
+                        """UPDATE ShopProductTable SET productkeysfile = ?,
+                            productquantity = CASE WHEN productkeysfile IS NULL THEN 0 ELSE productquantity END + ?
+                            WHERE productnumber = ?""",
+                        (source, added, productnumber)
+                    )
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+            # every batch changes the stock shown on product cards
+            invalidate_products()
+            result['added'] += added
+            result['duplicates'] += len(batch) - added
+
+        try:
+            batch = []
+            for line in lines:
+                key = (line.decode('utf-8', 'replace') if isinstance(line, bytes) else line).strip()
+                if not key:
+                    continue
+                if len(key) > KEY_MAX_LENGTH:
+                    result['invalid'] += 1
+                    continue
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+        except Exception as e:
+            logger.error("Error importing keys for product %s after %s keys: %s", productnumber, result['added'], e)
+            result['error'] = str(e)
+        logger.info("Imported keys for product %s from %s: %s added, %s duplicates, %s invalid",
+                    productnumber, source, result['added'], result['duplicates'], result['invalid'])
+        return result
+
+    @staticmethod
+    def upsert_products(products, admin_id, username):
+        # Write one chunk of validated catalog rows in a single transaction. Rows
+        # with a productnumber update that product, leaving fields that are None
+        # (and the stock of keyed products) as they are; rows without one are
+        # added. Returns {'added', 'updated', 'missing': [indexes of rows whose
+        # productnumber does not exist]}, or None if the chunk failed.
+        try:
+            new_numbers = {index: product_ids.next_id() for index, product in enumerate(products) if product.get('productnumber') is None}
+            new_categories = {}
+            for product in products:
+                name = product.get('productcategory')
+                if name and name.lower() not in new_categories and GetDataFromDB.Get_A_CategoryNumber(name) is None:
+                    new_categories[name.lower()] = (category_ids.next_id(), name)
+            with db_lock:
+                connection = get_connection()
+                connection.execute("BEGIN IMMEDIATE")
+                given = [product['productnumber'] for product in products if product.get('productnumber') is not None]
+                existing = set()
+                for start in range(0, len(given), 500):
+                    part = given[start:start + 500]
+                    existing.update(row[0] for row in connection.execute(
+                        f"SELECT productnumber FROM ShopProductTable WHERE productnumber IN ({','.join('?' * len(part))})", part
+                    ))
+                connection.executemany(
+                    "INSERT OR IGNORE INTO ShopCategoryTable (categorynumber, categoryname) VALUES (?, ?)",
+                    list(new_categories.values())
+                )
+                inserts, updates, missing = [], [], []
+                for index, product in enumerate(products):
+                    if index in new_numbers:
+                        inserts.append((new_numbers[index], admin_id, username, product['productname'], product.get('productdescription') or '',
+                                        product['productprice'], product.get('productquantity') or 0, product.get('productcategory') or 'Default Category',
+                                        product.get('productimagelink'), product.get('productdownloadlink')))
+                    elif product['productnumber'] in existing:
+                        updates.append((product['productname'], product.get('productdescription'), product['productprice'], product.get('productquantity'),
+                                        product.get('productcategory'), product.get('productimagelink'), product.get('productdownloadlink'), product['productnumber']))
+                    else:
+                        missing.append(index)
+                connection.executemany(
+                    "INSERT INTO ShopProductTable (productnumber, admin_id, username, productname, productdescription, productprice, productquantity, productcategory, productimagelink, productdownloadlink) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    inserts
+                )
+                connection.executemany(
+                    """UPDATE ShopProductTable SET productname = ?, productdescription = IFNULL(?, productdescription), productprice = ?,
+                        productquantity = CASE WHEN productkeysfile IS NULL THEN IFNULL(?, productquantity) ELSE productquantity END,
+                        productcategory = IFNULL(?, productcategory), productimagelink = IFNULL(?, productimagelink),
+                        productdownloadlink = IFNULL(?, productdownloadlink)
+                        WHERE productnumber = ?""",
+                    updates
+                )
+                connection.commit()
+                invalidate_products()
+                logger.info("Catalog chunk: %s products added, %s updated, %s unknown", len(inserts), len(updates), len(missing))
+                return {'added': len(inserts), 'updated': len(updates), 'missing': missing}
+        except Exception as e:
+            logger.error("Error upserting %s products: %s", len(products), e)
+            get_connection().rollback()
+            return None
+
+    @staticmethod
+    def rebuild_stats(fix=True):
+        # Compare orders_count/total_spent and units_sold/revenue with the order log,
+        # and the stock of keyed products with their unclaimed keys. Returns the drifted
+        # rows as {'users': [...], 'products': [...], 'stock': [...]}; with fix=True
+        # they are corrected in the same transaction, so no order can slip in between.
+        try:
+            with db_lock:
+                connection = get_connection()
+                connection.execute("BEGIN IMMEDIATE")
+                users = [dict(row) for row in connection.execute(USER_STATS_DRIFT_SQL).fetchall()]
+                products = [dict(row) for row in connection.execute(PRODUCT_STATS_DRIFT_SQL).fetchall()]
+                stock = [dict(row) for row in connection.execute(KEY_STOCK_DRIFT_SQL).fetchall()]
+                if fix:
+                    connection.executemany(
+                        "UPDATE ShopUserTable SET orders_count = ?, total_spent = ? WHERE user_id = ?",
+                        [(row['actual_orders_count'], row['actual_total_spent'], row['user_id']) for row in users]
+                    )
+                    connection.executemany(
+                        "UPDATE ShopProductTable SET units_sold = ?, revenue = ? WHERE productnumber = ?",
+                        [(row['actual_units_sold'], row['actual_revenue'], row['productnumber']) for row in products]
+                    )
+                    connection.executemany(
+                        "UPDATE ShopProductTable SET productquantity = ? WHERE productnumber = ?",
+                        [(row['actual_productquantity'], row['productnumber']) for row in stock]
+                    )
+                    connection.commit()
+                    invalidate_products()
+                    cache.invalidate_prefix(user_cache_key(''))
+                else:
+                    connection.rollback()
+                if users or products or stock:
+                    logger.warning("Stats drift: %s users, %s products, %s key stocks%s", len(users), len(products), len(stock), ' (fixed)' if fix else '')
+                return {'users': users, 'products': products, 'stock': stock}
+        except Exception as e:
+            logger.error("Error rebuilding stats: %s", e)
+            get_connection().rollback()
+            return None
@@ -0,0 +1,137 @@
+"""
+Online backups of the shop database with SQLite's backup API
+"""
+
+import os
+import gzip
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+from config import BotConfig
+from InDMDevDB import DB_FILE, DB_BUSY_TIMEOUT
+import metrics
+
+logger = logging.getLogger(__name__)
+
+backup_seconds = metrics.registry.histogram('bot_db_backup_seconds', 'Time to take, verify and store one database backup',
+                                            [], (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+backup_step_seconds = metrics.registry.histogram('bot_db_backup_step_seconds', 'Longest single backup step per backup',
+                                                 [], metrics.FAST_BUCKETS)
+backup_failures = metrics.registry.counter('bot_db_backup_failures_total', 'Backups that failed or did not pass integrity_check')
+
+class BackupJob:
+    """Periodic, verified, rotated snapshots of DB_FILE that never stop the bot's writers"""
+
+    def __init__(self, source: str = DB_FILE, directory: str = BotConfig.DB_BACKUP_DIR, keep: int = BotConfig.DB_BACKUP_KEEP,
+                 compress: bool = BotConfig.DB_BACKUP_COMPRESS, pages: int = BotConfig.DB_BACKUP_PAGES,
+                 sleep: float = BotConfig.DB_BACKUP_SLEEP, interval: int = BotConfig.DB_BACKUP_INTERVAL):
+        self.source = source
+        self.directory = directory
+        self.keep = keep
+        self.compress = compress
+        self.pages = pages
+        self.sleep = sleep
+        self.interval = interval
+        self.prefix = os.path.splitext(os.path.basename(source))[0] + '-'
+        self.last_result = None
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        metrics.registry.gauge('bot_db_backup_last_success_timestamp', 'Unix time of the last verified backup',
+                               lambda: self.last_result['finished'] if self.last_result and self.last_result['ok'] else 0)
+
+    def run_once(self) -> dict:
+        """Take one backup now; returns its result dict (also kept in last_result)"""
+        with self._run_lock:
+            started = time.perf_counter()
+            result = {'ok': False, 'path': None, 'size': 0, 'pages': 0, 'steps': 0, 'max_step': 0.0,
+                      'duration': 0.0, 'integrity': None, 'finished': time.time()}
+            os.makedirs(self.directory, exist_ok=True)
+            name = self.prefix + datetime.now().strftime('%Y%m%d-%H%M%S') + '.db'
+            temp_path = os.path.join(self.directory, name + '.tmp')
+            try:
+                self._copy(temp_path, result)
+                if result['integrity'] != 'ok':
+                    raise sqlite3.DatabaseError(f"integrity_check failed: {result['integrity']}")
+                final_path = os.path.join(self.directory, name + ('.gz' if self.compress else ''))
+                if self.compress:
+                    with open(temp_path, 'rb') as raw, gzip.open(final_path + '.tmp', 'wb') as packed:
+                        shutil.copyfileobj(raw, packed, 1024 * 1024)
+                    os.remove(temp_path)
+                    temp_path = final_path + '.tmp'
+                os.replace(temp_path, final_path)
+                result['path'] = final_path
+                result['size'] = os.path.getsize(final_path)
+                result['ok'] = True
+                self._rotate()
+            except Exception as e:
+                backup_failures.inc()
+                result['error'] = str(e)
+                logger.error("Database backup failed: %s", e)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            result['duration'] = time.perf_counter() - started
+            result['finished'] = time.time()
+            backup_seconds.observe(result['duration'])
+            backup_step_seconds.observe(result['max_step'])
+            if result['ok']:
+                logger.info("Database backup %s: %s pages in %s steps, %.2fs, longest step %.1f ms",
+                            result['path'], result['pages'], result['steps'], result['duration'], result['max_step'] * 1000)
+            self.last_result = result
+            return result
+
+    def _copy(self, path: str, result: dict):
+        source = sqlite3.connect(self.source, timeout=DB_BUSY_TIMEOUT / 1000)
+        target = sqlite3.connect(path)
+        try:
+            # Pin a read snapshot first. In WAL mode writers carry on meanwhile, and
+            # without the snapshot every commit by another connection would restart
+            # the copy from page one, so a busy bot could keep it from ever finishing.
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            last = time.perf_counter()
+
+            def progress(status, remaining, total):
+                nonlocal last
+                now = time.perf_counter()
+                # a step holds the source's read lock; in rollback-journal mode writers wait that long
+                result['max_step'] = max(result['max_step'], now - last)
+                result['steps'] += 1
+                result['pages'] = total
+                last = now + self.sleep
+
+            source.backup(target, pages=self.pages, progress=progress, sleep=self.sleep)
+            source.rollback()
+            result['integrity'] = target.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            source.close()
+            target.close()
+
+    def _rotate(self):
+        snapshots = sorted(name for name in os.listdir(self.directory)
+                           if name.startswith(self.prefix) and (name.endswith('.db') or name.endswith('.db.gz')))
+        for name in snapshots[:-self.keep] if self.keep > 0 else []:
+            os.remove(os.path.join(self.directory, name))
+            logger.info("Removed old backup %s", name)
+
+    def start(self):
+        """Back up every `interval` seconds on a daemon thread; interval 0 disables it"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="db-backup", daemon=True)
+        self._thread.start()
+        logger.info("Database backups every %ss to %s, keeping %s", self.interval, self.directory, self.keep)
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+# Global backup job
+backup_job = BackupJob()
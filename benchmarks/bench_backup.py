@@ -0,0 +1,87 @@
+"""
+Online backup under write load.
+
+A writer thread keeps committing orders-sized rows while BackupJob snapshots
+the database. Reports the backup's duration, steps and longest step, and the
+writer's commit latency with and without a backup running.
+
+Usage: python benchmarks/bench_backup.py [rows] [pages_per_step]
+"""
+
+import os
+import sys
+import logging
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench_backup.db')
+
+from InDMDevDB import DB_FILE, db_lock, get_connection
+from backup import BackupJob
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+_ordernumbers = iter(range(90000000, 99999999))
+
+
+def write_load(stop, latencies):
+    connection = get_connection()
+    while not stop.is_set():
+        n = next(_ordernumbers)
+        started = time.perf_counter()
+        with db_lock:
+            connection.execute(
+                "INSERT INTO ShopOrderTable (buyerid, productname, productprice, ordernumber, productnumber) VALUES (?, ?, ?, ?, ?)",
+                (n % 1000, "Product", "10", n, 1)
+            )
+            connection.commit()
+        latencies.append(time.perf_counter() - started)
+
+
+def measure(seconds, job=None):
+    stop = threading.Event()
+    latencies = []
+    writer = threading.Thread(target=write_load, args=(stop, latencies))
+    writer.start()
+    result = None
+    if job:
+        result = job.run_once()
+    else:
+        time.sleep(seconds)
+    stop.set()
+    writer.join()
+    return latencies, result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    logging.disable(logging.WARNING)
+
+    connection = get_connection()
+    connection.executemany(
+        "INSERT INTO ShopOrderTable (buyerid, productname, productprice, ordernumber, productnumber) VALUES (?, ?, ?, ?, ?)",
+        ((n % 1000, f"Product {n}", "10", n, 1) for n in range(1, rows + 1))
+    )
+    connection.commit()
+    print(f"database: {os.path.getsize(DB_FILE) / 1e6:.1f} MB, {rows:,} orders, {pages} pages per step")
+
+    job = BackupJob(source=DB_FILE, directory=os.path.join(os.path.dirname(DB_FILE), 'backups'), keep=2, pages=pages)
+    backed_up, result = measure(0, job)
+    idle, _ = measure(result['duration'])
+
+    print(f"backup:  {result['duration']:.2f}s, {result['steps']} steps, longest step {result['max_step'] * 1000:.2f} ms, "
+          f"integrity {result['integrity']}, {result['size'] / 1e6:.1f} MB")
+    for label, latencies in (('no backup', idle), ('during backup', backed_up)):
+        print(f"writer {label:<14} {len(latencies):>7,} commits, p50 {percentile(latencies, 0.5) * 1000:.3f} ms, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.3f} ms, max {max(latencies) * 1000:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Catalog import/export throughput.
+
+Generates a catalog of new products (1 in 50 rows deliberately invalid) as
+CSV and JSONL, imports each through catalog_io.import_catalog, exports the
+catalog back out, then re-imports the CSV export as an update of every
+product. Prints rows/s for each pass and checks the row counts.
+Each run is appended to benchmarks/results/catalog.jsonl.
+
+Usage: python benchmarks/bench_catalog.py [rows]
+"""
+
+import os
+import sys
+import csv
+import json
+import logging
+import tempfile
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+directory = tempfile.mkdtemp()
+os.environ['DB_FILE'] = os.path.join(directory, 'bench_catalog.db')
+
+from catalog_io import CATALOG_COLUMNS, import_catalog, export_catalog
+from InDMDevDB import get_connection
+
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results', 'catalog.jsonl')
+
+
+def catalog_rows(count, prefix):
+    for n in range(count):
+        row = {'productnumber': '', 'productname': f"{prefix} product {n}", 'productprice': str(1 + n % 500),
+               'productquantity': str(n % 100), 'productcategory': f"Category {n % 40}",
+               'productdescription': f"Description of {prefix} product {n}, with a comma.",
+               'productimagelink': '', 'productdownloadlink': f"https://example.com/download/{prefix}/{n}"}
+        if n % 50 == 49:
+            row['productprice'] = 'free'
+        yield row
+
+
+def write_file(path, fmt, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, CATALOG_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                f.write(json.dumps({key: value for key, value in row.items() if value != ''}) + '\n')
+
+
+def timed_import(path, fmt):
+    started = time.perf_counter()
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        result = import_catalog(f, fmt, 1, 'admin')
+    return result, time.perf_counter() - started
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    logging.disable(logging.WARNING)
+    invalid = count // 50
+    passes = {}
+
+    for fmt in ('csv', 'jsonl'):
+        path = os.path.join(directory, f"catalog.{fmt}")
+        write_file(path, fmt, catalog_rows(count, fmt))
+        result, elapsed = timed_import(path, fmt)
+        passes[f"import_{fmt}"] = result['rows'] / elapsed
+        print(f"import {fmt:<5} {result['rows']:>8,} rows in {elapsed:6.2f}s {result['rows'] / elapsed:>9,.0f} rows/s "
+              f"({result['added']:,} added, {len(result['errors']):,} rejected)")
+        if result['added'] != count - invalid or len(result['errors']) != invalid:
+            print("FAIL: unexpected added/rejected counts")
+            sys.exit(1)
+
+    for fmt in ('csv', 'jsonl'):
+        path = os.path.join(directory, f"export.{fmt}")
+        started = time.perf_counter()
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            exported = export_catalog(f, fmt)
+        elapsed = time.perf_counter() - started
+        passes[f"export_{fmt}"] = exported / elapsed
+        print(f"export {fmt:<5} {exported:>8,} rows in {elapsed:6.2f}s {exported / elapsed:>9,.0f} rows/s "
+              f"({os.path.getsize(path) / 1e6:.1f} MB)")
+
+    total = get_connection().execute("SELECT COUNT(*) FROM ShopProductTable").fetchone()[0]
+    result, elapsed = timed_import(os.path.join(directory, 'export.csv'), 'csv')
+    passes['update_csv'] = result['rows'] / elapsed
+    print(f"update csv   {result['rows']:>8,} rows in {elapsed:6.2f}s {result['rows'] / elapsed:>9,.0f} rows/s "
+          f"({result['updated']:,} updated, {len(result['errors']):,} rejected)")
+    if result['updated'] != total or result['errors']:
+        print("FAIL: re-importing the export did not update every product")
+        sys.exit(1)
+
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'a') as f:
+        f.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(), 'rows': count,
+                            'rows_per_s': {name: round(rate) for name, rate in passes.items()}}) + '\n')
+    print(f"ok, saved to {os.path.relpath(RESULTS_FILE, ROOT)}")
+
+
+if __name__ == '__main__':
+    main()
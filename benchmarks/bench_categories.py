@@ -0,0 +1,122 @@
+"""
+Category listing at thousands of categories: the Categories 🏷 screen, built on
+one GROUP BY query, versus the old per-category count lookups.
+
+Drives store_main's Categories handler against the local fake Bot API and
+walks every page of its keyboard (catlist_ callbacks), checking that each
+category with in-stock products is listed exactly once, with the same count
+GetCategoryNumProduct gives (in-stock products only, case-insensitive names).
+The lookups are timed against the first screen's query and rendering, and
+the handler (one sendMessage round trip to the fake API included), with the
+read-through and render caches cleared.
+
+Usage: python benchmarks/bench_categories.py [categories] [products_per_category]
+"""
+
+import os
+import sys
+import json
+import logging
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench_categories.db')
+
+from fake_bot_api import FakeBotAPI
+
+CHAT_ID = 4242
+
+
+def main():
+    categories = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    per_category = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    logging.disable(logging.INFO)
+
+    api = FakeBotAPI().start()
+    os.environ['TELEGRAM_API_URL'] = api.api_url
+    from config import APIConfig
+    # time the screen, not the per-chat flood limit every page edit would wait on
+    APIConfig.TELEGRAM_CHAT_RATE = APIConfig.TELEGRAM_CHAT_BURST = 1e9
+    from telebot import types
+    from InDMDevDB import CreateDatas, GetDataFromDB
+    from render_cache import renders
+    from utils import cache
+    import store_main
+
+    for category in range(categories):
+        for n in range(per_category):
+            # mixed case on purpose, and every fourth product sold out
+            name = f"Category {category}" if n % 2 else f"CATEGORY {category}"
+            CreateDatas.add_product(1, "admin", f"Item {category}-{n}", "", 5, n % 4, name)
+
+    def n_plus_one():
+        counts = {}
+        for catnum, catname in GetDataFromDB.GetCategoryIDsInDB():
+            for ctg in GetDataFromDB.GetCategoryNumProduct(catname.upper()):
+                counts[catnum] = ctg[0]
+        return counts
+
+    chat = {'id': CHAT_ID, 'type': 'private'}
+    user = {'id': CHAT_ID, 'is_bot': False, 'first_name': 'Bench'}
+    message = types.Message.de_json(json.dumps({'message_id': 1, 'date': 0, 'text': 'Categories 🏷', 'chat': chat, 'from': user}))
+
+    def categories_screen():
+        # the handler, then every further page through the Next button's callback
+        store_main.show_categories(message)
+        while True:
+            shown = next(call for call in reversed(api.calls) if 'reply_markup' in call['params'])
+            buttons = json.loads(shown['params']['reply_markup'])['inline_keyboard']
+            following = [button for button in buttons[-1] if button['text'].startswith('Next')]
+            if not following:
+                return
+            store_main.callback_query(types.CallbackQuery.de_json(json.dumps({
+                'id': '1', 'from': user, 'chat_instance': '1', 'data': following[0]['callback_data'],
+                'message': {'message_id': 2, 'date': 0, 'chat': chat, 'from': user, 'text': 'CATEGORIES:'}
+            })))
+
+    def timed(function, rounds=5):
+        best = float('inf')
+        for _ in range(rounds):
+            cache.clear()
+            renders.clear()
+            started = time.perf_counter()
+            result = function()
+            best = min(best, time.perf_counter() - started)
+        return result, best
+
+    expected, slow = timed(n_plus_one)
+    _, render = timed(store_main.render_categories_page)
+    _, handler = timed(lambda: store_main.show_categories(message))
+    cache.clear()
+    renders.clear()
+    api.reset()
+    categories_screen()
+    listed = {}
+    pages = 0
+    for call in api.calls:
+        if 'reply_markup' not in call['params']:
+            continue
+        pages += 1
+        for row in json.loads(call['params']['reply_markup'])['inline_keyboard']:
+            for button in row:
+                if button['callback_data'].startswith('getcats_'):
+                    catnum = int(button['callback_data'].replace('getcats_', ''))
+                    assert catnum not in listed, f"category {catnum} listed twice"
+                    listed[catnum] = int(button['text'].rsplit('(', 1)[1].rstrip(')'))
+    api.stop()
+    ids = GetDataFromDB.GetCategoryIDsInDB()
+
+    print(f"categories={len(ids):,} products={categories * per_category:,}")
+    print(f"per-category lookups: {slow * 1000:.1f} ms ({len(ids) + 1} queries)")
+    print(f"Categories screen:    {render * 1000:.1f} ms (1 query), {handler * 1000:.1f} ms through the handler")
+    print(f"pages walked: {pages} of up to {store_main.BotConfig.CATEGORIES_PER_PAGE} categories")
+    assert len(ids) == categories, "case variants created duplicate categories"
+    assert listed == {catnum: count for catnum, count in expected.items() if count}, "listed counts differ from per-category counts"
+    assert all(count == sum(1 for n in range(per_category) if n % 4) for count in listed.values())
+    print("counts match")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Round trips and bytes for one category view, against the local fake Bot API.
+
+"before" replays the old loop (one send_photo per product, each carrying a
+keyboard with every earlier product's button); "after" is
+CategoriesDatas.get_category_products: the first page, and every page the
+way the Next button asks for them, PRODUCTS_PER_PAGE products each as media
+groups plus that page's BUY keyboard. The default 41 products leave a lone
+photo on the last page, which Telegram (and the fake API) refuse as a media
+group; every page must still end with the BUY keyboard.
+
+Usage: python benchmarks/bench_category_cards.py [products] [without_photo] [latency_ms]
+"""
+
+import os
+import sys
+import json
+import logging
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench_cards.db')
+
+from telebot import apihelper, types
+
+from fake_bot_api import FakeBotAPI
+from InDMDevDB import CreateDatas, GetDataFromDB
+from InDMCategories import CategoriesDatas, bot, StoreCurrency
+from config import BotConfig
+
+CHAT_ID = 4242
+CATEGORY = "Bench Category"
+
+
+def old_category_view(product_list):
+    bot.send_message(CHAT_ID, f"{CATEGORY} Gategory's Products")
+    keyboard = types.InlineKeyboardMarkup()
+    for productnumber, productname, productprice, productdescription, productimagelink, productdownloadlink, productquantity, productcategory in product_list:
+        keyboard.add(types.InlineKeyboardButton(text="BUY NOW 💰", callback_data=f"getproduct_{productnumber}"))
+        bot.send_photo(CHAT_ID, photo=f"{productimagelink}", caption=f"Product ID 🪪: /{productnumber}\n\nProduct Name 📦: {productname}\n\nProduct Price 💰: {productprice} {StoreCurrency}\n\nProducts In Stock 🛍: {productquantity}\n\nProduct Description 💬: {productdescription}", reply_markup=keyboard)
+
+
+def measure(api, view):
+    api.reset()
+    started = time.perf_counter()
+    view()
+    elapsed = time.perf_counter() - started
+    return api.stats(), elapsed
+
+
+def main():
+    products = int(sys.argv[1]) if len(sys.argv) > 1 else 41
+    without_photo = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.05
+    logging.disable(logging.INFO)
+
+    for n in range(products):
+        image = None if n < without_photo else f"AgACAgQAAxkBAAI{n:06d}"
+        CreateDatas.add_product(1, "admin", f"Product {n}", "A short product description.", 10 + n, 5, CATEGORY, image)
+    catnum = GetDataFromDB.Get_A_CategoryNumber(CATEGORY)
+    product_list = GetDataFromDB.GetProductInfoByCTGName(CATEGORY.upper())
+
+    api = FakeBotAPI(latency=latency).start()
+    apihelper.API_URL = api.api_url
+    apihelper.CUSTOM_REQUEST_SENDER = None  # raw round trips, no flood-limit pacing
+    message = types.Message.de_json(json.dumps({
+        'message_id': 1, 'date': 0, 'text': 'x',
+        'chat': {'id': CHAT_ID, 'type': 'private'},
+        'from': {'id': CHAT_ID, 'is_bot': False, 'first_name': 'Bench'}
+    }))
+
+    def all_pages():
+        for offset in range(0, len(product_list), BotConfig.PRODUCTS_PER_PAGE):
+            CategoriesDatas.get_category_products(message, str(catnum), offset)
+            ends.append(api.calls[-1])
+
+    ends = []
+    before, before_time = measure(api, lambda: old_category_view(product_list))
+    first, first_time = measure(api, lambda: CategoriesDatas.get_category_products(message, str(catnum)))
+    ends.append(api.calls[-1])
+    after, after_time = measure(api, all_pages)
+    api.stop()
+
+    print(f"products={products} (without photo: {without_photo}) simulated latency={latency * 1000:.0f} ms")
+    print(f"before:     {before['calls']} round trips, {before['bytes']:,} bytes, {before_time * 1000:.0f} ms  {before['methods']}")
+    print(f"first page: {first['calls']} round trips, {first['bytes']:,} bytes, {first_time * 1000:.0f} ms  {first['methods']}")
+    print(f"all pages:  {after['calls']} round trips, {after['bytes']:,} bytes, {after_time * 1000:.0f} ms  {after['methods']}")
+    if any(end['method'] != 'sendMessage' or 'reply_markup' not in end['params'] for end in ends):
+        print("FAIL: a category page did not end with the BUY keyboard")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Concurrent checkout stress test.
+
+Many buyers race for a product with limited stock through
+UpdateData.checkout. Fails if more units are sold than were in stock, if
+any wallet goes negative, or if money and orders do not add up; prints the
+purchases per second sustained.
+
+Usage: python benchmarks/bench_checkout.py [threads] [stock] [buyers]
+"""
+
+import os
+import sys
+import logging
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench_checkout.db')
+
+from InDMDevDB import CreateDatas, GetDataFromDB, UpdateData, CheckoutStatus, get_connection
+
+PRICE = 7
+START_BALANCE = 50
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    stock = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    buyers = int(sys.argv[3]) if len(sys.argv) > 3 else 400
+    logging.disable(logging.INFO)
+
+    for user_id in range(1, buyers + 1):
+        CreateDatas.add_user(user_id, f"buyer{user_id}")
+        CreateDatas.topup_wallet(user_id, START_BALANCE)
+    CreateDatas.add_product(1, "admin", "Last units", "", PRICE, stock, "Stress")
+    productnumber = GetDataFromDB.get_products()[0]['productnumber']
+
+    results = {}
+    results_lock = threading.Lock()
+
+    def buyer(slot):
+        local = {}
+        user_id = slot % buyers + 1
+        while True:
+            status = UpdateData.checkout(user_id, productnumber, 1, f"buyer{user_id}").status
+            local[status] = local.get(status, 0) + 1
+            if status == CheckoutStatus.OUT_OF_STOCK:
+                break
+            if status == CheckoutStatus.INSUFFICIENT_FUNDS:
+                user_id = (user_id + threads - 1) % buyers + 1
+                if local[status] > buyers:
+                    break
+        with results_lock:
+            for status, count in local.items():
+                results[status] = results.get(status, 0) + count
+
+    workers = [threading.Thread(target=buyer, args=(slot,)) for slot in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    connection = get_connection()
+    sold = connection.execute("SELECT COUNT(*) FROM ShopOrderTable").fetchone()[0]
+    left = GetDataFromDB.get_product_by_id(productnumber)['productquantity']
+    spent = connection.execute("SELECT ? * COUNT(*) - SUM(wallet) FROM ShopUserTable", (START_BALANCE,)).fetchone()[0]
+    negative = connection.execute("SELECT COUNT(*) FROM ShopUserTable WHERE wallet < 0").fetchone()[0]
+
+    print(f"threads={threads} stock={stock} buyers={buyers}")
+    print(f"results: {results}")
+    print(f"orders={sold} stock_left={left} spent={spent} negative_wallets={negative}")
+    print(f"{results.get(CheckoutStatus.OK, 0) / elapsed:,.0f} purchases/s")
+
+    affordable = buyers * (START_BALANCE // PRICE)
+    assert sold == results.get(CheckoutStatus.OK, 0), "order rows do not match successful checkouts"
+    assert sold + left == stock, "oversold"
+    assert sold == min(stock, affordable), "sold a different number of units than possible"
+    assert spent == sold * PRICE, "wallet debits do not match orders"
+    assert negative == 0, "negative wallet balance"
+    print("no oversell")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Read throughput of InDMDevDB on N threads while a writer tops up wallets.
+
+"before" replays the old layout (one shared connection, one cursor, every
+call behind one lock); "after" runs the same get_user query on the per-thread
+WAL connections, past the read-through cache, so both sides measure SQLite.
+"cached" is GetDataFromDB.get_user itself, cache included, for reference.
+
+Usage: python benchmarks/bench_db_reads.py [threads] [seconds]
+"""
+
+import os
+import sys
+import logging
+import sqlite3
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench_reads.db')
+
+from InDMDevDB import CreateDatas, GetDataFromDB, close_connection, get_connection, DB_FILE
+
+USERS = 1000
+
+
+def seed():
+    for user_id in range(1, USERS + 1):
+        CreateDatas.add_user(user_id, f"user{user_id}")
+    for n in range(200):
+        CreateDatas.add_product(1, "admin", f"Product {n}", "", 10, 5, f"Category {n % 10}")
+
+
+def run(read, write, threads, seconds):
+    stop = threading.Event()
+    counts = [0] * threads
+
+    def reader(slot):
+        i = slot
+        while not stop.is_set():
+            read(i % USERS + 1)
+            i += threads
+            counts[slot] += 1
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            write(i % USERS + 1)
+            i += 1
+
+    workers = [threading.Thread(target=reader, args=(slot,)) for slot in range(threads)]
+    workers.append(threading.Thread(target=writer))
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / seconds
+
+
+def legacy_layer():
+    connection = sqlite3.connect(DB_FILE, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=DELETE")
+    cursor = connection.cursor()
+    lock = threading.Lock()
+
+    def read(user_id):
+        with lock:
+            cursor.execute("SELECT * FROM ShopUserTable WHERE user_id = ?", (user_id,))
+            return cursor.fetchone()
+
+    def write(user_id):
+        with lock:
+            cursor.execute("UPDATE ShopUserTable SET wallet = wallet + ? WHERE user_id = ?", (1, user_id))
+            connection.commit()
+
+    return connection, read, write
+
+
+def pooled_read(user_id):
+    # get_user's query without its cache, which would answer almost every read
+    return get_connection().execute("SELECT * FROM ShopUserTable WHERE user_id = ?", (user_id,)).fetchone()
+
+
+def cached_read(user_id):
+    return GetDataFromDB.get_user(user_id)
+
+
+def pooled_write(user_id):
+    CreateDatas.topup_wallet(user_id, 1)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    logging.disable(logging.INFO)
+    seed()
+    close_connection()
+
+    connection, read, write = legacy_layer()
+    before = run(read, write, threads, seconds)
+    connection.close()
+
+    # switch the file back to WAL for the pooled layer
+    sqlite3.connect(DB_FILE).execute("PRAGMA journal_mode=WAL").fetchone()
+    after = run(pooled_read, pooled_write, threads, seconds)
+    cached = run(cached_read, pooled_write, threads, seconds)
+
+    print(f"threads={threads} seconds={seconds}")
+    print(f"before (single cursor + lock): {before:,.0f} reads/s")
+    print(f"after  (per-thread WAL pool):  {after:,.0f} reads/s")
+    print(f"speedup: {after / before:.2f}x")
+    print(f"cached (GetDataFromDB.get_user): {cached:,.0f} reads/s")
+
+
+if __name__ == '__main__':
+    main()
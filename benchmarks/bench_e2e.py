@@ -0,0 +1,270 @@
+"""
+End-to-end load test: simulated users driving the whole bot through /webhook.
+
+Every simulated user sends /start, opens Shop Items, taps a category and a
+product, tops up, pays from the wallet and checks My Orders and Profile.
+The streams of all users are interleaved (each user's own updates stay in
+order) and POSTed to store_main's Flask app, whose workers answer through
+the local fake Bot API.
+
+Reports updates/s, handler latency percentiles, Bot API calls per update and
+time spent in the data layer (InDMDevDB) per update, and fails unless every
+processed product tap offered the "Pay from Wallet" button, the only way
+into checkout from the UI. Each run is appended to
+benchmarks/results/e2e.jsonl together with the commit it ran on, and compared
+with the previous run there.
+
+Telegram's own flood limits and the bot's per-user/global rate limits are
+lifted so the numbers show the bot's throughput, not the configured caps.
+With "flood" as the fourth argument the per-chat flood limits stay in place,
+which shows what a chat that is out of send budget costs the other chats.
+
+Usage: python benchmarks/bench_e2e.py [users] [latency_ms] [workers] [flood]
+"""
+
+import os
+import sys
+import json
+import random
+import logging
+import tempfile
+import threading
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench_e2e.db')
+
+from fake_bot_api import FakeBotAPI
+
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results', 'e2e.jsonl')
+CATEGORIES = 5
+PRODUCTS_PER_CATEGORY = 8
+TOPUP_NANOTON = 100 * 1000000000
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def user_updates(user_id, catnum, productnumber, message_ids):
+    """One user's session, as Bot API update dicts (update_id is added later)"""
+    chat = {'id': user_id, 'type': 'private'}
+    sender = {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+    def message(**fields):
+        return {'message': dict({'message_id': next(message_ids), 'date': int(time.time()), 'chat': chat, 'from': sender}, **fields)}
+
+    def tap(data):
+        bot_message = {'message_id': next(message_ids), 'date': int(time.time()), 'chat': chat,
+                       'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeStoreBot'}, 'text': 'menu'}
+        return {'callback_query': {'id': str(next(message_ids)), 'from': sender, 'chat_instance': str(user_id),
+                                   'message': bot_message, 'data': data}}
+
+    payment = {'currency': 'XTR', 'total_amount': TOPUP_NANOTON, 'invoice_payload': f"topup_{user_id}",
+               'telegram_payment_charge_id': f"charge{user_id}", 'provider_payment_charge_id': f"provider{user_id}"}
+    return [
+        ('start', message(text='/start', entities=[{'type': 'bot_command', 'offset': 0, 'length': 6}])),
+        ('shop_items', message(text='Shop Items 🛒')),
+        ('category', tap(f"getcats_{catnum}")),
+        ('product', tap(f"getproduct_{productnumber}")),
+        ('topup', message(successful_payment=payment)),
+        ('walletpay', tap(f"walletpay_{productnumber}")),
+        ('my_orders', message(text='My Orders 🛍')),
+        ('profile', message(text='Profile 👤')),
+    ]
+
+
+class DataLayerTimer:
+    """Wraps the InDMDevDB data classes to time calls made by each worker"""
+
+    def __init__(self, classes):
+        self._local = threading.local()
+        for cls in classes:
+            for name, member in list(vars(cls).items()):
+                if isinstance(member, staticmethod):
+                    setattr(cls, name, staticmethod(self._wrap(member.__func__)))
+
+    def _wrap(self, func):
+        def timed(*args, **kwargs):
+            depth = getattr(self._local, 'depth', 0)
+            self._local.depth = depth + 1
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.depth = depth
+                if depth == 0:  # nested calls are already inside the outer one
+                    self._local.elapsed = getattr(self._local, 'elapsed', 0.0) + time.perf_counter() - started
+        return timed
+
+    def take(self):
+        """Data-layer seconds this thread spent since the last take()"""
+        elapsed = getattr(self._local, 'elapsed', 0.0)
+        self._local.elapsed = 0.0
+        return elapsed
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def save_result(result):
+    previous = None
+    if os.path.exists(RESULTS_FILE):
+        with open(RESULTS_FILE) as f:
+            lines = [line for line in f if line.strip()]
+        if lines:
+            previous = json.loads(lines[-1])
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+    return previous
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[3] != '0' else None
+    flood = len(sys.argv) > 4 and sys.argv[4] == 'flood'
+    logging.disable(logging.WARNING)
+
+    api = FakeBotAPI(latency=latency).start()
+    os.environ['TELEGRAM_API_URL'] = api.api_url
+    if workers:
+        os.environ['UPDATE_WORKERS'] = str(workers)
+
+    from config import APIConfig, BotConfig
+    APIConfig.TELEGRAM_GLOBAL_RATE = 1e9
+    if not flood:
+        APIConfig.TELEGRAM_CHAT_RATE = APIConfig.TELEGRAM_CHAT_BURST = APIConfig.TELEGRAM_GROUP_RATE = 1e9
+    from utils import RateLimiter
+    import InDMDevDB
+    import store_main
+    store_main.rate_limiter = RateLimiter(1e9, 1e9, 1e9, BotConfig.RATE_LIMIT_MAX_USERS)
+
+    products = []
+    for c in range(CATEGORIES):
+        for p in range(PRODUCTS_PER_CATEGORY):
+            InDMDevDB.CreateDatas.add_product(1, "admin", f"Product {c}-{p}", "A short product description.", 1 + p, users,
+                                              f"Category {c}", f"AgACAgQAAxkBAAI{c:03d}{p:03d}")
+    for catnum, catname in InDMDevDB.GetDataFromDB.GetCategoryIDsInDB():
+        for row in InDMDevDB.GetDataFromDB.GetProductInfoByCTGName(catname.upper()):
+            products.append((catnum, row[0]))
+
+    timer = DataLayerTimer([InDMDevDB.CreateDatas, InDMDevDB.GetDataFromDB, InDMDevDB.UpdateData])
+    handler_times = []
+    db_times = []
+    done_at = {}
+    process = store_main.dispatcher.process
+
+    def timed_process(update):
+        timer.take()
+        started = time.perf_counter()
+        process(update)
+        handler_times.append(time.perf_counter() - started)
+        db_times.append(timer.take())
+        done_at[update.update_id] = time.perf_counter()
+    store_main.dispatcher.process = timed_process
+
+    rng = random.Random(7)
+    message_ids = iter(range(1, 10 ** 9))
+    sessions = []
+    for n in range(users):
+        catnum, productnumber = rng.choice(products)
+        sessions.append(user_updates(100000 + n, catnum, productnumber, message_ids))
+    # interleave users at random while keeping every user's own order
+    stream = []
+    cursors = [0] * users
+    active = list(range(users))
+    while active:
+        i = rng.randrange(len(active))
+        user = active[i]
+        stream.append(sessions[user][cursors[user]])
+        cursors[user] += 1
+        if cursors[user] == len(sessions[user]):
+            active[i] = active[-1]
+            active.pop()
+
+    client = store_main.flask_app.test_client()
+    api.reset()
+    sent_at = {}
+    steps = {}
+    rejected = 0
+    started = time.perf_counter()
+    for update_id, (step, update) in enumerate(stream, 1):
+        body = json.dumps(dict(update, update_id=update_id))
+        sent_at[update_id] = time.perf_counter()
+        steps[update_id] = step
+        response = client.post('/webhook', data=body, content_type='application/json')
+        rejected += response.status_code != 200
+    for work_queue in store_main.dispatcher.queues:
+        work_queue.join()
+    elapsed = time.perf_counter() - started
+
+    calls = api.stats()
+    offered = {call['chat_id'] for call in api.calls if 'walletpay_' in call['params'].get('reply_markup', '')}
+    api.stop()
+    count = len(handler_times)
+    latencies = [done_at[update_id] - sent_at[update_id] for update_id in done_at]
+    step_latency = {}
+    for update_id, done in done_at.items():
+        step_latency.setdefault(steps[update_id], []).append(done - sent_at[update_id])
+    orders = InDMDevDB.get_connection().execute("SELECT COUNT(*) FROM ShopOrderTable").fetchone()[0]
+    product_taps = sum(1 for update_id in done_at if steps[update_id] == 'product')
+
+    result = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'users': users,
+        'updates': len(stream),
+        'workers': len(store_main.dispatcher.queues),
+        'api_latency_ms': latency * 1000,
+        'flood_limits': flood,
+        'updates_per_s': count / elapsed,
+        'handler_ms': {'p50': percentile(handler_times, 0.5) * 1000, 'p95': percentile(handler_times, 0.95) * 1000,
+                       'p99': percentile(handler_times, 0.99) * 1000},
+        'end_to_end_ms': {'p50': percentile(latencies, 0.5) * 1000, 'p95': percentile(latencies, 0.95) * 1000,
+                          'p99': percentile(latencies, 0.99) * 1000},
+        'api_calls_per_update': calls['calls'] / count if count else 0.0,
+        'api_bytes_per_update': calls['bytes'] / count if count else 0.0,
+        'db_ms_per_update': sum(db_times) / count * 1000 if count else 0.0,
+        'rejected': rejected,
+        'orders': orders,
+    }
+
+    print(f"{users:,} users, {len(stream):,} updates, {result['workers']} workers, fake API latency {latency * 1000:.0f} ms"
+          + (", per-chat flood limits on" if flood else ""))
+    print(f"throughput:    {result['updates_per_s']:,.0f} updates/s ({elapsed:.2f}s)")
+    print("handler:       p50 {p50:.2f} ms  p95 {p95:.2f} ms  p99 {p99:.2f} ms".format(**result['handler_ms']))
+    print("end to end:    p50 {p50:.2f} ms  p95 {p95:.2f} ms  p99 {p99:.2f} ms".format(**result['end_to_end_ms']))
+    print(f"Bot API calls: {result['api_calls_per_update']:.2f} per update, {result['api_bytes_per_update']:,.0f} bytes per update")
+    print(f"data layer:    {result['db_ms_per_update']:.3f} ms per update")
+    print(f"orders placed: {orders:,}, rejected updates: {rejected}")
+    print(f"wallet pay:    offered to {len(offered):,} users for {product_taps:,} product taps")
+    for step, values in step_latency.items():
+        print(f"  {step:<11} p50 {percentile(values, 0.5) * 1000:7.2f} ms  p99 {percentile(values, 0.99) * 1000:7.2f} ms")
+    for method, entry in sorted(calls['methods'].items()):
+        print(f"  {method:<20} {entry['calls']:>7,} calls")
+
+    previous = save_result(result)
+    if previous:
+        change = (result['updates_per_s'] / previous['updates_per_s'] - 1) * 100 if previous['updates_per_s'] else 0.0
+        print(f"vs previous run ({previous.get('commit')}, {previous['users']:,} users): {change:+.1f}% updates/s, "
+              f"p99 handler {previous['handler_ms']['p99']:.2f} -> {result['handler_ms']['p99']:.2f} ms")
+    print(f"saved to {os.path.relpath(RESULTS_FILE, ROOT)}")
+    if len(offered) != product_taps:
+        print("FAIL: a product tap did not offer Pay from Wallet")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
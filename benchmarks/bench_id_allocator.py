@@ -0,0 +1,90 @@
+"""
+Collision check and throughput for IDAllocator.
+
+Allocates millions of order numbers from several processes, each running
+several threads, and checks that every ID is unique and within the 8-digit
+format. For comparison it also counts collisions of the previous schemes
+(hash of the current timestamp, and ABS(RANDOM()) % 1000000).
+
+Usage: python benchmarks/bench_id_allocator.py [total] [processes] [threads]
+"""
+
+import os
+import sys
+import logging
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if __name__ == '__main__':
+    # spawned workers inherit this and share the same database
+    os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench_ids.db')
+logging.disable(logging.INFO)
+
+import InDMDevDB
+from utils import InputValidator
+
+
+def allocate(args):
+    count, threads = args
+    allocator = InDMDevDB.IDAllocator('order')
+    per_thread = count // threads
+    chunks = [[] for _ in range(threads)]
+
+    def work(chunk):
+        for _ in range(per_thread):
+            chunk.append(allocator.next_id())
+
+    workers = [threading.Thread(target=work, args=(chunk,)) for chunk in chunks]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return [value for chunk in chunks for value in chunk]
+
+
+def legacy_collisions(count):
+    hashed = set()
+    randoms = set()
+    hash_hits = random_hits = 0
+    for _ in range(count):
+        value = abs(hash(datetime.now().timestamp())) % 1000000
+        hash_hits += value in hashed
+        hashed.add(value)
+        value = random.randrange(1000000)
+        random_hits += value in randoms
+        randoms.add(value)
+    return hash_hits, random_hits
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    started = time.perf_counter()
+    with get_context("spawn").Pool(processes) as pool:
+        batches = pool.map(allocate, [(total // processes, threads)] * processes)
+    elapsed = time.perf_counter() - started
+
+    ids = [value for batch in batches for value in batch]
+    unique = set(ids)
+    invalid = [value for value in (min(ids), max(ids)) if InputValidator.validate_product_number(value) is None]
+    print(f"allocated={len(ids):,} unique={len(unique):,} collisions={len(ids) - len(unique)}")
+    print(f"range={min(ids)}..{max(ids)} processes={processes} threads/process={threads}")
+    print(f"{len(ids) / elapsed:,.0f} ids/s")
+
+    hash_hits, random_hits = legacy_collisions(100000)
+    print(f"previous schemes over 100,000 draws: hash(timestamp) collisions={hash_hits:,}, RANDOM() collisions={random_hits:,}")
+
+    assert len(unique) == len(ids), "duplicate IDs allocated"
+    assert not invalid, "IDs outside the product number format"
+    print("zero collisions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Inline-mode latency and pagination against the fake Bot API.
+
+Seeds a catalog (half the products with a photo: Telegram file_ids, and
+http URLs as a catalog import may set), then sends inline_query
+updates through store_main's /webhook one at a time and waits for each
+answerInlineQuery to reach the fake Bot API:
+
+- cold: first time each query/page is asked after a product write
+- warm: the same queries again; these must not run a single SQLite
+  statement but the catalog version check, at most once per
+  CATALOG_VERSION_POLL seconds (checked with db_profiler's statement counts)
+- pagination: walks next_offset for the empty query and a search and
+  checks every in-stock match comes back exactly once
+- typing: one user types a long query a letter at a time under the
+  production rate limits; every keystroke's query must be answered with
+  results and none may bring a "too fast" message
+
+Fails if warm p99 exceeds WARM_P99_TARGET_MS or cold p99 exceeds
+COLD_P99_TARGET_MS. Both are end to end, so they include the webhook, the
+worker queue and the HTTP round trip to the fake Bot API (about 10 ms on
+its own); the zero-statement check is what proves the cache.
+
+Usage: python benchmarks/bench_inline.py [products] [rounds]
+"""
+
+import os
+import sys
+import json
+import logging
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench_inline.db')
+
+from fake_bot_api import FakeBotAPI
+
+WARM_P99_TARGET_MS = 30
+COLD_P99_TARGET_MS = 50
+QUERIES = ['', 'premium', 'lic', 'family plugin', 'netflix', 'zzz']
+WORDS = ['premium', 'family', 'license', 'plugin', 'account', 'netflix', 'music', 'course', 'bundle', 'voucher']
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    logging.disable(logging.WARNING)
+
+    api = FakeBotAPI().start()
+    os.environ['TELEGRAM_API_URL'] = api.api_url
+    from config import APIConfig, BotConfig
+    APIConfig.TELEGRAM_GLOBAL_RATE = APIConfig.TELEGRAM_CHAT_RATE = APIConfig.TELEGRAM_CHAT_BURST = 1e9
+    from utils import RateLimiter
+    import InDMDevDB
+    import store_main
+    from db_profiler import profiler
+    store_main.rate_limiter = RateLimiter(1e9, 1e9, 1e9, BotConfig.RATE_LIMIT_MAX_USERS)
+
+    rows = []
+    for n in range(count):
+        name = f"{WORDS[n % 10].capitalize()} {WORDS[n * 7 % 10]} {n}"
+        rows.append((n + 1, 1, 'admin', name, f"A {WORDS[n * 3 % 10]} for everyone", 1 + n % 50, n % 7,
+                     f"Category {n % 8}", f"https://cdn.example.com/products/{n}.jpg" if n % 4 == 1 else f"AgACAgQAAx{n:06d}" if n % 2 else None))
+    with InDMDevDB.db_lock:
+        connection = InDMDevDB.get_connection()
+        connection.executemany(
+            "INSERT INTO ShopProductTable (productnumber, admin_id, username, productname, productdescription, productprice, productquantity, productcategory, productimagelink) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        connection.commit()
+    InDMDevDB.invalidate_products()
+    in_stock = sum(1 for row in rows if row[6] > 0)
+
+    client = store_main.flask_app.test_client()
+    update_ids = iter(range(1, 10 ** 9))
+
+    def ask(terms, offset='', user_id=500):
+        """Send one inline query, wait for its answer; returns (seconds, answer params)"""
+        query_id = str(next(update_ids))
+        update = {'update_id': int(query_id), 'inline_query': {
+            'id': query_id, 'from': {'id': user_id, 'is_bot': False, 'first_name': 'Inline'}, 'query': terms, 'offset': offset}}
+        started = time.perf_counter()
+        client.post('/webhook', data=json.dumps(update), content_type='application/json')
+        for work_queue in store_main.dispatcher.queues:
+            work_queue.join()
+        elapsed = time.perf_counter() - started
+        answer = next(call['params'] for call in reversed(api.calls)
+                      if call['method'] == 'answerInlineQuery' and call['params'].get('inline_query_id') == query_id)
+        return elapsed, answer
+
+    def walk(terms):
+        ids, offset, pages, timings = [], '', 0, []
+        while True:
+            elapsed, answer = ask(terms, offset)
+            timings.append(elapsed)
+            ids.extend(result['id'] for result in json.loads(answer['results']))
+            pages += 1
+            offset = answer.get('next_offset', '')
+            if not offset:
+                return ids, pages, timings, answer
+
+    ask('warmup')  # getMe for the deep-link username, first Flask request
+    InDMDevDB.invalidate_products()
+
+    cold = []
+    for terms in QUERIES:
+        for offset in ('', str(BotConfig.INLINE_RESULTS_PER_PAGE)):
+            cold.append(ask(terms, offset if terms else '')[0])
+
+    def statements():
+        # (catalog version checks, every other statement) run so far
+        counts = [0, 0]
+        for row in profiler.summary():
+            if row['phase'] == 'execute':
+                counts['CatalogVersionTable' not in row['statement']] += row['count']
+        return counts
+
+    checks_before, statements_before = statements()
+    warm_started = time.perf_counter()
+    warm = []
+    for _ in range(rounds):
+        for terms in QUERIES:
+            for offset in ('', str(BotConfig.INLINE_RESULTS_PER_PAGE)):
+                warm.append(ask(terms, offset if terms else '')[0])
+    warm_checks, warm_statements = statements()
+    warm_checks, warm_statements = warm_checks - checks_before, warm_statements - statements_before
+    allowed_checks = (time.perf_counter() - warm_started) / InDMDevDB.CATALOG_VERSION_POLL + 1
+
+    InDMDevDB.invalidate_products()
+    browse_ids, browse_pages, browse_timings, answer = walk('')
+    search_ids, search_pages, _, _ = walk('premium')
+    expected_search = len(InDMDevDB.GetDataFromDB.search_products('premium', 0, count)[0])
+    # more queries than the per-user budget of MAX_REQUESTS_PER_MINUTE allows
+    store_main.rate_limiter = RateLimiter(BotConfig.MAX_REQUESTS_PER_MINUTE, BotConfig.MAX_REQUESTS_PER_HOUR,
+                                          BotConfig.MAX_REQUESTS_PER_SECOND_GLOBAL, BotConfig.RATE_LIMIT_MAX_USERS)
+    typed = ('premium ' * 10)[:2 * BotConfig.MAX_REQUESTS_PER_MINUTE]
+    typing = [ask(typed[:length], user_id=501)[1] for length in range(1, len(typed) + 1)]
+    typing_answered = sum(1 for answer in typing if json.loads(answer['results']))
+    typing_messages = sum(1 for call in api.calls if call['method'] == 'sendMessage' and str(call['params'].get('chat_id')) == '501')
+    refused = sum(1 for call in api.calls if call['method'] == 'answerInlineQuery' and 'error' in call)
+    api.stop()
+
+    print(f"{count:,} products ({in_stock:,} in stock), {BotConfig.INLINE_RESULTS_PER_PAGE} results per page, "
+          f"cache_time {answer['cache_time']}s")
+    print(f"cold:  {len(cold):>5} queries  p50 {percentile(cold, 0.5) * 1000:6.2f} ms  p99 {percentile(cold, 0.99) * 1000:6.2f} ms"
+          f"  (target p99 < {COLD_P99_TARGET_MS} ms)")
+    print(f"warm:  {len(warm):>5} queries  p50 {percentile(warm, 0.5) * 1000:6.2f} ms  p99 {percentile(warm, 0.99) * 1000:6.2f} ms"
+          f"  (target p99 < {WARM_P99_TARGET_MS} ms), {warm_statements} SQLite statements, {warm_checks} catalog version checks")
+    print(f"browse: {browse_pages} pages, {len(browse_ids):,} results ({len(set(browse_ids)):,} distinct), "
+          f"p50 {percentile(browse_timings, 0.5) * 1000:.2f} ms per cold page")
+    print(f"search 'premium': {search_pages} pages, {len(search_ids):,} results of {expected_search:,} matches")
+    print(f"typing: {len(typing)} queries from one user, {typing_answered} answered with results, {typing_messages} messages to the user")
+
+    failures = []
+    if percentile(warm, 0.99) * 1000 > WARM_P99_TARGET_MS:
+        failures.append("warm p99 over target")
+    if percentile(cold, 0.99) * 1000 > COLD_P99_TARGET_MS:
+        failures.append("cold p99 over target")
+    if warm_statements or warm_checks > allowed_checks:
+        failures.append("warm queries reached SQLite")
+    if len(browse_ids) != in_stock or len(set(browse_ids)) != in_stock:
+        failures.append("browsing did not return every in-stock product exactly once")
+    if len(search_ids) != expected_search or len(set(search_ids)) != expected_search:
+        failures.append("search pages did not return every match exactly once")
+    if typing_answered != len(typing) or typing_messages:
+        failures.append("keystroke queries were rate limited")
+    if refused:
+        failures.append(f"{refused} inline answers refused by the Bot API")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+License-key import and claiming under load.
+
+Writes a key file (default 1,000,000 keys) and streams it into
+UpdateData.import_keys while buyer threads keep checking out the same
+product. Reports import rate, peak memory growth of the import, the longest
+db_lock hold and checkout latency during the import, then verifies that
+every sold unit claimed exactly one distinct key and that productquantity
+equals the unclaimed key count.
+
+Usage: python benchmarks/bench_keys.py [keys] [buyers]
+"""
+
+import os
+import sys
+import logging
+import resource
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+directory = tempfile.mkdtemp()
+os.environ['DB_FILE'] = os.path.join(directory, 'bench_keys.db')
+
+from InDMDevDB import CreateDatas, GetDataFromDB, UpdateData, CheckoutStatus, get_connection
+from db_profiler import profiler, LOCK
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    keys = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    buyers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    logging.disable(logging.WARNING)
+
+    path = os.path.join(directory, 'keys.txt')
+    with open(path, 'w') as f:
+        for n in range(keys):
+            f.write(f"KEY-{n:08d}-{(n * 2654435761) % 4294967296:08X}\n")
+    CreateDatas.add_product(1, "admin", "License", "", 1, 0, "Keys")
+    productnumber = GetDataFromDB.get_products()[0]['productnumber']
+    UpdateData.import_keys(productnumber, ["SEED-0", "SEED-1"], 'seed.txt')  # something to sell from the start
+    for user_id in range(1, buyers + 1):
+        CreateDatas.add_user(user_id, f"buyer{user_id}")
+        CreateDatas.topup_wallet(user_id, keys)
+
+    done = threading.Event()
+    latencies = []
+    sold = [0]
+    sold_lock = threading.Lock()
+
+    def buyer(user_id):
+        while not done.is_set():
+            started = time.perf_counter()
+            result = UpdateData.checkout(user_id, productnumber, 1, f"buyer{user_id}")
+            latencies.append(time.perf_counter() - started)
+            if result.status == CheckoutStatus.OK:
+                with sold_lock:
+                    sold[0] += 1
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=buyer, args=(user_id,)) for user_id in range(1, buyers + 1)]
+    for thread in threads:
+        thread.start()
+    profiler.reset()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        result = UpdateData.import_keys(productnumber, f, os.path.basename(path))
+    elapsed = time.perf_counter() - started
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    done.set()
+    for thread in threads:
+        thread.join()
+    hold = next(row for row in profiler.summary() if row['statement'] == LOCK and row['phase'] == 'hold')
+
+    connection = get_connection()
+    claimed, distinct = connection.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT productkey) FROM ShopProductKeyTable WHERE ordernumber IS NOT NULL").fetchone()
+    unclaimed = connection.execute(
+        "SELECT COUNT(*) FROM ShopProductKeyTable WHERE productnumber = ? AND ordernumber IS NULL", (productnumber,)).fetchone()[0]
+    stock = connection.execute("SELECT productquantity FROM ShopProductTable WHERE productnumber = ?", (productnumber,)).fetchone()[0]
+    orders = connection.execute("SELECT COUNT(*) FROM ShopOrderTable WHERE productkeys IS NOT NULL").fetchone()[0]
+
+    print(f"{keys:,} keys ({os.path.getsize(path) / 1e6:.1f} MB file), {buyers} buyers checking out meanwhile")
+    print(f"import:   {result['added']:,} added, {result['duplicates']:,} duplicates in {elapsed:.2f}s ({result['added'] / elapsed:,.0f} keys/s)")
+    print(f"memory:   peak RSS grew {rss_growth / 1024:.1f} MB during the import")
+    print(f"db_lock:  longest hold {hold['max'] * 1000:.1f} ms, p99 {hold['p99'] * 1000:.2f} ms")
+    print(f"checkout: {len(latencies):,} during import, p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms, max {max(latencies) * 1000:.1f} ms")
+    print(f"sold {sold[0]:,}: {orders:,} orders with keys, {claimed:,} keys claimed ({distinct:,} distinct), "
+          f"stock {stock:,} vs {unclaimed:,} unclaimed")
+    if not (sold[0] == orders == claimed == distinct and stock == unclaimed):
+        print("FAIL: keys and stock do not add up")
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
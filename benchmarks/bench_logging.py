@@ -0,0 +1,95 @@
+"""
+Cost of a log call on the request thread: old logging setup vs log_setup.
+
+old: basicConfig-style FileHandler + StreamHandler on the root logger and
+     f-string messages, so formatting and the write happen in the caller.
+new: setup_logging(): QueueHandler on the root logger (file and console I/O on
+     the listener thread), lazy %-style messages, and 1-in-N sampling on the
+     per-query InDMDevDB.query logger. Write-path records (orders, wallet,
+     catalog) on InDMDevDB itself are never sampled; the run fails if one is
+     missing from the file.
+
+Console output goes to /dev/null so the terminal does not skew the numbers.
+
+Usage: python benchmarks/bench_logging.py [iterations]
+"""
+
+import os
+import sys
+import logging
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import BotConfig
+import log_setup
+
+
+def per_call(func, iterations):
+    started = time.perf_counter()
+    func(iterations)
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def old_calls(logger):
+    def run(n):
+        for i in range(n):
+            logger.info(f"Order added: Order {i}, Buyer {i % 1000}, Product {i % 50}")
+    return run
+
+
+def new_calls(logger):
+    def run(n):
+        for i in range(n):
+            logger.info("Order added: Order %s, Buyer %s, Product %s", i, i % 1000, i % 50)
+    return run
+
+
+def line_count(path):
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    directory = tempfile.mkdtemp()
+    sys.stderr = open(os.devnull, 'w')
+    root = logging.getLogger()
+
+    old_file = os.path.join(directory, 'old.log')
+    handlers = [logging.FileHandler(old_file), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(log_setup.TEXT_FORMAT))
+        root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    old_query = per_call(old_calls(logging.getLogger('InDMDevDB.query')), iterations)
+    old_db = per_call(old_calls(logging.getLogger('InDMDevDB')), iterations)
+    for handler in handlers:
+        root.removeHandler(handler)
+        handler.close()
+
+    new_file = os.path.join(directory, 'new.log')
+    config = dict(BotConfig.get_log_config(), filename=new_file, level=logging.INFO)
+    log_setup.setup_logging(config)
+    new_query = per_call(new_calls(logging.getLogger('InDMDevDB.query')), iterations)
+    new_db = per_call(new_calls(logging.getLogger('InDMDevDB')), iterations)
+    started = time.perf_counter()
+    log_setup.stop_logging()
+    drain = time.perf_counter() - started
+
+    print(f"{iterations:,} INFO calls per logger, sampling 1 in {config['sample_every']} on {', '.join(config['sampled_loggers'])}")
+    print(f"{'caller thread, per call':<28}{'old':>10}{'new':>10}{'speedup':>10}")
+    for name, old, new in (('InDMDevDB.query (sampled)', old_query, new_query), ('InDMDevDB (every record)', old_db, new_db)):
+        print(f"{name:<28}{old:>7,.0f} ns{new:>7,.0f} ns{old / new:>9.1f}x")
+    print(f"lines written: old {line_count(old_file):,}, new {line_count(new_file):,}; "
+          f"listener drained the rest in {drain * 1000:.0f} ms after the calls returned")
+    with open(new_file, encoding='utf-8') as f:
+        written = sum(1 for line in f if ' - InDMDevDB - ' in line)
+    if written != iterations:
+        print(f"FAIL: {iterations - written:,} InDMDevDB write records were sampled away")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Hot-path cost of the metrics instrumentation.
+
+Times each instrumented primitive against its plain counterpart:
+Histogram.observe, db_profiler's ProfiledLock vs threading.Lock and
+ProfiledConnection vs a plain sqlite3 connection for an indexed point SELECT
+(execute + fetchone), plus rendering /metrics.
+
+Usage: python benchmarks/bench_metrics.py [iterations]
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from db_profiler import ProfiledConnection, ProfiledLock
+
+
+def per_call(func, iterations):
+    started = time.perf_counter()
+    func(iterations)
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def observe(n):
+    histogram = metrics.db_query_seconds
+    for i in range(n):
+        histogram.observe(0.0002, 'SELECT ShopProductTable')
+
+
+def lock_loop(lock):
+    def run(n):
+        for _ in range(n):
+            with lock:
+                pass
+    return run
+
+
+def query_loop(connection):
+    def run(n):
+        for i in range(n):
+            connection.execute("SELECT * FROM ShopProductTable WHERE productnumber = ?", (i % 1000,)).fetchone()
+    return run
+
+
+def make_db(path, factory):
+    connection = sqlite3.connect(path, factory=factory)
+    connection.execute("CREATE TABLE IF NOT EXISTS ShopProductTable(productnumber INTEGER PRIMARY KEY, productname TEXT)")
+    connection.executemany("INSERT OR IGNORE INTO ShopProductTable VALUES (?, ?)", [(i, f"Product {i}") for i in range(1000)])
+    connection.commit()
+    return connection
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    path = os.path.join(tempfile.mkdtemp(), 'bench_metrics.db')
+    plain_db = make_db(path, sqlite3.Connection)
+    timed_db = make_db(path, ProfiledConnection)
+
+    rows = [
+        ('Histogram.observe', per_call(observe, iterations), None),
+        ('lock enter/exit', per_call(lock_loop(ProfiledLock()), iterations), per_call(lock_loop(threading.Lock()), iterations)),
+        ('point SELECT', per_call(query_loop(timed_db), iterations), per_call(query_loop(plain_db), iterations)),
+    ]
+    print(f"{iterations:,} iterations")
+    print(f"{'':<20}{'instrumented':>14}{'plain':>10}{'overhead':>10}")
+    for name, instrumented, plain in rows:
+        if plain is None:
+            print(f"{name:<20}{instrumented:>11,.0f} ns{'':>10}{instrumented:>7,.0f} ns")
+        else:
+            print(f"{name:<20}{instrumented:>11,.0f} ns{plain:>7,.0f} ns{instrumented - plain:>7,.0f} ns")
+
+    # one webhook update: webhook + update + handler histograms, ~2 API calls, ~5 statements, ~1 lock
+    per_update = rows[0][1] * 5 + (rows[1][1] - rows[1][2]) + (rows[2][1] - rows[2][2]) * 5
+    print(f"estimated overhead per update: ~{per_update / 1000:.1f} us")
+
+    started = time.perf_counter()
+    text = metrics.registry.render()
+    print(f"/metrics render: {(time.perf_counter() - started) * 1000:.2f} ms, {len(text):,} bytes")
+
+
+if __name__ == '__main__':
+    main()
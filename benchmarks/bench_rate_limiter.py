@@ -0,0 +1,45 @@
+"""
+Per-update overhead of utils.RateLimiter.
+
+Replays a stream of updates from many users (a few of them spamming)
+through RateLimiter.check and reports the cost per call, the throttle
+counters and that tracked users stay within max_users.
+
+Usage: python benchmarks/bench_rate_limiter.py [updates] [users] [max_users]
+"""
+
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import BotConfig
+from utils import RateLimiter
+
+
+def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    max_users = int(sys.argv[3]) if len(sys.argv) > 3 else BotConfig.RATE_LIMIT_MAX_USERS
+
+    limiter = RateLimiter(BotConfig.MAX_REQUESTS_PER_MINUTE, BotConfig.MAX_REQUESTS_PER_HOUR, 1e9, max_users)
+    rng = random.Random(7)
+    spammers = list(range(1, 11))
+    stream = [rng.choice(spammers) if rng.random() < 0.2 else rng.randrange(1, users + 1) for _ in range(updates)]
+
+    started = time.perf_counter()
+    for user_id in stream:
+        limiter.check(user_id)
+    elapsed = time.perf_counter() - started
+
+    stats = limiter.stats()
+    print(f"updates={updates:,} users={users:,} max_users={max_users:,}")
+    print(f"{elapsed / updates * 1e9:,.0f} ns per check ({updates / elapsed:,.0f} checks/s)")
+    print(f"stats: {stats}")
+    assert stats['tracked_users'] <= max_users, "limiter grew past max_users"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Formatting cost of product cards, catalog pages and keyboards, with and without
+the render cache, and a check that no stale card is ever served.
+
+- render: each view built from scratch (rows already in the read-through
+  cache, so this is the formatting and serialization alone)
+- cached: the same views through render_cache; the steady state must not
+  render anything (no render cache misses) nor run a SQLite statement
+  other than the catalog version check, at most once per
+  CATALOG_VERSION_POLL seconds
+- stale: after every quantity change the card and the admin page must show
+  the new stock, also while reader threads keep hitting the same cards,
+  and within CATALOG_VERSION_POLL of a change made through another
+  connection, as another worker process would
+
+Usage: python benchmarks/bench_render.py [products] [rounds]
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import sqlite3
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench_render.db')
+
+from fake_bot_api import FakeBotAPI
+
+WRITES = 300
+READERS = 4
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    logging.disable(logging.WARNING)
+
+    api = FakeBotAPI().start()
+    os.environ['TELEGRAM_API_URL'] = api.api_url
+    import InDMDevDB
+    import render_cache
+    import store_main
+    from db_profiler import profiler
+
+    with InDMDevDB.db_lock:
+        connection = InDMDevDB.get_connection()
+        connection.executemany(
+            "INSERT INTO ShopProductTable (productnumber, admin_id, username, productname, productdescription, productprice, productquantity, productcategory, productimagelink) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(n, 1, 'admin', f"Premium item {n}", f"Description of item {n}", 1 + n % 50, 1 + n % 9, f"Category {n % 8}",
+              f"AgACAgQAAx{n:06d}" if n % 2 else None) for n in range(1, count + 1)]
+        )
+        connection.commit()
+    InDMDevDB.invalidate_products()
+    numbers = list(range(1, count + 1))
+
+    views = {
+        'main keyboard': (lambda: store_main._build_main_keyboard().to_json(), store_main.create_main_keyboard),
+        'shop page': (lambda: store_main.render_product_page('shop'), lambda: store_main.build_product_page('shop')),
+        'admin page': (lambda: store_main.render_product_page('admin'), lambda: store_main.build_product_page('admin')),
+        'search page': (lambda: store_main.render_search_page('premium', 0), lambda: store_main.build_search_page('premium')),
+        'product card': (lambda: render_cache._render_card(InDMDevDB.GetDataFromDB.get_product_by_id(numbers[7])),
+                         lambda: render_cache.load_product_card(numbers[7])),
+    }
+    for render, cached in views.values():
+        render()
+        cached()
+
+    def statements():
+        # (catalog version checks, every other statement) run so far
+        counts = [0, 0]
+        for row in profiler.summary():
+            if row['phase'] == 'execute':
+                counts['CatalogVersionTable' not in row['statement']] += row['count']
+        return counts
+
+    checks_before, statements_before = statements()
+    steady_started = time.perf_counter()
+    misses_before = render_cache.renders.misses
+    timings = {}
+    for name, (render, cached) in views.items():
+        started = time.perf_counter()
+        for _ in range(rounds):
+            render()
+        rendered = (time.perf_counter() - started) / rounds
+        started = time.perf_counter()
+        for _ in range(rounds):
+            cached()
+        timings[name] = (rendered, (time.perf_counter() - started) / rounds)
+    checks, other = statements()
+    checks, other = checks - checks_before, other - statements_before
+    allowed_checks = (time.perf_counter() - steady_started) / InDMDevDB.CATALOG_VERSION_POLL + 1
+    misses = render_cache.renders.misses - misses_before
+
+    # sequential: every write is visible to the very next read
+    stale = 0
+    rng = random.Random(7)
+    for _ in range(WRITES):
+        productnumber, quantity = rng.choice(numbers[:10]), rng.randint(1, 999)
+        InDMDevDB.UpdateData.update_product_quantity(productnumber, quantity)
+        card = render_cache.load_product_card(productnumber)
+        text, _, _ = store_main.build_product_page('admin')
+        if f"Products In Stock 🛍: {quantity}\n" not in card.caption or f"ID: {productnumber} - Premium item {productnumber} ({quantity} left" not in text:
+            stale += 1
+
+    # concurrent: readers keep the same cards hot while a writer changes them
+    stop = threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            for productnumber in numbers[:10]:
+                render_cache.load_product_card(productnumber)
+            store_main.build_product_page('admin')
+
+    threads = [threading.Thread(target=reader) for _ in range(READERS)]
+    for thread in threads:
+        thread.start()
+    for _ in range(WRITES):
+        InDMDevDB.UpdateData.update_product_quantity(rng.choice(numbers[:10]), rng.randint(1, 999))
+    stop.set()
+    for thread in threads:
+        thread.join()
+    for productnumber in numbers[:10]:
+        quantity = InDMDevDB.get_connection().execute(
+            "SELECT productquantity FROM ShopProductTable WHERE productnumber = ?", (productnumber,)).fetchone()[0]
+        if f"Products In Stock 🛍: {quantity}\n" not in render_cache.load_product_card(productnumber).caption:
+            stale += 1
+
+    # another process: its write bumps the version in the database, not this process's caches
+    render_cache.load_product_card(numbers[0])
+    other_process = sqlite3.connect(InDMDevDB.DB_FILE)
+    other_process.execute("UPDATE ShopProductTable SET productquantity = 4321 WHERE productnumber = ?", (numbers[0],))
+    other_process.commit()
+    other_process.close()
+    time.sleep(InDMDevDB.CATALOG_VERSION_POLL)
+    if "Products In Stock 🛍: 4321\n" not in render_cache.load_product_card(numbers[0]).caption:
+        stale += 1
+    api.stop()
+
+    print(f"{count:,} products, {rounds} rounds per view")
+    print(f"{'view':<15} {'render':>10} {'cached':>10}")
+    for name, (rendered, cached) in timings.items():
+        print(f"{name:<15} {rendered * 1e6:8.1f} us {cached * 1e6:8.1f} us")
+    print(f"steady state: {misses} renders, {other} SQLite statements, {checks} catalog version checks")
+    print(f"stale reads: {stale} ({WRITES} sequential writes, {WRITES} concurrent with {READERS} readers, 1 from another connection)")
+
+    failures = []
+    if misses:
+        failures.append("steady state rendered cards or keyboards")
+    if other or checks > allowed_checks:
+        failures.append("steady state reached SQLite")
+    if stale:
+        failures.append("stale card or page served after a write")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Product search latency over a large catalog.
+
+Fills a scratch database with products whose names, descriptions and
+categories are drawn from a fixed vocabulary (the FTS index is filled by
+the ShopProductTable triggers), then times GetDataFromDB.search_products
+for selective, prefix, multi-word and very common queries, first and later
+pages, with the read-through cache cleared before every query.
+
+Every in-stock match is ranked, so the cost grows with the number of
+matches: selective queries stay under a millisecond, a word found in a
+fifth of the catalog costs tens of milliseconds cold; those results are
+then served from the cache.
+
+Finally checks that the oldest product, the best match for a word, is
+ranked first behind a thousand newer sold-out matches and a thousand newer
+weaker ones, and that the match count covers every in-stock match.
+
+Usage: python benchmarks/bench_search.py [products] [iterations]
+"""
+
+import os
+import sys
+import random
+import logging
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bench_search.db')
+
+from InDMDevDB import GetDataFromDB, get_connection, db_lock, invalidate_products, search_match_expression
+from utils import cache
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'po', 'da', 'fi', 'gu', 'he', 'jo']
+KINDS = ['license', 'account', 'subscription', 'key', 'bundle', 'voucher', 'pack', 'course', 'template', 'plugin']
+ADJECTIVES = ['premium', 'lifetime', 'family', 'pro', 'basic', 'ultimate', 'student', 'business', 'annual', 'monthly']
+
+QUERIES = [
+    ('rare word', 'kalomi'),
+    ('2-letter prefix', 'ka'),
+    ('3-letter prefix', 'kal'),
+    ('two words', 'premium lic'),
+    ('three words', 'lifetime family plugin'),
+    ('common word', 'license'),
+    ('no match', 'zzzzzz'),
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def fill(count):
+    rng = random.Random(3)
+    brands = sorted({''.join(rng.choice(SYLLABLES) for _ in range(3)) for _ in range(3000)})
+    rows = []
+    for n in range(count):
+        brand = rng.choice(brands)
+        name = f"{brand.capitalize()} {rng.choice(ADJECTIVES)} {rng.choice(KINDS)}"
+        description = f"{rng.choice(ADJECTIVES).capitalize()} {rng.choice(KINDS)} for {rng.choice(brands)} users, delivered instantly."
+        rows.append((n + 1, 1, 'admin', name, description, 1 + n % 100, 1 + n % 20, f"{rng.choice(KINDS).capitalize()}s"))
+    with db_lock:
+        connection = get_connection()
+        connection.executemany(
+            "INSERT INTO ShopProductTable (productnumber, admin_id, username, productname, productdescription, productprice, productquantity, productcategory) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        connection.commit()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    logging.disable(logging.WARNING)
+    started = time.perf_counter()
+    fill(count)
+    print(f"{count:,} products indexed in {time.perf_counter() - started:.2f}s")
+    print(f"{'query':<16}{'terms':<24}{'matches':>8}{'page':>5}{'hits':>6}{'p50':>10}{'p99':>10}")
+    for name, terms in QUERIES:
+        matches = get_connection().execute("SELECT COUNT(*) FROM ShopProductSearch WHERE ShopProductSearch MATCH ?",
+                                           (search_match_expression(terms),)).fetchone()[0]
+        for offset in (0, 50):
+            timings = []
+            for _ in range(iterations):
+                cache.clear()
+                t0 = time.perf_counter()
+                rows, _ = GetDataFromDB.search_products(terms, offset, 10)
+                timings.append(time.perf_counter() - t0)
+            p50 = percentile(timings, 0.5)
+            print(f"{name:<16}{terms:<24}{matches:>8,}{offset // 10 + 1:>5}{len(rows):>6}{p50 * 1000:>8.3f}ms{percentile(timings, 0.99) * 1000:>8.3f}ms")
+    cache.clear()
+    GetDataFromDB.search_products('premium lic')
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        GetDataFromDB.search_products('premium lic')
+    print(f"cached repeat: {(time.perf_counter() - t0) / iterations * 1e6:.1f} us")
+
+    # the oldest row matches by name; then sold-out matches, then in-stock description-only ones
+    old_stock = [('Zyxoldstock item', 1)] + [(f'Sold out {n}', 0) for n in range(1000)] + [(f'Newer {n}', 1) for n in range(1000)]
+    with db_lock:
+        connection = get_connection()
+        connection.executemany(
+            "INSERT INTO ShopProductTable (productnumber, admin_id, username, productname, productdescription, productprice, productquantity, productcategory) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(count + n + 1, 1, 'admin', name, 'Zyxoldstock edition', 5, quantity, 'Old') for n, (name, quantity) in enumerate(old_stock)]
+        )
+        connection.commit()
+    invalidate_products()
+    t0 = time.perf_counter()
+    rows, has_next = GetDataFromDB.search_products('zyxoldstock')
+    print(f"oldest best match behind {len(old_stock) - 1:,} newer ones: ranked {'first' if rows and rows[0]['productname'] == 'Zyxoldstock item' else 'lower'}, "
+          f"{rows[0]['matches'] if rows else 0:,} in-stock matches, {(time.perf_counter() - t0) * 1000:.2f} ms")
+    if not rows or rows[0]['productname'] != 'Zyxoldstock item' or rows[0]['matches'] != 1001 or not has_next:
+        print("FAIL: an older match was not ranked, or sold-out matches were counted")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
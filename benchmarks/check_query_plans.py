@@ -0,0 +1,156 @@
+"""
+Check that every query InDMDevDB issues is served by an index.
+
+Each CreateDatas, GetDataFromDB and UpdateData method is called against a
+scratch database with sample arguments, once per branch that issues different
+SQL (keyset cursors, checkout's key claim, ...). The statements it actually
+runs, reads and writes alike, are captured with a trace callback and fed to
+EXPLAIN QUERY PLAN. Any plain table SCAN fails the check.
+
+Usage: python benchmarks/check_query_plans.py
+"""
+
+import os
+import sys
+import inspect
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'check_plans.db')
+
+from InDMDevDB import CreateDatas, GetDataFromDB, UpdateData, get_connection
+from utils import cache
+
+# Sample values for method parameters, by parameter name
+SAMPLE_ARGS = {
+    'user_id': 1,
+    'admin_id': 1,
+    'buyerid': 1,
+    'username': 'buyer',
+    'buyerusername': 'buyer',
+    'productnumber': 1,
+    'productname': 'Sample product',
+    'productdescription': 'Sample description',
+    'productprice': 1,
+    'productquantity': 5,
+    'productcategory': 'Default Category',
+    'productimagelink': None,
+    'productdownloadlink': None,
+    'categoryname': 'Default Category',
+    'categorynumber': 1,
+    'amount': 1,
+    'new_quantity': 5,
+    'quantity': 1,
+    'after': 1,
+    'before': None,
+    'cursor': 1,
+    'terms': 'product',
+    'offset': 0,
+    'limit': 10,
+    'in_stock_only': True,
+    'lines': ['KEY-CHECK-1', 'KEY-CHECK-2'],
+    'source': 'check',
+    'batch_size': 100,
+    'products': [
+        {'productnumber': 1, 'productname': 'Sample product', 'productprice': 1},
+        {'productname': 'New product', 'productprice': 2, 'productcategory': 'New Category'},
+    ],
+    'fix': True,
+}
+
+# Further calls for branches the sample arguments don't reach, by method
+VARIANTS = {
+    'get_orders': [{'cursor': None}],
+    'get_products_page': [{'after': None, 'before': 5}, {'in_stock_only': False}],
+}
+
+# Methods that return or check a whole table by design
+FULL_SCAN_ALLOWED = {
+    'get_products',
+    'GetProductInfo',
+    'rebuild_stats',
+}
+
+# Statements that have no query plan of their own
+NOT_QUERIES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'PRAGMA', '--')
+
+
+def seed():
+    # A buyer who can pay, a keyed product with keys to claim and one order,
+    # so checkout and the cursor branches run all their statements
+    connection = get_connection()
+    connection.execute("INSERT INTO ShopUserTable (user_id, username, wallet) VALUES (1, 'buyer', 1000)")
+    connection.execute("INSERT INTO ShopCategoryTable (categorynumber, categoryname) VALUES (1, 'Default Category')")
+    connection.execute(
+        """INSERT INTO ShopProductTable (productnumber, admin_id, username, productname, productdescription, productprice, productquantity, productcategory, productkeysfile)
+        VALUES (1, 1, 'admin', 'Sample product', 'Sample description', 1, 3, 'Default Category', 'seed')"""
+    )
+    connection.executemany("INSERT INTO ShopProductKeyTable (productnumber, productkey) VALUES (1, ?)", [('KEY-1',), ('KEY-2',), ('KEY-3',)])
+    connection.execute(
+        """INSERT INTO ShopOrderTable (buyerid, buyerusername, productname, productprice, paidmethod, ordernumber, productnumber)
+        VALUES (1, 'buyer', 'Sample product', 1, 'WALLET', 1, 1)"""
+    )
+    connection.commit()
+
+
+def calls():
+    for owner in (CreateDatas, GetDataFromDB, UpdateData):
+        for name, method in inspect.getmembers(owner, inspect.isfunction):
+            if name.startswith('_'):
+                continue  # helpers run inside the public methods' transactions
+            params = inspect.signature(method).parameters
+            args = {name: SAMPLE_ARGS[name] for name in params}
+            yield name, method, args
+            for variant in VARIANTS.get(name, []):
+                yield name, method, {**args, **variant}
+
+
+def captured_queries(method, args):
+    statements = []
+    connection = get_connection()
+    connection.set_trace_callback(statements.append)
+    cache.clear()  # make the read-through layer go to SQLite
+    try:
+        result = method(**args)
+        if inspect.isgenerator(result):
+            list(result)
+    finally:
+        connection.set_trace_callback(None)
+    return [sql for sql in statements if not sql.lstrip().upper().startswith(NOT_QUERIES)]
+
+
+def full_scans(sql):
+    plan = get_connection().execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    # subquery results (already bounded by their own plan) and FTS5 index lookups are fine
+    subqueries = {row['detail'].split()[-1] for row in plan if row['detail'].startswith(('MATERIALIZE', 'CO-ROUTINE'))}
+    return [row['detail'] for row in plan
+            if row['detail'].startswith('SCAN') and 'USING' not in row['detail'] and 'VIRTUAL TABLE INDEX' not in row['detail']
+            and row['detail'].split()[1] not in subqueries]
+
+
+def main():
+    logging.disable(logging.WARNING)  # rebuild_stats reports the drift seed() leaves
+    seed()
+    failures = 0
+    checked = set()
+    for name, method, args in calls():
+        for sql in captured_queries(method, args):
+            shape = (name, ' '.join(sql.split()))
+            if shape in checked:
+                continue
+            checked.add(shape)
+            scans = full_scans(sql)
+            if scans and name not in FULL_SCAN_ALLOWED:
+                failures += 1
+                print(f"FAIL {name}: {shape[1]}\n     {'; '.join(scans)}")
+            else:
+                print(f"ok   {name}: {shape[1]}")
+    if failures:
+        print(f"{failures} of {len(checked)} statements without an index")
+        sys.exit(1)
+    print(f"all {len(checked)} statements use an index")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Local stand-in for api.telegram.org.
+
+Answers every Bot API method with a plausible result, refuses the calls
+Telegram refuses (media groups outside 2-10 items, inline photo results
+whose file_id is a URL) and records each call
+(method, chat, request bytes) so benchmarks can count round trips and
+payload size without touching Telegram.
+
+    api = FakeBotAPI().start()
+    apihelper.API_URL = api.api_url
+    ...
+    print(api.stats())
+    api.stop()
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeStoreBot', 'username': 'fake_store_bot'}
+
+
+class BotAPIError(Exception):
+    """A call the real Bot API would refuse; answered with ok=false and this code"""
+
+    def __init__(self, error_code, description):
+        super().__init__(description)
+        self.error_code = error_code
+        self.description = description
+
+
+class FakeBotAPI:
+    """Threaded HTTP server speaking just enough of the Bot API"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency  # simulated network round trip, seconds
+        self.calls = []
+        self.webhook_url = ''
+        self.updates = []  # pending updates served by getUpdates
+        self._lock = threading.Lock()
+        self._new_update = threading.Condition(self._lock)
+        self._update_id = 0
+        self._message_id = 0
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+            def do_POST(self):
+                api._handle(self)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self):
+        """Value for telebot.apihelper.API_URL"""
+        return self.base_url + "/bot{0}/{1}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls = []
+
+    def stats(self):
+        """Calls and request bytes per method"""
+        with self._lock:
+            calls = list(self.calls)
+        methods = {}
+        for call in calls:
+            entry = methods.setdefault(call['method'], {'calls': 0, 'bytes': 0})
+            entry['calls'] += 1
+            entry['bytes'] += call['bytes']
+        return {
+            'calls': len(calls),
+            'bytes': sum(call['bytes'] for call in calls),
+            'methods': methods
+        }
+
+    def push_update(self, update):
+        """Queue an update dict for getUpdates; update_id is filled in"""
+        with self._lock:
+            self._update_id += 1
+            self.updates.append(dict(update, update_id=self._update_id))
+            self._new_update.notify_all()
+            return self._update_id
+
+    def _get_updates(self, params):
+        # Long polling: confirm everything below offset, wait up to timeout for more
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.time() + float(params.get('timeout') or 0)
+        with self._lock:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            while not self.updates and time.time() < deadline:
+                self._new_update.wait(deadline - time.time())
+            return self.updates[:limit]
+
+    def _next_message_id(self):
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def _message(self, chat_id, **fields):
+        message = {
+            'message_id': self._next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id or 0), 'type': 'private'},
+            'from': BOT_USER
+        }
+        message.update(fields)
+        return message
+
+    def _result(self, method, params):
+        chat_id = params.get('chat_id')
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getWebhookInfo':
+            return {'url': self.webhook_url, 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url', '')
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = ''
+            return True
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'sendMediaGroup':
+            media = json.loads(params.get('media', '[]'))
+            if not 2 <= len(media) <= 10:
+                raise BotAPIError(400, "Bad Request: wrong number of media in the group")
+            return [self._message(chat_id, photo=[{'file_id': item.get('media', ''), 'file_unique_id': 'u', 'width': 1, 'height': 1}])
+                    for item in media]
+        if method == 'answerInlineQuery':
+            for result in json.loads(params.get('results', '[]')):
+                if '://' in result.get('photo_file_id', ''):
+                    raise BotAPIError(400, "Bad Request: wrong file identifier/HTTP URL specified")
+            return True
+        if method == 'sendPhoto':
+            return self._message(chat_id, photo=[{'file_id': params.get('photo', ''), 'file_unique_id': 'u', 'width': 1, 'height': 1}],
+                                 caption=params.get('caption', ''))
+        if method == 'sendDocument':
+            return self._message(chat_id, document={'file_id': 'doc', 'file_unique_id': 'u'})
+        if method.startswith('send') or method.startswith('edit') or method in ('copyMessage', 'forwardMessage'):
+            return self._message(chat_id, text=params.get('text', ''))
+        return True
+
+    def _handle(self, request):
+        parts = urlsplit(request.path)
+        method = parts.path.rsplit('/', 1)[-1]
+        params = dict(parse_qsl(parts.query))
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length) if length else b''
+        if body and request.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            params.update(parse_qsl(body.decode('utf-8')))
+        call = {'method': method, 'chat_id': params.get('chat_id'), 'bytes': len(request.path) + length,
+                'params': params, 'time': time.time()}
+        with self._lock:
+            self.calls.append(call)
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            status, body = 200, {'ok': True, 'result': self._result(method, params)}
+        except BotAPIError as e:
+            call['error'] = e.description
+            status, body = e.error_code, {'ok': False, 'error_code': e.error_code, 'description': e.description}
+        payload = json.dumps(body).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
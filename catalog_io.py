@@ -0,0 +1,144 @@
+"""
+Bulk catalog import and export as CSV or JSONL, one product per row
+"""
+
+import csv
+import json
+import logging
+from typing import IO, Iterable, Iterator, Optional
+
+from config import BotConfig
+from InDMDevDB import GetDataFromDB, UpdateData
+from utils import InputValidator, SecurityUtils
+
+logger = logging.getLogger(__name__)
+
+# Columns read on import and written on export, so an export can be edited and imported back
+CATALOG_COLUMNS = ['productnumber', 'productname', 'productprice', 'productquantity', 'productcategory',
+                   'productdescription', 'productimagelink', 'productdownloadlink']
+FORMATS = ('csv', 'jsonl')
+
+def catalog_format(filename: str) -> Optional[str]:
+    """'csv' or 'jsonl' from a file name, None for anything else"""
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    return extension if extension in FORMATS else None
+
+def read_rows(stream: IO[str], fmt: str) -> Iterator[tuple]:
+    """(line number, row dict or None, parse error or None) for each record of a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        try:
+            for row in reader:
+                yield reader.line_num, row, None
+        except csv.Error as e:
+            yield reader.line_num, None, f"unreadable CSV: {e}"
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "expected a JSON object"
+            continue
+        yield line_number, row, None
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+def validate_row(row: dict) -> tuple:
+    """(product dict for UpdateData.upsert_products, None) or (None, error message)"""
+    product = {}
+    productnumber = _text(row.get('productnumber'))
+    if productnumber is not None:
+        product['productnumber'] = InputValidator.validate_product_number(productnumber)
+        if product['productnumber'] is None:
+            return None, f"invalid productnumber {productnumber!r}"
+    else:
+        product['productnumber'] = None
+    name = InputValidator.sanitize_text(_text(row.get('productname')), BotConfig.MAX_PRODUCT_NAME_LENGTH)
+    if not name:
+        return None, "productname is required"
+    product['productname'] = name
+    price = InputValidator.validate_price(_text(row.get('productprice')))
+    if price is None or not price.is_integer():
+        return None, f"invalid productprice {row.get('productprice')!r} (whole number, 0 or more)"
+    product['productprice'] = int(price)
+    quantity = _text(row.get('productquantity'))
+    product['productquantity'] = None
+    if quantity is not None:
+        product['productquantity'] = InputValidator.validate_quantity(quantity)
+        if product['productquantity'] is None:
+            return None, f"invalid productquantity {quantity!r}"
+    product['productcategory'] = InputValidator.sanitize_text(_text(row.get('productcategory')), BotConfig.MAX_PRODUCT_NAME_LENGTH)
+    product['productdescription'] = InputValidator.sanitize_text(_text(row.get('productdescription')), BotConfig.MAX_PRODUCT_DESCRIPTION_LENGTH)
+    product['productimagelink'] = _text(row.get('productimagelink'))
+    link = _text(row.get('productdownloadlink'))
+    if link is not None and not SecurityUtils.is_valid_url(link):
+        return None, f"invalid productdownloadlink {link!r}"
+    product['productdownloadlink'] = link
+    return product, None
+
+def import_catalog(stream: IO[str], fmt: str, admin_id: int, username: str, batch_size: int = BotConfig.CATALOG_IMPORT_BATCH) -> dict:
+    """Validate and upsert every row of a CSV/JSONL text stream in chunks of batch_size.
+
+    Returns {'rows', 'added', 'updated', 'errors': [(line number, message)]}.
+    """
+    result = {'rows': 0, 'added': 0, 'updated': 0, 'errors': []}
+    seen = set()
+    batch, lines = [], []
+
+    def flush():
+        written = UpdateData.upsert_products(batch, admin_id, username)
+        if written is None:
+            result['errors'].extend((line, "database error, chunk not saved") for line in lines)
+            return
+        result['added'] += written['added']
+        result['updated'] += written['updated']
+        result['errors'].extend((lines[index], f"unknown productnumber {batch[index]['productnumber']} (leave it empty to add a product)")
+                                for index in written['missing'])
+
+    for line, row, error in read_rows(stream, fmt):
+        result['rows'] += 1
+        if error is None:
+            product, error = validate_row(row)
+        if error is None and product['productnumber'] is not None:
+            if product['productnumber'] in seen:
+                error = f"productnumber {product['productnumber']} appears more than once"
+            seen.add(product['productnumber'])
+        if error is not None:
+            result['errors'].append((line, error))
+            continue
+        batch.append(product)
+        lines.append(line)
+        if len(batch) >= batch_size:
+            flush()
+            batch, lines = [], []
+    if batch:
+        flush()
+    logger.info("Catalog import: %s rows, %s added, %s updated, %s errors",
+                result['rows'], result['added'], result['updated'], len(result['errors']))
+    return result
+
+def export_catalog(stream: IO[str], fmt: str, products: Iterable = None) -> int:
+    """Write the catalog (or the given product rows) to a text stream; returns the number of rows"""
+    products = GetDataFromDB.iter_products() if products is None else products
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(CATALOG_COLUMNS)
+        for product in products:
+            writer.writerow([product[column] for column in CATALOG_COLUMNS])
+            count += 1
+    else:
+        for product in products:
+            stream.write(json.dumps({column: product[column] for column in CATALOG_COLUMNS}, ensure_ascii=False) + '\n')
+            count += 1
+    return count
@@ -14,7 +14,8 @@ class BotConfig:
     
     # Bot Settings
     BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-    WEBHOOK_URL = os.getenv('NGROK_HTTPS_URL')
+    BOT_MODE = os.getenv('BOT_MODE', 'webhook')  # 'webhook' (Flask) or 'polling' (getUpdates)
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL') or os.getenv('NGROK_HTTPS_URL')
     
     # Store Settings
     STORE_CURRENCY = os.getenv('STORE_CURRENCY', 'USD')
@@ -22,7 +23,12 @@ class BotConfig:
     
     # Database Settings
     DB_FILE = 'InDMDevDBShop.db'
-    DB_BACKUP_INTERVAL = 3600  # 1 hour in seconds
+    DB_BACKUP_INTERVAL = int(os.getenv('DB_BACKUP_INTERVAL', 3600))  # seconds between backups, 0 disables them
+    DB_BACKUP_DIR = os.getenv('DB_BACKUP_DIR', 'backups')
+    DB_BACKUP_KEEP = int(os.getenv('DB_BACKUP_KEEP', 7))  # snapshots kept, oldest are deleted
+    DB_BACKUP_COMPRESS = os.getenv('DB_BACKUP_COMPRESS', 'false').lower() in ('1', 'true', 'yes')  # gzip snapshots
+    DB_BACKUP_PAGES = 256  # pages copied per backup step
+    DB_BACKUP_SLEEP = 0.005  # seconds to yield between steps
     
     # Payment Settings
     NOWPAYMENTS_API_BASE = 'https://api.nowpayments.io/v1'
@@ -32,25 +38,46 @@ class BotConfig:
     MAX_LOGIN_ATTEMPTS = 5
     SESSION_TIMEOUT = 3600  # 1 hour
     
+    # Conversation State Settings
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')  # 'memory' or 'sqlite' (survives restarts, shared by processes)
+    CONVERSATION_STATE_TTL = 1800  # idle admin flows expire after 30 minutes
+    
     # File Upload Settings
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
     ALLOWED_FILE_TYPES = ['.txt', '.pdf', '.doc', '.docx']
     UPLOAD_FOLDER = 'uploads'
     KEYS_FOLDER = 'Keys'
     
+    # Update Processing
+    UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 4))
+    UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', 1000))  # queued updates per worker
+    POLLING_TIMEOUT = 30  # seconds a getUpdates call waits for new updates
+    POLLING_LIMIT = 100  # updates per getUpdates batch
+    
     # Rate Limiting
     MAX_REQUESTS_PER_MINUTE = 30
     MAX_REQUESTS_PER_HOUR = 1000
+    MAX_REQUESTS_PER_SECOND_GLOBAL = 200  # all users together
+    RATE_LIMIT_MAX_USERS = 10000  # users tracked before the least recently seen is forgotten
+    
+    # Query Profiler Settings
+    SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', 100))  # statements slower than this are logged with their plan
+    QUERY_STATS_WINDOW = 1000  # recent timings kept per statement for p99
     
     # Logging Settings
     LOG_LEVEL = logging.INFO
     LOG_FILE = 'bot.log'
     LOG_MAX_SIZE = 10 * 1024 * 1024  # 10MB
     LOG_BACKUP_COUNT = 5
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # 'text' or 'json' (one JSON object per line)
+    LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', 100))  # keep 1 in N INFO records of each message from chatty loggers
+    LOG_SAMPLED_LOGGERS = ['InDMDevDB.query', 'health']  # per-query and health-check logs; never the write-path (money, audit) loggers
     
     # Cache Settings
     CACHE_TTL = 300  # 5 minutes
     CACHE_MAX_SIZE = 1000
+    RENDER_CACHE_SIZE = 5000  # pre-rendered product cards and keyboards
+    RENDER_CACHE_TTL = 86400  # entries are keyed by catalog version, so this only bounds idle memory
     
     # Message Settings
     MAX_MESSAGE_LENGTH = 4096
@@ -61,6 +88,13 @@ class BotConfig:
     MAX_CATEGORIES = 50
     MAX_PRODUCT_NAME_LENGTH = 100
     MAX_PRODUCT_DESCRIPTION_LENGTH = 1000
+    PRODUCTS_PER_PAGE = 10
+    CATEGORIES_PER_PAGE = 20
+    ORDERS_PER_PAGE = 10
+    INLINE_RESULTS_PER_PAGE = 20  # Telegram allows up to 50 per answerInlineQuery
+    INLINE_CACHE_TIME = 300  # seconds Telegram may serve an inline answer without asking again
+    CATALOG_IMPORT_BATCH = 500  # products written per transaction by a catalog import
+    CATALOG_ERRORS_SHOWN = 100  # rejected rows listed in the import reply
     
     # Order Settings
     ORDER_TIMEOUT = 1800  # 30 minutes
@@ -74,8 +108,11 @@ class BotConfig:
         if not cls.BOT_TOKEN:
             errors.append("TELEGRAM_BOT_TOKEN is not set")
         
-        if not cls.WEBHOOK_URL:
-            errors.append("NGROK_HTTPS_URL is not set")
+        if cls.BOT_MODE not in ('webhook', 'polling'):
+            errors.append(f"BOT_MODE must be 'webhook' or 'polling', not '{cls.BOT_MODE}'")
+        
+        if cls.BOT_MODE == 'webhook' and not cls.WEBHOOK_URL:
+            errors.append("WEBHOOK_URL (or NGROK_HTTPS_URL) is not set")
         
         if errors:
             raise ValueError(f"Configuration errors: {', '.join(errors)}")
@@ -94,7 +131,10 @@ class BotConfig:
             'level': cls.LOG_LEVEL,
             'filename': cls.LOG_FILE,
             'maxBytes': cls.LOG_MAX_SIZE,
-            'backupCount': cls.LOG_BACKUP_COUNT
+            'backupCount': cls.LOG_BACKUP_COUNT,
+            'format': cls.LOG_FORMAT,
+            'sample_every': cls.LOG_SAMPLE_EVERY,
+            'sampled_loggers': cls.LOG_SAMPLED_LOGGERS
         }
 
 class APIConfig:
@@ -112,6 +152,17 @@ class APIConfig:
     MAX_RETRIES = 3
     RETRY_DELAY = 1  # seconds
     
+    # Telegram Bot API limits
+    TELEGRAM_GLOBAL_RATE = 30  # messages per second across all chats
+    TELEGRAM_CHAT_RATE = 1  # messages per second to one private chat
+    TELEGRAM_CHAT_BURST = 3
+    TELEGRAM_GROUP_RATE = 20 / 60  # messages per second to one group
+    TELEGRAM_POOL_SIZE = 16  # keep-alive connections to api.telegram.org
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # e.g. http://127.0.0.1:8081/bot{0}/{1} for a local Bot API server
+    TELEGRAM_FILE_URL = os.getenv('TELEGRAM_FILE_URL')  # e.g. http://127.0.0.1:8081/file/bot{0}/{1}
+    TELEGRAM_DOWNLOAD_TIMEOUT = 60  # seconds without data before a streamed file download gives up
+    WEBHOOK_RETRY_MAX_DELAY = 60  # seconds between webhook registration attempts, at most
+    
     @classmethod
     def get_headers(cls, api_key=None):
         """Get standard API headers"""
@@ -0,0 +1,224 @@
+"""
+Query profiler for InDMDevDB: lock, execute, fetch and commit timings per statement
+"""
+
+import re
+import time
+import sqlite3
+import logging
+import threading
+from collections import deque
+
+from config import BotConfig
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_STATEMENTS = 1000  # distinct statements tracked; the rest are pooled under OTHER
+OTHER = 'other'
+LOCK = 'db_lock'
+COMMIT = 'COMMIT'
+PLAN_LOG_INTERVAL = 300  # seconds before the same slow statement logs its plan again
+
+_STATEMENT_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(\w+)', re.IGNORECASE)
+
+class StatementStats:
+    """Count, total and max for one (statement, phase), plus a window of recent timings for p99"""
+
+    __slots__ = ('count', 'total', 'max', 'recent')
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.recent.append(elapsed)
+
+    def summary(self) -> dict:
+        recent = sorted(self.recent)
+        return {
+            'count': self.count,
+            'total': self.total,
+            'avg': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p99': recent[min(len(recent) - 1, int(0.99 * len(recent)))] if recent else 0.0
+        }
+
+class QueryProfiler:
+    """Rolling per-statement stats and the slow-query log, fed by ProfiledConnection and ProfiledLock"""
+
+    def __init__(self, slow_threshold: float = BotConfig.SLOW_QUERY_MS / 1000, window: int = BotConfig.QUERY_STATS_WINDOW):
+        self.slow_threshold = slow_threshold
+        self.window = window
+        self.stats = {}  # (statement, phase) -> StatementStats
+        self._keys = {}  # raw SQL -> (normalized statement, metrics label)
+        self._plans_logged = {}  # statement -> time its plan was last logged
+        self._lock = threading.Lock()
+
+    def statement(self, sql: str) -> tuple:
+        """(normalized SQL, low-cardinality metrics label such as 'SELECT ShopProductTable')"""
+        key = self._keys.get(sql)
+        if key is None:
+            normalized = ' '.join(sql.split())
+            verb = normalized.split(' ', 1)[0].upper()
+            table = _STATEMENT_TABLE.search(normalized)
+            key = (normalized, f"{verb} {table.group(1)}" if table else verb)
+            if len(self._keys) < MAX_STATEMENTS:
+                self._keys[sql] = key
+            else:
+                key = (OTHER, key[1])
+        return key
+
+    def record(self, statement: str, label: str, phase: str, elapsed: float):
+        metrics.db_query_seconds.observe(elapsed, label, phase)
+        self.add(statement, phase, elapsed)
+
+    def add(self, statement: str, phase: str, elapsed: float):
+        with self._lock:
+            stats = self.stats.get((statement, phase))
+            if stats is None:
+                stats = self.stats[(statement, phase)] = StatementStats(self.window)
+            stats.add(elapsed)
+
+    def check_slow(self, connection, sql: str, parameters, statement: str, elapsed: float, fetch: float = 0.0):
+        """Log a statement whose execute + fetch time went over the threshold, with its plan (parameters None: no plan)"""
+        total = elapsed + fetch
+        if total < self.slow_threshold:
+            return
+        now = time.time()
+        with self._lock:
+            plan_due = now - self._plans_logged.get(statement, 0) > PLAN_LOG_INTERVAL
+            if plan_due:
+                self._plans_logged[statement] = now
+        plan = ''
+        if plan_due and parameters is not None and statement.split(' ', 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            try:
+                rows = sqlite3.Connection.execute(connection, f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+                plan = ' | plan: ' + '; '.join(row[3] for row in rows)
+            except sqlite3.Error as e:
+                plan = f" | plan unavailable: {e}"
+        logger.warning("Slow query %.1f ms (execute %.1f ms, fetch %.1f ms): %s%s", total * 1000, elapsed * 1000, fetch * 1000, statement, plan)
+
+    def summary(self, limit: int = None) -> list:
+        """Per-statement stats, slowest total first: dicts with statement, phase, count, total, avg, max, p99"""
+        with self._lock:
+            items = [(statement, phase, stats.summary()) for (statement, phase), stats in self.stats.items()]
+        rows = [dict(summary, statement=statement, phase=phase) for statement, phase, summary in items]
+        rows.sort(key=lambda row: row['total'], reverse=True)
+        return rows[:limit] if limit else rows
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+# Global profiler instance
+profiler = QueryProfiler()
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that times execute and fetch separately"""
+
+    def execute(self, sql, parameters=()):
+        self._statement, self._label = profiler.statement(sql)
+        self._sql = sql
+        self._parameters = parameters
+        self._fetch = 0.0
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed = time.perf_counter() - started
+            profiler.record(self._statement, self._label, 'execute', self._elapsed)
+            profiler.check_slow(self.connection, sql, parameters, self._statement, self._elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        statement, label = profiler.statement(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            profiler.record(statement, label, 'execute', elapsed)
+            profiler.check_slow(self.connection, sql, None, statement, elapsed)
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            statement = getattr(self, '_statement', None)
+            if statement is not None:
+                profiler.record(statement, self._label, 'fetch', elapsed)
+                # only report execute + fetch once it crosses the threshold, not on every row after
+                before = self._elapsed + self._fetch
+                self._fetch += elapsed
+                if before < profiler.slow_threshold:
+                    profiler.check_slow(self.connection, self._sql, self._parameters, statement, self._elapsed, self._fetch)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+class ProfiledConnection(sqlite3.Connection):
+    """sqlite3 connection factory: every statement and commit goes through the profiler"""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            profiler.record(COMMIT, COMMIT, 'commit', time.perf_counter() - started)
+
+class ProfiledLock:
+    """threading.Lock that records how long callers wait for it and hold it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            # only the holder writes _acquired_at, so no extra locking is needed
+            self._acquired_at = time.perf_counter()
+            waited = self._acquired_at - started
+            metrics.db_lock_wait_seconds.observe(waited)
+            profiler.add(LOCK, 'wait', waited)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        metrics.db_lock_hold_seconds.observe(held)
+        profiler.add(LOCK, 'hold', held)
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
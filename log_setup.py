@@ -0,0 +1,98 @@
+"""
+Process-wide logging: a queue handler on the request threads, file/console I/O on a listener thread
+"""
+
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+from config import BotConfig
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, thread, message and any traceback"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """Pass the first and then every Nth INFO/DEBUG record of each message template; warnings always pass"""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self.seen = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.every == 1:
+            return True
+        key = (record.name, record.msg)
+        # unlocked on purpose: a lost increment only shifts which record is sampled
+        count = self.seen.get(key, 0)
+        self.seen[key] = count + 1
+        return count % self.every == 0
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() formats the message on the calling thread; keep that
+    # on the listener, only resolving args that may change after the call returns
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging(config: dict = None):
+    """Install the queue handler and start the listener once per process; later calls are no-ops"""
+    global _listener
+    if _listener is not None:
+        return
+    config = config or BotConfig.get_log_config()
+    formatter = JsonFormatter() if config['format'] == 'json' else logging.Formatter(TEXT_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(config['filename'], maxBytes=config['maxBytes'],
+                                                        backupCount=config['backupCount'], encoding='utf-8')
+    console_handler = logging.StreamHandler()
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config['level'])
+
+    sampler = SamplingFilter(config['sample_every'])
+    for name in config['sampled_loggers']:
+        logging.getLogger(name).addFilter(sampler)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush everything queued and stop the listener"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,172 @@
+"""
+In-process metrics in the Prometheus text exposition format
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from typing import Callable, Sequence
+
+# Seconds; request-level work (updates, handlers, Bot API calls)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Seconds; SQLite statements and db_lock waits
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = list(self.values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self.series.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ('le',)
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Gauge:
+    """Value read from a callback at scrape time, so it costs nothing on the hot path"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), callback: Callable = None, kind: str = 'gauge'):
+        # callback() returns a number, or {label values tuple: number} when labelnames are set;
+        # kind='counter' for totals another component already keeps (cache hits, ...)
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        values = self.callback()
+        if not self.labelnames:
+            values = {(): values}
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+class Registry:
+    """Named collection of metrics rendered together for /metrics"""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # re-registering a name replaces it (gauges bound to a new object, module reloads)
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, callback: Callable, labelnames: Sequence[str] = (), kind: str = 'gauge') -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback, kind))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+# Global registry
+registry = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+update_seconds = registry.histogram('bot_update_seconds', 'Time to process one update on a worker, by update type', ['type'])
+handler_seconds = registry.histogram('bot_handler_seconds', 'Time spent in each bot handler', ['handler'])
+webhook_seconds = registry.histogram('bot_webhook_request_seconds', 'Time to accept a webhook request', ['status'], FAST_BUCKETS)
+db_lock_wait_seconds = registry.histogram('bot_db_lock_wait_seconds', 'Time spent waiting for db_lock', [], FAST_BUCKETS)
+db_lock_hold_seconds = registry.histogram('bot_db_lock_hold_seconds', 'Time db_lock was held', [], FAST_BUCKETS)
+db_query_seconds = registry.histogram('bot_db_query_seconds', 'SQLite statement time, by statement kind and table and phase (execute, fetch, commit)', ['statement', 'phase'], FAST_BUCKETS)
+api_request_seconds = registry.histogram('bot_api_request_seconds', 'Bot API request latency, by method', ['method'])
+api_errors = registry.counter('bot_api_errors_total', 'Failed Bot API requests, by method', ['method'])
+api_throttled = registry.counter('bot_api_throttled_total', 'Bot API 429 responses, by method', ['method'])
+
+def instrument_handlers(bot):
+    """Time every handler registered on a TeleBot so far, labelled with its function name"""
+    for attribute in dir(bot):
+        if not attribute.endswith('_handlers'):
+            continue
+        handlers = getattr(bot, attribute)
+        if not isinstance(handlers, list):
+            continue
+        for handler in handlers:
+            if isinstance(handler, dict) and callable(handler.get('function')) and not getattr(handler['function'], '_timed', False):
+                handler['function'] = _timed_handler(handler['function'])
+
+def _timed_handler(function):
+    name = getattr(function, '__name__', 'handler')
+
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+    timed._timed = True
+    timed.__name__ = name
+    return timed
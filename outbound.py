@@ -0,0 +1,183 @@
+"""
+Rate-limited, retrying sender for all outgoing Telegram Bot API requests
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from telebot import apihelper
+
+from config import APIConfig
+import metrics
+from utils import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Methods that deliver or change a message and count against Telegram's flood limits
+THROTTLED_PREFIXES = ('send', 'copyMessage', 'forwardMessage', 'editMessage')
+# Methods that are safe to repeat after a 5xx, which may come after Telegram acted on
+# the request: reads, and answers Telegram accepts only once per query
+RETRY_5XX_PREFIXES = ('get', 'answerCallbackQuery', 'answerInlineQuery')
+MAX_CHAT_BUCKETS = 10000
+
+def _not_sent(error: requests.RequestException) -> bool:
+    """True if the request failed before any of it reached Telegram, so sending it again cannot duplicate it"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # refused, unreachable, DNS: requests wraps urllib3's MaxRetryError, whose reason is the connect error
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+class OutboundSender:
+    """Bot API request sender: global and per-chat token buckets, 429/connect retries (5xx for safe methods), one keep-alive session"""
+
+    def __init__(self, max_retries: int = APIConfig.MAX_RETRIES, retry_delay: float = APIConfig.RETRY_DELAY):
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=APIConfig.TELEGRAM_POOL_SIZE, pool_maxsize=APIConfig.TELEGRAM_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.global_bucket = TokenBucket(APIConfig.TELEGRAM_GLOBAL_RATE, APIConfig.TELEGRAM_GLOBAL_RATE)
+        self.chat_buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0  # 429 responses
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.wait_total = 0.0  # time spent in our own buckets
+
+    def install(self):
+        """Route every TeleBot instance in this process through this sender"""
+        apihelper.CUSTOM_REQUEST_SENDER = self
+        if APIConfig.TELEGRAM_API_URL:
+            apihelper.API_URL = APIConfig.TELEGRAM_API_URL
+        if APIConfig.TELEGRAM_FILE_URL:
+            apihelper.FILE_URL = APIConfig.TELEGRAM_FILE_URL
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        chat_id = str(chat_id)  # telebot passes some chat_ids as str, some as int
+        with self._lock:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                if chat_id.startswith('-'):
+                    bucket = TokenBucket(APIConfig.TELEGRAM_GROUP_RATE, 1)
+                else:
+                    bucket = TokenBucket(APIConfig.TELEGRAM_CHAT_RATE, APIConfig.TELEGRAM_CHAT_BURST)
+                self.chat_buckets[chat_id] = bucket
+                if len(self.chat_buckets) > MAX_CHAT_BUCKETS:
+                    self.chat_buckets.popitem(last=False)
+            else:
+                self.chat_buckets.move_to_end(chat_id)
+            return bucket
+
+    def chat_delay(self, chat_id) -> float:
+        """Seconds until a message to chat_id would go out without waiting on the chat's bucket"""
+        with self._lock:
+            bucket = self.chat_buckets.get(str(chat_id))
+        return bucket.delay() if bucket is not None else 0.0
+
+    def _throttle(self, method_name: str, params) -> float:
+        if not method_name.startswith(THROTTLED_PREFIXES):
+            return 0.0
+        waited = 0.0
+        chat_id = params.get('chat_id') if params else None
+        if chat_id is not None:
+            waited += self._chat_bucket(chat_id).acquire()
+        waited += self.global_bucket.acquire()
+        return waited
+
+    def _record(self, method_name: str, latency: float, waited: float, error: bool = False, throttled: bool = False, retried: bool = False):
+        metrics.api_request_seconds.observe(latency, method_name)
+        if error:
+            metrics.api_errors.inc(method_name)
+        if throttled:
+            metrics.api_throttled.inc(method_name)
+        with self._lock:
+            self.requests += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.wait_total += waited
+            self.errors += error
+            self.throttled += throttled
+            self.retries += retried
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        method_name = url.rsplit('/', 1)[-1]
+        for attempt in range(self.max_retries + 1):
+            waited = self._throttle(method_name, params)
+            if files and attempt:
+                for value in files.values():
+                    file = value[1] if isinstance(value, tuple) else value
+                    if hasattr(file, 'seek'):
+                        file.seek(0)
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # A read timeout or a connection dropped mid-request usually means
+                # Telegram already has the request: a retry could send a message or
+                # an invoice twice, so only failures to connect are retried
+                last_attempt = attempt == self.max_retries or not _not_sent(e)
+                self._record(method_name, time.perf_counter() - started, waited, error=True, retried=not last_attempt)
+                if last_attempt:
+                    raise
+                logger.warning("%s failed (%s), retrying", method_name, e)
+                time.sleep(self.retry_delay * 2 ** attempt)
+                continue
+            latency = time.perf_counter() - started
+            last_attempt = attempt == self.max_retries
+            if response.status_code == 429:
+                self._record(method_name, latency, waited, error=True, throttled=True, retried=not last_attempt)
+                if last_attempt:
+                    return response
+                try:
+                    retry_after = response.json()['parameters']['retry_after']
+                except (ValueError, KeyError, TypeError):
+                    retry_after = self.retry_delay
+                logger.warning("%s hit Telegram flood limit, retrying in %ss", method_name, retry_after)
+                time.sleep(retry_after)
+                continue
+            if response.status_code >= 500 and method_name.startswith(RETRY_5XX_PREFIXES):
+                self._record(method_name, latency, waited, error=True, retried=not last_attempt)
+                if last_attempt:
+                    return response
+                time.sleep(self.retry_delay * 2 ** attempt)
+                continue
+            self._record(method_name, latency, waited, error=response.status_code != 200)
+            return response
+
+    def open_file(self, token: str, file_path: str) -> requests.Response:
+        """Streamed download of a file from getFile; unlike TeleBot.download_file the body is not read into memory"""
+        url = (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(token, file_path)
+        started = time.perf_counter()
+        response = self.session.get(url, stream=True, timeout=APIConfig.TELEGRAM_DOWNLOAD_TIMEOUT)
+        self._record('downloadFile', time.perf_counter() - started, 0.0, error=response.status_code != 200)
+        if response.status_code != 200:
+            response.close()
+            raise apihelper.ApiHTTPException('Download file', response)
+        return response
+
+    def stats(self) -> dict:
+        """Send counters, latency and time spent waiting on rate limits"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'throttled': self.throttled,
+                'retries': self.retries,
+                'latency_avg': self.latency_total / self.requests if self.requests else 0.0,
+                'latency_max': self.latency_max,
+                'wait_total': self.wait_total,
+                'chats_tracked': len(self.chat_buckets)
+            }
+
+# Global sender instance
+sender = OutboundSender()
@@ -0,0 +1,69 @@
+"""
+Pre-rendered product cards and keyboards, so the steady-state catalog costs no formatting work
+"""
+
+from collections import namedtuple
+from typing import Callable, Optional
+
+from telebot import types
+
+from config import BotConfig
+from InDMDevDB import GetDataFromDB, products_version
+from utils import CacheManager
+
+# Entries are keyed by name plus the catalog version (InDMDevDB.products_version),
+# a counter in the database that every product or category write bumps, from any
+# process; this process drops its cached rows before it takes a new version. Take
+# the version *before* reading the rows a value is rendered from:
+# a row read after that is at least as new as the version, so an entry can hold
+# newer data than its stamp but never older, and old stamps are simply never asked
+# for again and age out of the LRU.
+renders = CacheManager(BotConfig.RENDER_CACHE_SIZE, BotConfig.RENDER_CACHE_TTL)
+
+# Everything a handler sends for one product; markups are serialized JSON, which
+# telebot passes through as reply_markup as is
+ProductCard = namedtuple('ProductCard', ['productnumber', 'imagelink', 'in_stock', 'caption', 'line', 'buy_label', 'wallet_markup'])
+
+class Rendered(types.JsonSerializable):
+    """Pre-serialized JSON for telebot arguments that must be objects (inline query results)"""
+
+    def __init__(self, json_string: str):
+        self.json_string = json_string
+
+    def to_json(self) -> str:
+        return self.json_string
+
+def product_caption(product) -> str:
+    caption = (f"Product ID 🪪: /{product['productnumber']}\n\nProduct Name 📦: {product['productname']}\n\n"
+               f"Product Price 💰: {product['productprice']} {BotConfig.STORE_CURRENCY}\n\n"
+               f"Products In Stock 🛍: {product['productquantity']}\n\nProduct Description 💬: {product['productdescription']}")
+    return caption[:BotConfig.MAX_CAPTION_LENGTH]
+
+def _render_card(product) -> ProductCard:
+    number = product['productnumber']
+    wallet = types.InlineKeyboardMarkup()
+    wallet.add(types.InlineKeyboardButton(text="Pay from Wallet 💰", callback_data=f"walletpay_{number}"))
+    return ProductCard(
+        productnumber=number,
+        imagelink=product['productimagelink'],
+        in_stock=product['productquantity'] > 0,
+        caption=product_caption(product),
+        line=f"/{number} {product['productname']} - {product['productprice']} {BotConfig.STORE_CURRENCY} ({product['productquantity']} in stock)",
+        buy_label=f"BUY {product['productname']} ({product['productprice']} {BotConfig.STORE_CURRENCY}) 💰",
+        wallet_markup=wallet.to_json()
+    )
+
+def product_card(product, version: int) -> ProductCard:
+    """Card for a product row read after `version` was taken"""
+    return renders.get_or_load(f"card:{product['productnumber']}:{version}", lambda: _render_card(product))
+
+def load_product_card(productnumber: int) -> Optional[ProductCard]:
+    """Card for a product number, None if there is no such product"""
+    version = products_version()
+    product = GetDataFromDB.get_product_by_id(productnumber)
+    return None if product is None else product_card(product, version)
+
+def get_or_render(name: str, render: Callable):
+    """Cached render(version) for the current catalog version; render reads its own rows"""
+    version = products_version()
+    return renders.get_or_load(f"{name}:{version}", lambda: render(version))
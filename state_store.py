@@ -0,0 +1,155 @@
+"""
+Per-chat conversation state for multi-step flows (admin wizards)
+"""
+
+import json
+import time
+import logging
+import threading
+from typing import Optional
+
+from config import BotConfig
+from InDMDevDB import db_lock, get_connection
+
+logger = logging.getLogger(__name__)
+
+PURGE_EVERY = 100  # writes between sweeps for idle flows
+
+class MemoryStateStore:
+    """Process-local state store: one record per chat, O(1) get/set/clear"""
+
+    def __init__(self, ttl: int = BotConfig.CONVERSATION_STATE_TTL):
+        self.ttl = ttl
+        self.records = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, chat_id: int) -> Optional[dict]:
+        """Current {'state', 'data'} record for chat_id, or None if absent or idle too long"""
+        with self._lock:
+            record = self.records.get(chat_id)
+            if record is None:
+                return None
+            if time.time() - record['updated'] > self.ttl:
+                del self.records[chat_id]
+                return None
+            return {'state': record['state'], 'data': dict(record['data'])}
+
+    def start(self, chat_id: int, state: str, **data):
+        """Begin a new flow, discarding anything collected before"""
+        with self._lock:
+            self.records[chat_id] = {'state': state, 'data': data, 'updated': time.time()}
+            self._count_write()
+
+    def set_state(self, chat_id: int, state: str, **data):
+        """Move to state, keeping collected data and adding data"""
+        with self._lock:
+            record = self.records.get(chat_id)
+            merged = dict(record['data']) if record else {}
+            merged.update(data)
+            self.records[chat_id] = {'state': state, 'data': merged, 'updated': time.time()}
+            self._count_write()
+
+    def clear(self, chat_id: int):
+        """Drop the chat's flow"""
+        with self._lock:
+            self.records.pop(chat_id, None)
+
+    def purge_expired(self):
+        """Drop every flow idle for longer than the TTL"""
+        with self._lock:
+            self._purge()
+
+    def _count_write(self):
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self._purge()
+
+    def _purge(self):
+        cutoff = time.time() - self.ttl
+        for chat_id in [chat_id for chat_id, record in self.records.items() if record['updated'] < cutoff]:
+            del self.records[chat_id]
+
+class SQLiteStateStore:
+    """State store in ConversationStateTable: survives restarts and is shared by worker processes"""
+
+    def __init__(self, ttl: int = BotConfig.CONVERSATION_STATE_TTL):
+        self.ttl = ttl
+        self._writes = 0
+
+    def get(self, chat_id: int) -> Optional[dict]:
+        """Current {'state', 'data'} record for chat_id, or None if absent or idle too long"""
+        try:
+            row = get_connection().execute(
+                "SELECT state, data, updated_at FROM ConversationStateTable WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+        except Exception as e:
+            logger.error("Error reading conversation state for %s: %s", chat_id, e)
+            return None
+        if row is None:
+            return None
+        if time.time() - row['updated_at'] > self.ttl:
+            self.clear(chat_id)
+            return None
+        return {'state': row['state'], 'data': json.loads(row['data'])}
+
+    def start(self, chat_id: int, state: str, **data):
+        """Begin a new flow, discarding anything collected before"""
+        self._write(chat_id, state, data, merge=False)
+
+    def set_state(self, chat_id: int, state: str, **data):
+        """Move to state, keeping collected data and adding data"""
+        self._write(chat_id, state, data, merge=True)
+
+    def clear(self, chat_id: int):
+        """Drop the chat's flow"""
+        try:
+            with db_lock:
+                connection = get_connection()
+                connection.execute("DELETE FROM ConversationStateTable WHERE chat_id = ?", (chat_id,))
+                connection.commit()
+        except Exception as e:
+            logger.error("Error clearing conversation state for %s: %s", chat_id, e)
+            get_connection().rollback()
+
+    def purge_expired(self):
+        """Drop every flow idle for longer than the TTL"""
+        try:
+            with db_lock:
+                connection = get_connection()
+                connection.execute("DELETE FROM ConversationStateTable WHERE updated_at < ?", (time.time() - self.ttl,))
+                connection.commit()
+        except Exception as e:
+            logger.error("Error purging conversation states: %s", e)
+            get_connection().rollback()
+
+    def _write(self, chat_id: int, state: str, data: dict, merge: bool):
+        # BEGIN IMMEDIATE takes the write lock before the merge reads, so another
+        # process can't change the record between the read and the write
+        try:
+            with db_lock:
+                connection = get_connection()
+                connection.execute("BEGIN IMMEDIATE")
+                if merge:
+                    row = connection.execute("SELECT data FROM ConversationStateTable WHERE chat_id = ?", (chat_id,)).fetchone()
+                    if row is not None:
+                        data = {**json.loads(row['data']), **data}
+                connection.execute(
+                    """INSERT INTO ConversationStateTable (chat_id, state, data, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(chat_id) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at""",
+                    (chat_id, state, json.dumps(data), time.time())
+                )
+                connection.commit()
+        except Exception as e:
+            logger.error("Error saving conversation state for %s: %s", chat_id, e)
+            get_connection().rollback()
+            return
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self.purge_expired()
+
+def create_state_store():
+    """State store for BotConfig.STATE_BACKEND ('memory' or 'sqlite')"""
+    if BotConfig.STATE_BACKEND == 'sqlite':
+        return SQLiteStateStore()
+    return MemoryStateStore()
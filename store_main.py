@@ -1,88 +1,205 @@
 import flask
 from datetime import datetime
+import atexit
+import time
 import logging
+import signal
+import sys
+import threading
 from flask import Flask, request
 from telebot import types, TeleBot
 import os
-from InDMDevDB import CreateTables, CreateDatas, GetDataFromDB, UpdateData
-from purchase import UserOperations
+import io
+import tempfile
+from log_setup import setup_logging
+
+# Configure logging before InDMDevDB is imported, so its migrations are logged too
+setup_logging()
+
+from InDMDevDB import CreateTables, CreateDatas, GetDataFromDB, UpdateData, CheckoutStatus
 from InDMCategories import CategoriesDatas
+from utils import RateLimiter, MessageFormatter, cache
+from config import BotConfig, APIConfig
+from update_dispatcher import UpdateDispatcher, UpdatePoller, update_chat_id, update_user_id
+from outbound import sender
+from state_store import create_state_store
+import metrics
+from db_profiler import profiler
+from backup import backup_job
+from catalog_io import catalog_format, import_catalog, export_catalog
+from render_cache import renders, Rendered, product_card, load_product_card, get_or_render
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv('config.env')
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler('bot.log'), logging.StreamHandler()]
-)
 logger = logging.getLogger(__name__)
+health_logger = logging.getLogger('health')  # sampled, see BotConfig.LOG_SAMPLED_LOGGERS
 
 # Flask connection
 flask_app = Flask(__name__)
 flask_app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 
 # Bot connection
-webhook_url = os.getenv('WEBHOOK_URL')
+webhook_url = BotConfig.WEBHOOK_URL
 bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
 store_currency = os.getenv('STORE_CURRENCY', 'USD')
 admin_ids = os.getenv('ADMIN_IDS', '8354685313').split(',')
 payment_provider_token = os.getenv('PAYMENT_PROVIDER_TOKEN')
 
-if not webhook_url or not bot_token or not payment_provider_token:
-    logger.error("Missing required environment variables: WEBHOOK_URL, TELEGRAM_BOT_TOKEN, or PAYMENT_PROVIDER_TOKEN")
+try:
+    BotConfig.validate_config()
+except ValueError as e:
+    logger.error(str(e))
+    exit(1)
+if not payment_provider_token:
+    logger.error("Missing required environment variable: PAYMENT_PROVIDER_TOKEN")
     exit(1)
 
 bot = TeleBot(bot_token, threaded=False)
+sender.install()  # rate limits and retries for every Bot API call
 
-# Store user states
-user_states = {}
+def process_update(update):
+    # A main menu button or a command leaves whatever multi-step flow the chat was in,
+    # so a later document or text is not taken as the answer to a forgotten prompt
+    message = update.message
+    if message is not None and message.text and (message.text in MENU_BUTTONS or message.text.startswith('/')):
+        if state_store.get(message.chat.id) is not None:
+            state_store.clear(message.chat.id)
+    bot.process_new_updates([update])
 
-# Set up webhook only if needed
-try:
-    webhook_info = bot.get_webhook_info()
-    if webhook_info.url != f"{webhook_url}/webhook":
-        bot.remove_webhook()
-        bot.set_webhook(url=f"{webhook_url}/webhook")
-        logger.info(f"Webhook set successfully to {webhook_url}/webhook")
-    else:
-        logger.info(f"Webhook already set to {webhook_url}/webhook")
-except Exception as e:
-    logger.error(f"Failed to manage webhook: {e}")
-    exit(1)
+# Webhook requests only enqueue; these workers run the handlers, setting aside the
+# updates of a chat that is out of send budget instead of sleeping on its bucket
+dispatcher = UpdateDispatcher(process_update, BotConfig.UPDATE_WORKERS, BotConfig.UPDATE_QUEUE_SIZE, chat_delay=sender.chat_delay)
+dispatcher.start()
+atexit.register(dispatcher.stop)
+
+# Per-user and global request budgets, checked before an update is queued
+rate_limiter = RateLimiter(BotConfig.MAX_REQUESTS_PER_MINUTE, BotConfig.MAX_REQUESTS_PER_HOUR, BotConfig.MAX_REQUESTS_PER_SECOND_GLOBAL, BotConfig.RATE_LIMIT_MAX_USERS)
+THROTTLED_REPLY = "⏳ You're sending requests too fast. Please wait a moment and try again."
+
+def is_rate_limited(update):
+    # Payments are never dropped: the money has already moved
+    if update.pre_checkout_query or (update.message and update.message.successful_payment):
+        return False
+    if update.inline_query or update.chosen_inline_result:
+        # "@bot words" sends a query per keystroke, far past the per-user budget: only the
+        # global one applies. There is no chat to warn; a shed query gets an empty answer
+        # Telegram does not cache, instead of leaving the client spinning
+        if rate_limiter.check_global():
+            return False
+        if update.inline_query:
+            query = update.inline_query
+            dispatcher.submit_task(query.from_user.id, lambda: bot.answer_inline_query(query.id, [], cache_time=0))
+        return True
+    user_id = update_user_id(update)
+    if user_id is None or rate_limiter.check(user_id):
+        return False
+    if rate_limiter.should_notify(user_id):
+        chat_id = update_chat_id(update)
+        dispatcher.submit_task(chat_id, lambda: bot.send_message(chat_id, THROTTLED_REPLY))
+    return True
+
+# Conversation state of multi-step admin flows, one record per chat
+state_store = create_state_store()
+
+def enqueue_update(update):
+    """Rate-limit and queue an update from either runtime mode; False only if its queue is full"""
+    if is_rate_limited(update):
+        return True
+    return dispatcher.submit(update)
+
+# Webhook registration runs at startup, not import: the URL that is known to be
+# set is cached, and failures are retried in the background while Flask serves
+registered_webhook_url = None
+
+def register_webhook():
+    global registered_webhook_url
+    target = f"{webhook_url}/webhook"
+    if registered_webhook_url == target:
+        return True
+    try:
+        if bot.get_webhook_info().url != target:
+            bot.remove_webhook()
+            bot.set_webhook(url=target)
+            logger.info("Webhook set successfully to %s", target)
+        else:
+            logger.info("Webhook already set to %s", target)
+        registered_webhook_url = target
+        return True
+    except Exception as e:
+        logger.error("Failed to manage webhook: %s", e)
+        return False
+
+def register_webhook_until_done():
+    delay = APIConfig.RETRY_DELAY
+    while not register_webhook():
+        logger.info("Retrying webhook registration in %ss", delay)
+        time.sleep(delay)
+        delay = min(delay * 2, APIConfig.WEBHOOK_RETRY_MAX_DELAY)
+
+def start_webhook_registration():
+    threading.Thread(target=register_webhook_until_done, name="webhook-registration", daemon=True).start()
 
 # Process webhook calls
 @flask_app.route('/webhook', methods=['POST'])
 def webhook():
+    started = time.perf_counter()
+    status = accept_webhook()
+    metrics.webhook_seconds.observe(time.perf_counter() - started, status)
+    return '', status
+
+def accept_webhook():
     if request.method == 'POST' and request.headers.get('content-type') == 'application/json':
         json_string = request.get_data().decode('utf-8')
         update = types.Update.de_json(json_string)
-        bot.process_new_updates([update])
-        return '', 200
-    logger.warning(f"Invalid request to /webhook: method={request.method}, content-type={request.headers.get('content-type')}")
-    return '', 400
+        if not enqueue_update(update):
+            # Telegram redelivers on non-2xx, so a full queue pushes back instead of dropping
+            logger.warning("Update queue full, rejecting update %s", update.update_id)
+            return 503
+        return 200
+    logger.warning("Invalid request to /webhook: method=%s, content-type=%s", request.method, request.headers.get('content-type'))
+    return 400
 
 @flask_app.route('/', methods=['HEAD', 'GET'])
 def health_check():
-    logger.info(f"Health check: {request.method}")
+    # probed every few seconds by the host; the sampling filter keeps 1 in LOG_SAMPLE_EVERY
+    health_logger.info("Health check: %s", request.method)
     return '', 200
 
-# Main keyboard
-def create_main_keyboard():
+# Gauges and totals other components already keep, read at scrape time
+metrics.registry.gauge('bot_update_queue_depth', 'Updates waiting per worker queue',
+                       lambda: {(str(index),): work_queue.qsize() for index, work_queue in enumerate(dispatcher.queues)}, ['worker'])
+metrics.registry.gauge('bot_updates_held', 'Updates set aside until their chat may be sent to again', lambda: dispatcher.held)
+metrics.registry.gauge('bot_cache_lookups_total', 'Read-through cache lookups, by result',
+                       lambda: {('hit',): cache.hits, ('miss',): cache.misses}, ['result'], kind='counter')
+metrics.registry.gauge('bot_cache_hit_ratio', 'Read-through cache hit ratio since start', lambda: cache.stats()['hit_ratio'])
+metrics.registry.gauge('bot_cache_entries', 'Entries in the read-through cache', lambda: len(cache.cache))
+metrics.registry.gauge('bot_render_cache_lookups_total', 'Pre-rendered card and keyboard lookups, by result',
+                       lambda: {('hit',): renders.hits, ('miss',): renders.misses}, ['result'], kind='counter')
+metrics.registry.gauge('bot_render_cache_entries', 'Entries in the render cache', lambda: len(renders.cache))
+metrics.registry.gauge('bot_api_wait_seconds_total', 'Time Bot API requests waited on our own flood-limit buckets', lambda: sender.wait_total, kind='counter')
+metrics.registry.gauge('bot_rate_limited_updates_total', 'Updates dropped by the per-user/global rate limiter, by limit',
+                       lambda: {('user',): rate_limiter.throttled_user, ('global',): rate_limiter.throttled_global}, ['limit'], kind='counter')
+
+@flask_app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return metrics.registry.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+MENU_BUTTONS = ("Shop Items 🛒", "My Orders 🛍", "Top Up Wallet 💰", "Profile 👤", "Search 🔍", "Categories 🏷")
+
+# Reply keyboards never change: they are built and serialized once at import,
+# and create_*_keyboard hand out the JSON, which telebot sends as is
+def _build_main_keyboard():
     keyboard = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
     keyboard.row_width = 2
-    key1 = types.KeyboardButton("Shop Items 🛒")
-    key2 = types.KeyboardButton("My Orders 🛍")
-    key3 = types.KeyboardButton("Top Up Wallet 💰")
-    key4 = types.KeyboardButton("Profile 👤")
+    key1, key2, key3, key4, key5, key6 = (types.KeyboardButton(text) for text in MENU_BUTTONS)
     keyboard.add(key1, key2)
     keyboard.add(key3, key4)
+    keyboard.add(key5, key6)
     return keyboard
 
-# Admin keyboard
-def create_admin_keyboard():
+def _build_admin_keyboard():
     keyboard = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
     keyboard.row_width = 2
     key1 = types.KeyboardButton("Add Item 📦")
@@ -93,71 +210,330 @@ def create_admin_keyboard():
     keyboard.add(key3, key4)
     return keyboard
 
+MAIN_KEYBOARD = _build_main_keyboard().to_json()
+ADMIN_KEYBOARD = _build_admin_keyboard().to_json()
+
+# Main keyboard
+def create_main_keyboard():
+    return MAIN_KEYBOARD
+
+# Admin keyboard
+def create_admin_keyboard():
+    return ADMIN_KEYBOARD
+
+# Catalog page: one bounded keyset query per view, Prev/Next carry the cursor in callback data
+# Views: 'shop' (buy buttons), 'catalog' (/shop text list), 'admin' (admin list, includes sold out)
+# Returns (text, keyboard JSON, has products), rendered once per catalog version
+def build_product_page(view, after=None, before=None):
+    return get_or_render(f"page:{view}:{after}:{before}", lambda version: render_product_page(view, after, before))
+
+def render_product_page(view, after=None, before=None):
+    products, has_prev, has_next = GetDataFromDB.get_products_page(after, before, BotConfig.PRODUCTS_PER_PAGE, in_stock_only=view != 'admin')
+    if not products and (after is not None or before is not None):
+        # the page we pointed at emptied out meanwhile, start over
+        return render_product_page(view)
+    keyboard = types.InlineKeyboardMarkup()
+    if not products:
+        text = "No products available yet." if view != 'admin' else "No products yet."
+    elif view == 'shop':
+        text = "Available products:"
+        for product in products:
+            button = types.InlineKeyboardButton(text=f"Buy {product['productname']} ({product['productprice']} {store_currency})", callback_data=f"getproduct_{product['productnumber']}")
+            keyboard.add(button)
+    else:
+        text = "Products:\n"
+        for product in products:
+            sold = f", {product['units_sold']} sold" if view == 'admin' else ""
+            text += f"ID: {product['productnumber']} - {product['productname']} ({product['productquantity']} left{sold}) - {product['productprice']} {store_currency}\n"
+    nav = []
+    if products and has_prev:
+        nav.append(types.InlineKeyboardButton(text="◀️ Prev", callback_data=f"page_{view}_p_{products[0]['productnumber']}"))
+    if products and has_next:
+        nav.append(types.InlineKeyboardButton(text="Next ▶️", callback_data=f"page_{view}_n_{products[-1]['productnumber']}"))
+    if nav:
+        keyboard.row(*nav)
+    return text, keyboard.to_json(), bool(products)
+
+# Category list: one button per category with in-stock products, counted by one grouped
+# query; a button opens the category's products (getcats_), Prev/Next carry the offset.
+# Returns (text, keyboard JSON, has categories), rendered once per catalog version.
+def build_categories_page(offset=0):
+    return get_or_render(f"categories:{offset}", lambda version: render_categories_page(offset))
+
+def render_categories_page(offset=0):
+    categories = [row for row in GetDataFromDB.GetCategoriesWithProductCount() if row['productcount'] > 0]
+    if not categories:
+        return "⚠️ No Product available at the moment, kindly check back soon", None, False
+    if offset >= len(categories):
+        offset = 0
+    page_size = BotConfig.CATEGORIES_PER_PAGE
+    keyboard = types.InlineKeyboardMarkup()
+    for category in categories[offset:offset + page_size]:
+        keyboard.add(types.InlineKeyboardButton(text=f"🏷 {category['categoryname']} ({category['productcount']})",
+                                                callback_data=f"getcats_{category['categorynumber']}"))
+    nav = []
+    if offset > 0:
+        nav.append(types.InlineKeyboardButton(text="◀️ Prev", callback_data=f"catlist_{max(offset - page_size, 0)}"))
+    if offset + page_size < len(categories):
+        nav.append(types.InlineKeyboardButton(text="Next ▶️", callback_data=f"catlist_{offset + page_size}"))
+    if nav:
+        keyboard.row(*nav)
+    return "CATEGORIES:", keyboard.to_json(), True
+
+# Order history page: newest first, "Older" carries the keyset cursor in callback data
+def build_orders_page(user_id, cursor=None):
+    orders, next_cursor = GetDataFromDB.get_orders(user_id, cursor, BotConfig.ORDERS_PER_PAGE)
+    if not orders:
+        return ["No orders yet."], None
+    # the user row's counter, kept by add_order/checkout, instead of a COUNT(*) per page
+    user = GetDataFromDB.get_user(user_id)
+    lines = [f"Your orders ({user['orders_count'] if user else len(orders)}):"]
+    for order in orders:
+        lines.append(f"Order #{order['ordernumber']}: {order['productname']} - {order['productprice']} {store_currency} ({order['orderdate']})")
+    keyboard = types.InlineKeyboardMarkup()
+    nav = []
+    if cursor is not None:
+        nav.append(types.InlineKeyboardButton(text="⏮ Newest", callback_data="orders_first"))
+    if next_cursor is not None:
+        nav.append(types.InlineKeyboardButton(text="Older ▶️", callback_data=f"orders_{next_cursor}"))
+    if nav:
+        keyboard.row(*nav)
+    return MessageFormatter.chunk_lines(lines), keyboard if nav else None
+
+# Search results page: ranked, buy buttons; Prev/Next carry the offset and the search words in
+# callback data, cut to whole words so it stays within Telegram's 64-byte limit.
+# Returns (text, keyboard JSON or None), rendered once per catalog version.
+def build_search_page(terms, offset=0):
+    words = []
+    for word in terms.split():
+        if len(f"search_{offset + BotConfig.PRODUCTS_PER_PAGE}_{' '.join(words + [word])}".encode('utf-8')) > 64:
+            break
+        words.append(word)
+    terms = ' '.join(words)
+    return get_or_render(f"search:{offset}:{terms}", lambda version: render_search_page(terms, offset))
+
+def render_search_page(terms, offset):
+    products, has_next = GetDataFromDB.search_products(terms, offset, BotConfig.PRODUCTS_PER_PAGE)
+    keyboard = types.InlineKeyboardMarkup()
+    if not products:
+        return f"No products found for \"{terms}\"." if offset == 0 else "No more results.", None
+    for product in products:
+        button = types.InlineKeyboardButton(text=f"Buy {product['productname']} ({product['productprice']} {store_currency})", callback_data=f"getproduct_{product['productnumber']}")
+        keyboard.add(button)
+    nav = []
+    if offset > 0:
+        nav.append(types.InlineKeyboardButton(text="◀️ Prev", callback_data=f"search_{max(offset - BotConfig.PRODUCTS_PER_PAGE, 0)}_{terms}"))
+    if has_next:
+        nav.append(types.InlineKeyboardButton(text="Next ▶️", callback_data=f"search_{offset + BotConfig.PRODUCTS_PER_PAGE}_{terms}"))
+    if nav:
+        keyboard.row(*nav)
+    return f"Results for \"{terms}\" ({offset + 1}-{offset + len(products)} of {products[0]['matches']}):", keyboard.to_json()
+
+# Inline mode (@bot <words> in any chat): answers are built from the cached product
+# pages/search and kept pre-serialized in the render cache until the next product
+# write; Telegram serves repeats for INLINE_CACHE_TIME on its side
+_bot_username = None
+
+def product_deep_link(productnumber):
+    global _bot_username
+    if _bot_username is None:
+        _bot_username = bot.get_me().username
+    return f"https://t.me/{_bot_username}?start=product_{productnumber}"
+
+def inline_result(product, version):
+    return renders.get_or_load(f"inline:{product['productnumber']}:{version}", lambda: Rendered(render_inline_result(product, version).to_json()))
+
+def render_inline_result(product, version):
+    caption = product_card(product, version).caption
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton(text="Buy in the bot 🛒", url=product_deep_link(product['productnumber'])))
+    description = f"{product['productprice']} {store_currency} · {product['productquantity']} in stock"
+    image = product['productimagelink']
+    if image and image.lower().startswith(('http://', 'https://')):
+        # catalog imports can set a plain URL; a cached photo only takes a Telegram file_id
+        return types.InlineQueryResultPhoto(str(product['productnumber']), image, image, title=product['productname'],
+                                            description=description, caption=caption, reply_markup=keyboard)
+    if image:
+        return types.InlineQueryResultCachedPhoto(str(product['productnumber']), image, title=product['productname'],
+                                                  description=description, caption=caption, reply_markup=keyboard)
+    return types.InlineQueryResultArticle(str(product['productnumber']), product['productname'], types.InputTextMessageContent(caption),
+                                          reply_markup=keyboard, description=description)
+
+def build_inline_page(terms, offset):
+    # Words: ranked search, next_offset is the result offset. Empty query: the
+    # in-stock catalog by productnumber, next_offset is the last number shown.
+    # Returns (results, next_offset), '' when there are no more.
+    terms = ' '.join(terms.split()).lower()
+    try:
+        offset = int(offset) if offset else None
+    except ValueError:
+        offset = None
+
+    def load(version):
+        if terms:
+            start = offset or 0
+            products, has_next = GetDataFromDB.search_products(terms, start, BotConfig.INLINE_RESULTS_PER_PAGE)
+            next_offset = str(start + len(products)) if has_next else ''
+        else:
+            products, _, has_next = GetDataFromDB.get_products_page(after=offset, limit=BotConfig.INLINE_RESULTS_PER_PAGE)
+            next_offset = str(products[-1]['productnumber']) if has_next else ''
+        return [inline_result(product, version) for product in products], next_offset
+    return get_or_render(f"inlinepage:{terms}:{offset}", load)
+
+def send_orders_page(chat_id, chunks, keyboard):
+    for chunk in chunks[:-1]:
+        bot.send_message(chat_id, chunk)
+    bot.send_message(chat_id, chunks[-1], reply_markup=keyboard)
+
 # Callback handler
 @bot.callback_query_handler(func=lambda call: True)
 def callback_query(call):
     try:
-        logger.info(f"Callback received: {call.data}")
+        logger.info("Callback received: %s", call.data)
         chat_id = call.message.chat.id
         if call.data.startswith("getcats_"):
             input_catees = call.data.replace('getcats_', '')
             CategoriesDatas.get_category_products(call.message, input_catees)
+            bot.answer_callback_query(call.id)
+        elif call.data.startswith("catlist_"):
+            text, keyboard, _ = build_categories_page(int(call.data.replace('catlist_', '')))
+            bot.edit_message_text(text, chat_id, call.message.message_id, reply_markup=keyboard)
+            bot.answer_callback_query(call.id)
+        elif call.data.startswith("catpage_"):
+            _, catnum, offset = call.data.split('_')
+            CategoriesDatas.get_category_products(call.message, catnum, int(offset))
+            bot.answer_callback_query(call.id)
         elif call.data.startswith("getproduct_"):
-            input_cate = call.data.replace('getproduct_', '')
-            UserOperations.purchase_a_products(call.message, input_cate)
+            # the product card carries "Pay from Wallet", the way into checkout
+            send_product_card(chat_id, int(call.data.replace('getproduct_', '')))
+            bot.answer_callback_query(call.id)
+        elif call.data.startswith("walletpay_"):
+            productnumber = int(call.data.replace('walletpay_', ''))
+            result = UpdateData.checkout(chat_id, productnumber, 1, call.from_user.username)
+            if result.status == CheckoutStatus.OK:
+                text = f"Purchase complete! Order #{result.ordernumber}, paid {result.total} {store_currency} from your wallet."
+                if result.keys:
+                    text += "\n\nYour key:\n" + "\n".join(result.keys)
+                bot.send_message(chat_id, text, reply_markup=create_main_keyboard())
+            elif result.status == CheckoutStatus.INSUFFICIENT_FUNDS:
+                bot.send_message(chat_id, f"Insufficient balance: this costs {result.total} {store_currency}. Use /topup to add funds.")
+            elif result.status in (CheckoutStatus.OUT_OF_STOCK, CheckoutStatus.NOT_FOUND):
+                bot.send_message(chat_id, "Sorry, this product is out of stock.")
+            else:
+                bot.send_message(chat_id, "Purchase failed. Contact support.")
+            bot.answer_callback_query(call.id)
+        elif call.data.startswith("page_"):
+            _, view, direction, cursor = call.data.split('_')
+            if view == 'admin' and str(chat_id) not in admin_ids:
+                return
+            if direction == 'n':
+                text, keyboard, _ = build_product_page(view, after=int(cursor))
+            else:
+                text, keyboard, _ = build_product_page(view, before=int(cursor))
+            bot.edit_message_text(text, chat_id, call.message.message_id, reply_markup=keyboard)
+            bot.answer_callback_query(call.id)
+        elif call.data.startswith("search_"):
+            _, offset, terms = call.data.split('_', 2)
+            text, keyboard = build_search_page(terms, int(offset))
+            bot.edit_message_text(text, chat_id, call.message.message_id, reply_markup=keyboard)
+            bot.answer_callback_query(call.id)
+        elif call.data.startswith("orders_"):
+            cursor = call.data.replace('orders_', '')
+            chunks, keyboard = build_orders_page(chat_id, None if cursor == 'first' else int(cursor))
+            if len(chunks) == 1:
+                bot.edit_message_text(chunks[0], chat_id, call.message.message_id, reply_markup=keyboard)
+            else:
+                send_orders_page(chat_id, chunks, keyboard)
+            bot.answer_callback_query(call.id)
         elif call.data == "buy_product":
             user = GetDataFromDB.get_user(chat_id)
             balance = user['wallet'] if user else 0
             bot.answer_callback_query(call.id, f"Your balance: {balance} {store_currency}")
     except Exception as e:
-        logger.error(f"Callback error: {e}")
+        logger.error("Callback error: %s", e)
+
+# Inline query: product results for @bot <words>, paged with next_offset
+@bot.inline_handler(func=lambda query: True)
+def inline_query(query):
+    try:
+        results, next_offset = build_inline_page(query.query, query.offset)
+        bot.answer_inline_query(query.id, results, cache_time=BotConfig.INLINE_CACHE_TIME, is_personal=False, next_offset=next_offset)
+    except Exception as e:
+        logger.error("Inline query error for %r: %s", query.query, e)
+
+# Product card for the BUY buttons and the /start product_<number> deep links of inline results
+def send_product_card(chat_id, productnumber):
+    card = load_product_card(productnumber)
+    if card is None or not card.in_stock:
+        bot.send_message(chat_id, "Sorry, this product is no longer available.", reply_markup=create_main_keyboard())
+        return
+    if card.imagelink:
+        bot.send_photo(chat_id, card.imagelink, caption=card.caption, reply_markup=card.wallet_markup)
+    else:
+        bot.send_message(chat_id, card.caption, reply_markup=card.wallet_markup)
 
 # Start message
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
     chat_id = message.chat.id
     username = message.from_user.username or "Unknown"
+    payload = message.text.split(maxsplit=1)[1] if len(message.text.split()) > 1 else ''
     try:
         if CreateDatas.add_user(chat_id, username):
             bot.send_message(chat_id, f"Welcome to the store, {username}! Use /shop to browse.", reply_markup=create_main_keyboard())
-            logger.info(f"Sent welcome to {username} (ID: {chat_id})")
+            logger.info("Sent welcome to %s (ID: %s)", username, chat_id)
+            if payload.startswith('product_') and payload[len('product_'):].isdigit():
+                send_product_card(chat_id, int(payload[len('product_'):]))
         else:
             bot.send_message(chat_id, f"Failed to register you, {username}. Contact support.", reply_markup=create_main_keyboard())
-            logger.error(f"Failed to add user {username} (ID: {chat_id})")
+            logger.error("Failed to add user %s (ID: %s)", username, chat_id)
     except Exception as e:
         bot.send_message(chat_id, f"Error starting: {e}. Please try again or contact support.", reply_markup=create_main_keyboard())
-        logger.error(f"Exception in send_welcome for {username} (ID: {chat_id}): {e}")
+        logger.error("Exception in send_welcome for %s (ID: %s): %s", username, chat_id, e)
 
 # Shop Items
 @bot.message_handler(func=lambda message: message.text == "Shop Items 🛒")
 def shop_items(message):
     chat_id = message.chat.id
-    products = GetDataFromDB.get_products()
-    if products:
-        keyboard = types.InlineKeyboardMarkup()
-        for product in products:
-            if product['productquantity'] > 0:
-                button = types.InlineKeyboardButton(text=f"Buy {product['productname']} ({product['productprice']} {store_currency})", callback_data=f"getproduct_{product['productnumber']}")
-                keyboard.add(button)
-        bot.send_message(chat_id, "Available products:", reply_markup=keyboard)
+    text, keyboard, has_products = build_product_page('shop')
+    if has_products:
+        bot.send_message(chat_id, text, reply_markup=keyboard)
     else:
-        bot.send_message(chat_id, "No products available yet.", reply_markup=create_main_keyboard())
-    logger.info(f"Shop items viewed by {message.from_user.username} (ID: {chat_id})")
+        bot.send_message(chat_id, text, reply_markup=create_main_keyboard())
+    logger.info("Shop items viewed by %s (ID: %s)", message.from_user.username, chat_id)
+
+# Categories
+@bot.message_handler(func=lambda message: message.text == "Categories 🏷")
+def show_categories(message):
+    chat_id = message.chat.id
+    text, keyboard, has_categories = build_categories_page()
+    bot.send_message(chat_id, text, reply_markup=keyboard if has_categories else create_main_keyboard())
+    logger.info("Categories viewed by %s (ID: %s)", message.from_user.username, chat_id)
 
 # My Orders
 @bot.message_handler(func=lambda message: message.text == "My Orders 🛍")
 def my_orders(message):
     chat_id = message.chat.id
-    orders = GetDataFromDB.get_orders(chat_id)
-    if orders:
-        response = "Your orders:\n"
-        for order in orders:
-            response += f"Order #{order['ordernumber']}: {order['productname']} - {order['productprice']} {store_currency}\n"
-        bot.send_message(chat_id, response)
-    else:
-        bot.send_message(chat_id, "No orders yet.")
+    chunks, keyboard = build_orders_page(chat_id)
+    send_orders_page(chat_id, chunks, keyboard)
     bot.send_message(chat_id, "Choose an option:", reply_markup=create_main_keyboard())
-    logger.info(f"My orders viewed by {message.from_user.username} (ID: {chat_id})")
+    logger.info("My orders viewed by %s (ID: %s)", message.from_user.username, chat_id)
+
+# Product search: /search <words>, every word matches as a prefix of name, description or category
+@bot.message_handler(commands=['search'])
+def search(message):
+    chat_id = message.chat.id
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2 or not parts[1].strip():
+        bot.send_message(chat_id, "Send /search followed by what you are looking for, e.g. /search netflix")
+        return
+    text, keyboard = build_search_page(parts[1])
+    bot.send_message(chat_id, text, reply_markup=keyboard or create_main_keyboard())
+    logger.info("Search by %s (ID: %s): %s", message.from_user.username, chat_id, parts[1])
+
+@bot.message_handler(func=lambda message: message.text == "Search 🔍")
+def search_button(message):
+    bot.send_message(message.chat.id, "Send /search followed by what you are looking for, e.g. /search netflix")
 
 # Profile
 @bot.message_handler(func=lambda message: message.text == "Profile 👤")
@@ -165,11 +541,11 @@ def profile(message):
     chat_id = message.chat.id
     user = GetDataFromDB.get_user(chat_id)
     balance = user['wallet'] if user else 0
-    orders = GetDataFromDB.get_orders(chat_id)
-    orders_count = len(orders) if orders else 0
-    response = f"Profile:\nUsername: {message.from_user.username}\nBalance: {balance} {store_currency}\nOrders: {orders_count}"
+    orders_count = user['orders_count'] if user else 0
+    total_spent = user['total_spent'] if user else 0
+    response = f"Profile:\nUsername: {message.from_user.username}\nBalance: {balance} {store_currency}\nOrders: {orders_count}\nTotal spent: {total_spent} {store_currency}"
     bot.send_message(chat_id, response)
-    logger.info(f"Profile viewed by {message.from_user.username} (ID: {chat_id})")
+    logger.info("Profile viewed by %s (ID: %s)", message.from_user.username, chat_id)
 
 # Top up wallet
 @bot.message_handler(func=lambda message: message.text == "Top Up Wallet 💰")
@@ -178,7 +554,7 @@ def topup_wallet(message):
     user = GetDataFromDB.get_user(chat_id)
     balance = user['wallet'] if user else 0
     bot.send_message(chat_id, f"Your current balance: {balance} {store_currency}\nUse /topup to add funds via TON.")
-    logger.info(f"Top up request from {message.from_user.username} (ID: {chat_id})")
+    logger.info("Top up request from %s (ID: %s)", message.from_user.username, chat_id)
 
 @bot.message_handler(commands=['topup'])
 def send_topup_invoice(message):
@@ -195,12 +571,12 @@ def send_topup_invoice(message):
         start_parameter="topup",
         invoice_payload=f"topup_{chat_id}"  # Corrected to invoice_payload
     )
-    logger.info(f"Top up invoice sent to {message.from_user.username} (ID: {chat_id})")
+    logger.info("Top up invoice sent to %s (ID: %s)", message.from_user.username, chat_id)
 
 @bot.pre_checkout_query_handler(func=lambda query: True)
 def pre_checkout_query(pre_checkout_query):
     bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
-    logger.info(f"Pre-checkout approved for {pre_checkout_query.from_user.username} (ID: {pre_checkout_query.from_user.id})")
+    logger.info("Pre-checkout approved for %s (ID: %s)", pre_checkout_query.from_user.username, pre_checkout_query.from_user.id)
 
 @bot.message_handler(content_types=['successful_payment'])
 def successful_payment(message):
@@ -208,57 +584,233 @@ def successful_payment(message):
     amount = message.successful_payment.total_amount / 1000000000  # Convert nanoTON to TON
     if CreateDatas.topup_wallet(chat_id, amount):
         bot.send_message(chat_id, f"Top up successful! Added {amount} TON to your wallet.")
-        logger.info(f"Top up successful for {message.from_user.username} (ID: {chat_id}): {amount} TON")
+        logger.info("Top up successful for %s (ID: %s): %s TON", message.from_user.username, chat_id, amount)
     else:
         bot.send_message(chat_id, "Top up failed. Contact support.")
-        logger.error(f"Top up failed for {message.from_user.username} (ID: {chat_id})")
+        logger.error("Top up failed for %s (ID: %s)", message.from_user.username, chat_id)
 
 # Admin command to enter admin mode
 @bot.message_handler(commands=['admin'])
 def enter_admin_mode(message):
     chat_id = message.chat.id
     username = message.from_user.username or "Unknown"
-    logger.info(f"Admin command received from {username} (ID: {chat_id})")
+    logger.info("Admin command received from %s (ID: %s)", username, chat_id)
     if str(chat_id) not in admin_ids:
         bot.send_message(chat_id, "You are not an admin.", reply_markup=create_main_keyboard())
-        logger.warning(f"Non-admin {username} (ID: {chat_id}) tried to enter admin mode")
+        logger.warning("Non-admin %s (ID: %s) tried to enter admin mode", username, chat_id)
         return
     try:
         if CreateDatas.add_admin(chat_id, username):
             bot.send_message(chat_id, "Admin mode activated. Choose an option:", reply_markup=create_admin_keyboard())
-            logger.info(f"Admin mode activated for {username} (ID: {chat_id})")
+            logger.info("Admin mode activated for %s (ID: %s)", username, chat_id)
         else:
             bot.send_message(chat_id, "Failed to activate admin mode. Contact support.")
-            logger.error(f"Failed to add admin {username} (ID: {chat_id})")
+            logger.error("Failed to add admin %s (ID: %s)", username, chat_id)
     except Exception as e:
         bot.send_message(chat_id, f"Error activating admin mode: {e}. Contact support.")
-        logger.error(f"Exception in enter_admin_mode for {username} (ID: {chat_id}): {e}")
+        logger.error("Exception in enter_admin_mode for %s (ID: %s): %s", username, chat_id, e)
+
+# Admin commands to check (/verifystats) or repair (/rebuildstats) the order counters
+@bot.message_handler(commands=['verifystats', 'rebuildstats'])
+def rebuild_stats(message):
+    chat_id = message.chat.id
+    if str(chat_id) not in admin_ids:
+        bot.send_message(chat_id, "You are not an admin.", reply_markup=create_main_keyboard())
+        return
+    fix = message.text.startswith('/rebuildstats')
+    drift = UpdateData.rebuild_stats(fix=fix)
+    if drift is None:
+        bot.send_message(chat_id, "Stats check failed. Check logs.")
+        return
+    lines = [f"Stats drift: {len(drift['users'])} users, {len(drift['products'])} products, {len(drift['stock'])} key stocks" + (" (fixed)" if fix else "")]
+    for row in drift['users']:
+        lines.append(f"User {row['user_id']}: orders {row['orders_count']} -> {row['actual_orders_count']}, spent {row['total_spent']} -> {row['actual_total_spent']}")
+    for row in drift['products']:
+        lines.append(f"Product {row['productnumber']}: sold {row['units_sold']} -> {row['actual_units_sold']}, revenue {row['revenue']} -> {row['actual_revenue']}")
+    for row in drift['stock']:
+        lines.append(f"Product {row['productnumber']}: stock {row['productquantity']} -> {row['actual_productquantity']} unclaimed keys")
+    for chunk in MessageFormatter.chunk_lines(lines):
+        bot.send_message(chat_id, chunk)
+    logger.info("Stats %s by %s (ID: %s)", 'rebuilt' if fix else 'verified', message.from_user.username, chat_id)
+
+# Admin command: slowest statements by total time, with lock wait/hold and commit
+@bot.message_handler(commands=['dbstats'])
+def db_stats(message):
+    chat_id = message.chat.id
+    if str(chat_id) not in admin_ids:
+        bot.send_message(chat_id, "You are not an admin.", reply_markup=create_main_keyboard())
+        return
+    rows = profiler.summary(limit=15)
+    if not rows:
+        bot.send_message(chat_id, "No queries profiled yet.")
+        return
+    lines = [f"DB profile (slow query threshold {profiler.slow_threshold * 1000:.0f} ms), slowest total first:"]
+    for row in rows:
+        lines.append(f"\n[{row['phase']}] {row['statement'][:200]}\n"
+                     f"count {row['count']}, total {row['total'] * 1000:.1f} ms, avg {row['avg'] * 1000:.2f} ms, "
+                     f"p99 {row['p99'] * 1000:.2f} ms, max {row['max'] * 1000:.2f} ms")
+    for chunk in MessageFormatter.chunk_lines(lines):
+        bot.send_message(chat_id, chunk)
+
+# Admin command: take a verified database backup now, off the worker thread
+@bot.message_handler(commands=['backup'])
+def backup_now(message):
+    chat_id = message.chat.id
+    if str(chat_id) not in admin_ids:
+        bot.send_message(chat_id, "You are not an admin.", reply_markup=create_main_keyboard())
+        return
+
+    def run():
+        result = backup_job.run_once()
+        if result['ok']:
+            bot.send_message(chat_id, f"Backup saved: {result['path']} ({result['size']:,} bytes, {result['pages']} pages) "
+                                      f"in {result['duration']:.2f}s, longest step {result['max_step'] * 1000:.1f} ms, integrity {result['integrity']}")
+        else:
+            bot.send_message(chat_id, f"Backup failed: {result.get('error')}")
+    bot.send_message(chat_id, "Backup started...")
+    threading.Thread(target=run, name="db-backup-now", daemon=True).start()
+
+# Admin command: /importkeys <product number>, then upload a text file with one license key per line
+@bot.message_handler(commands=['importkeys'])
+def import_keys(message):
+    chat_id = message.chat.id
+    if str(chat_id) not in admin_ids:
+        bot.send_message(chat_id, "You are not an admin.", reply_markup=create_main_keyboard())
+        return
+    try:
+        productnumber = int(message.text.split()[1])
+    except (IndexError, ValueError):
+        bot.send_message(chat_id, "Usage: /importkeys <product number>")
+        return
+    product = GetDataFromDB.get_product_by_id(productnumber)
+    if product is None:
+        bot.send_message(chat_id, "Product not found.")
+        return
+    state_store.start(chat_id, "awaiting_keys_file", productnumber=productnumber)
+    bot.send_message(chat_id, f"Send the key file for {product['productname']} as a document, one key per line.")
+
+# Admin command: /importcatalog, then upload a .csv or .jsonl file (columns as in /exportcatalog)
+@bot.message_handler(commands=['importcatalog'])
+def import_catalog_command(message):
+    chat_id = message.chat.id
+    if str(chat_id) not in admin_ids:
+        bot.send_message(chat_id, "You are not an admin.", reply_markup=create_main_keyboard())
+        return
+    state_store.start(chat_id, "awaiting_catalog_file")
+    bot.send_message(chat_id, "Send the catalog as a .csv or .jsonl document. Rows with a productnumber update that product, "
+                              "rows without one are added. Use /exportcatalog for a template.")
+
+# Admin command: /exportcatalog [csv|jsonl], the whole catalog as a document
+@bot.message_handler(commands=['exportcatalog'])
+def export_catalog_command(message):
+    chat_id = message.chat.id
+    if str(chat_id) not in admin_ids:
+        bot.send_message(chat_id, "You are not an admin.", reply_markup=create_main_keyboard())
+        return
+    parts = message.text.split()
+    fmt = parts[1].lower() if len(parts) > 1 else 'csv'
+    if catalog_format(f"catalog.{fmt}") is None:
+        bot.send_message(chat_id, "Usage: /exportcatalog [csv|jsonl]")
+        return
+
+    def run():
+        # rows go from keyset pages straight to a temp file, which is uploaded from disk
+        with tempfile.TemporaryFile() as file:
+            text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+            count = export_catalog(text, fmt)
+            text.detach()
+            file.seek(0)
+            bot.send_document(chat_id, file, visible_file_name=f"catalog-{datetime.now():%Y%m%d-%H%M%S}.{fmt}",
+                              caption=f"{count:,} products")
+        logger.info("Catalog exported by %s (ID: %s): %s products", message.from_user.username, chat_id, count)
+    threading.Thread(target=run, name="catalog-export", daemon=True).start()
+
+def run_catalog_import(message, document):
+    chat_id = message.chat.id
+    fmt = catalog_format(document.file_name)
+    if fmt is None:
+        bot.send_message(chat_id, "Send a .csv or .jsonl file.", reply_markup=create_admin_keyboard())
+        return
+
+    def run():
+        try:
+            file_info = bot.get_file(document.file_id)
+            with sender.open_file(bot.token, file_info.file_path) as response:
+                response.raw.decode_content = True
+                stream = io.TextIOWrapper(response.raw, encoding='utf-8-sig', newline='')
+                result = import_catalog(stream, fmt, chat_id, message.from_user.username)
+        except Exception as e:
+            logger.error("Catalog import failed: %s", e)
+            bot.send_message(chat_id, f"Catalog import failed: {e}", reply_markup=create_admin_keyboard())
+            return
+        errors = result['errors']
+        lines = [f"Catalog import: {result['rows']:,} rows, {result['added']:,} added, {result['updated']:,} updated, {len(errors):,} rejected"]
+        lines.extend(f"Line {line}: {error}" for line, error in errors[:BotConfig.CATALOG_ERRORS_SHOWN])
+        for chunk in MessageFormatter.chunk_lines(lines):
+            bot.send_message(chat_id, chunk, reply_markup=create_admin_keyboard())
+        if len(errors) > BotConfig.CATALOG_ERRORS_SHOWN:
+            report = io.BytesIO(''.join(f"Line {line}: {error}\n" for line, error in errors).encode('utf-8'))
+            bot.send_document(chat_id, report, visible_file_name="catalog-errors.txt", caption=f"All {len(errors):,} rejected rows")
+    bot.send_message(chat_id, "Importing catalog...")
+    threading.Thread(target=run, name="catalog-import", daemon=True).start()
+
+def run_keys_import(message, document, productnumber):
+    chat_id = message.chat.id
+
+    def run():
+        # streamed line by line into batched inserts, off the worker thread like /backup
+        try:
+            file_info = bot.get_file(document.file_id)
+            with sender.open_file(bot.token, file_info.file_path) as response:
+                result = UpdateData.import_keys(productnumber, response.iter_lines(), document.file_name)
+            if result is None:
+                result = {'added': 0, 'error': "product not found"}
+        except Exception as e:
+            logger.error("Key file download failed for product %s: %s", productnumber, e)
+            result = {'added': 0, 'error': str(e)}
+        text = (f"Keys imported for product {productnumber}: {result['added']:,} added, "
+                f"{result.get('duplicates', 0):,} duplicates, {result.get('invalid', 0):,} invalid")
+        if result.get('error'):
+            text += f"\nStopped early: {result['error']}"
+        bot.send_message(chat_id, text, reply_markup=create_admin_keyboard())
+    bot.send_message(chat_id, "Importing keys...")
+    threading.Thread(target=run, name="key-import", daemon=True).start()
+
+# Admin document uploads: key files after /importkeys, catalogs after /importcatalog
+@bot.message_handler(content_types=['document'])
+def handle_document(message):
+    chat_id = message.chat.id
+    record = state_store.get(chat_id)
+    if str(chat_id) not in admin_ids or not record or record['state'] not in ("awaiting_keys_file", "awaiting_catalog_file"):
+        return
+    state_store.clear(chat_id)
+    if record['state'] == "awaiting_catalog_file":
+        run_catalog_import(message, message.document)
+    else:
+        run_keys_import(message, message.document, record['data']['productnumber'])
 
 # Handle admin actions
 @bot.message_handler(func=lambda message: message.text in ["Add Item 📦", "Edit Item ✏️", "List Products 📋", "Back 🔙"])
 def handle_admin_action(message):
     chat_id = message.chat.id
     text = message.text
+    # the same check as /admin and the page_admin_* callback; Back stays open to everyone
+    if text != "Back 🔙" and str(chat_id) not in admin_ids:
+        bot.send_message(chat_id, "You are not an admin.", reply_markup=create_main_keyboard())
+        logger.warning("Non-admin (ID: %s) tried admin action %r", chat_id, text)
+        return
     if text == "Add Item 📦":
-        user_states[str(chat_id)] = "awaiting_product_name"
+        state_store.start(chat_id, "awaiting_product_name")
         bot.send_message(chat_id, "Send the product name:")
     elif text == "Edit Item ✏️":
-        user_states[str(chat_id)] = "awaiting_edit_id"
+        state_store.start(chat_id, "awaiting_edit_id")
         bot.send_message(chat_id, "Send the product number to edit:")
     elif text == "List Products 📋":
-        products = GetDataFromDB.get_products()
-        if products:
-            response = "Products:\n"
-            for product in products:
-                response += f"ID: {product['productnumber']} - {product['productname']} ({product['productquantity']} left) - {product['productprice']} {store_currency}\n"
-            bot.send_message(chat_id, response)
-        else:
-            bot.send_message(chat_id, "No products yet.")
+        text, keyboard, _ = build_product_page('admin')
+        bot.send_message(chat_id, text, reply_markup=keyboard)
         bot.send_message(chat_id, "Choose an option:", reply_markup=create_admin_keyboard())
     elif text == "Back 🔙":
-        state_keys = [k for k in user_states.keys() if k.startswith(str(chat_id))]
-        for key in state_keys:
-            del user_states[key]
+        state_store.clear(chat_id)
         bot.send_message(chat_id, "Returning to main menu.", reply_markup=create_main_keyboard())
 
 # Handle text and photo input for admin actions
@@ -266,70 +818,68 @@ def handle_admin_action(message):
 def handle_text(message):
     chat_id = message.chat.id
     text = message.text if message.text else None
-    if str(chat_id) in user_states:
-        state = user_states[str(chat_id)]
+    record = state_store.get(chat_id)
+    if record and record['state'] in ("awaiting_keys_file", "awaiting_catalog_file"):
+        # only a document answers these; anything else ends the upload and is handled as usual
+        state_store.clear(chat_id)
+        bot.send_message(chat_id, "Upload cancelled.", reply_markup=create_admin_keyboard())
+        record = None
+    if record:
+        state = record['state']
+        data = record['data']
         if state == "awaiting_product_name":
-            user_states[str(chat_id)] = "awaiting_product_price"
-            user_states[str(chat_id) + '_name'] = text
+            state_store.set_state(chat_id, "awaiting_product_price", name=text)
             bot.send_message(chat_id, "Send the product price:")
         elif state == "awaiting_product_price":
             try:
                 price = int(text)
-                user_states[str(chat_id)] = "awaiting_product_quantity"
-                user_states[str(chat_id) + '_price'] = price
+                state_store.set_state(chat_id, "awaiting_product_quantity", price=price)
                 bot.send_message(chat_id, "Send the product quantity:")
             except ValueError:
                 bot.send_message(chat_id, "Invalid price. Send a number.")
         elif state == "awaiting_product_quantity":
             try:
                 quantity = int(text)
-                user_states[str(chat_id)] = "awaiting_product_photo"
-                user_states[str(chat_id) + '_quantity'] = quantity
+                state_store.set_state(chat_id, "awaiting_product_photo", quantity=quantity)
                 bot.send_message(chat_id, "Send the product photo (optional, or type 'skip' for no photo):")
             except ValueError:
                 bot.send_message(chat_id, "Invalid quantity. Send a number.")
         elif state == "awaiting_product_photo":
-            name = user_states[str(chat_id) + '_name']
-            price = user_states[str(chat_id) + '_price']
-            quantity = user_states[str(chat_id) + '_quantity']
+            name = data['name']
+            price = data['price']
+            quantity = data['quantity']
             productimagelink = None
             if text and text.lower() == 'skip':
                 if CreateDatas.add_product(chat_id, message.from_user.username, name, "", price, quantity, "Default Category", productimagelink):
                     bot.send_message(chat_id, f"Product '{name}' added successfully! Price: {price}, Quantity: {quantity}")
-                    logger.info(f"Product '{name}' added by {message.from_user.username}")
+                    logger.info("Product '%s' added by %s", name, message.from_user.username)
                 else:
                     bot.send_message(chat_id, "Failed to add product. Check logs.")
-                state_keys = [k for k in user_states.keys() if k.startswith(str(chat_id))]
-                for key in state_keys:
-                    del user_states[key]
+                state_store.clear(chat_id)
                 bot.send_message(chat_id, "Choose an option:", reply_markup=create_admin_keyboard())
             else:
-                user_states[str(chat_id)] = "awaiting_product_photo_upload"
+                state_store.set_state(chat_id, "awaiting_product_photo_upload")
                 bot.send_message(chat_id, "Send the product photo (or type 'skip' again):")
         elif state == "awaiting_product_photo_upload":
-            name = user_states[str(chat_id) + '_name']
-            price = user_states[str(chat_id) + '_price']
-            quantity = user_states[str(chat_id) + '_quantity']
+            name = data['name']
+            price = data['price']
+            quantity = data['quantity']
             if message.photo:
                 productimagelink = message.photo[-1].file_id
                 if CreateDatas.add_product(chat_id, message.from_user.username, name, "", price, quantity, "Default Category", productimagelink):
                     bot.send_photo(chat_id, photo=productimagelink, caption=f"Product '{name}' added with photo! Price: {price}, Quantity: {quantity}")
-                    logger.info(f"Product '{name}' added with photo by {message.from_user.username}")
+                    logger.info("Product '%s' added with photo by %s", name, message.from_user.username)
                 else:
                     bot.send_message(chat_id, "Failed to add product. Check logs.")
-                state_keys = [k for k in user_states.keys() if k.startswith(str(chat_id))]
-                for key in state_keys:
-                    del user_states[key]
+                state_store.clear(chat_id)
                 bot.send_message(chat_id, "Choose an option:", reply_markup=create_admin_keyboard())
             elif text and text.lower() == 'skip':
                 if CreateDatas.add_product(chat_id, message.from_user.username, name, "", price, quantity, "Default Category", productimagelink):
                     bot.send_message(chat_id, f"Product '{name}' added successfully! Price: {price}, Quantity: {quantity}")
-                    logger.info(f"Product '{name}' added by {message.from_user.username}")
+                    logger.info("Product '%s' added by %s", name, message.from_user.username)
                 else:
                     bot.send_message(chat_id, "Failed to add product. Check logs.")
-                state_keys = [k for k in user_states.keys() if k.startswith(str(chat_id))]
-                for key in state_keys:
-                    del user_states[key]
+                state_store.clear(chat_id)
                 bot.send_message(chat_id, "Choose an option:", reply_markup=create_admin_keyboard())
             else:
                 bot.send_message(chat_id, "Please send a photo or type 'skip'.")
@@ -338,8 +888,7 @@ def handle_text(message):
                 product_id = int(text)
                 product = GetDataFromDB.get_product_by_id(product_id)
                 if product:
-                    user_states[str(chat_id)] = "awaiting_edit_details"
-                    user_states[str(chat_id) + '_edit_id'] = product_id
+                    state_store.set_state(chat_id, "awaiting_edit_details", edit_id=product_id)
                     bot.send_message(chat_id, f"Editing {product['productname']}. Send new details (name,price,quantity):")
                 else:
                     bot.send_message(chat_id, "Product not found.")
@@ -353,29 +902,43 @@ def handle_text(message):
                 quantity = int(quantity)
                 # Update product (placeholder)
                 bot.send_message(chat_id, f"Product updated to '{name}'! Price: {price}, Quantity: {quantity}")
-                state_keys = [k for k in user_states.keys() if k.startswith(str(chat_id))]
-                for key in state_keys:
-                    del user_states[key]
+                state_store.clear(chat_id)
                 bot.send_message(chat_id, "Choose an option:", reply_markup=create_admin_keyboard())
             except ValueError:
                 bot.send_message(chat_id, "Invalid format. Use: name,price,quantity")
     elif text == "/shop":
-        products = GetDataFromDB.get_products()
-        if products:
-            response = "Products:\n"
-            for product in products:
-                response += f"ID: {product['productnumber']} - {product['productname']} ({product['productquantity']} left) - {product['productprice']} {store_currency}\n"
-            bot.send_message(message.chat.id, response)
-        else:
-            bot.send_message(message.chat.id, "No products available yet.")
+        text, keyboard, _ = build_product_page('catalog')
+        bot.send_message(message.chat.id, text, reply_markup=keyboard)
         bot.send_message(message.chat.id, "Choose an option:", reply_markup=create_main_keyboard())
     elif text and text.startswith("admin,"):
         enter_admin_mode(message)
 
+# Every handler is registered by now
+metrics.instrument_handlers(bot)
+
+def run_polling():
+    # getUpdates does not work while a webhook is set
+    try:
+        bot.remove_webhook()
+    except Exception as e:
+        logger.warning("Could not remove webhook before polling: %s", e)
+    poller = UpdatePoller(bot, enqueue_update, BotConfig.POLLING_TIMEOUT, BotConfig.POLLING_LIMIT, APIConfig.WEBHOOK_RETRY_MAX_DELAY)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: poller.stop())
+    poller.run()
+
 if __name__ == '__main__':
+    backup_job.start()
+    if BotConfig.BOT_MODE == 'polling':
+        logger.info("Starting in long-polling mode...")
+        run_polling()
+        sys.exit(0)
+    # SIGTERM exits through atexit so queued updates are drained first
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    start_webhook_registration()
     try:
         logger.info("Starting Flask application...")
         flask_app.run(debug=False, host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
     except Exception as e:
-        logger.error(f"Error starting Flask application: {e}")
+        logger.error("Error starting Flask application: %s", e)
         exit(1)
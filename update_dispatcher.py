@@ -0,0 +1,227 @@
+"""
+Background processing of incoming Telegram updates
+"""
+
+import time
+import heapq
+import queue
+import logging
+import threading
+from collections import deque
+from typing import Callable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+def update_chat_id(update) -> int:
+    """Chat (or user) an update belongs to; updates with the same key are handled in order"""
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = getattr(update, field, None)
+        if message is not None:
+            return message.chat.id
+    callback_query = getattr(update, 'callback_query', None)
+    if callback_query is not None:
+        if callback_query.message is not None:
+            return callback_query.message.chat.id
+        return callback_query.from_user.id
+    for field in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query'):
+        query = getattr(update, field, None)
+        if query is not None:
+            return query.from_user.id
+    return update.update_id
+
+# Updates whose handlers answer the query instead of messaging the chat: never held
+# back by a chat's send budget (and a pre_checkout_query must be answered within 10 s)
+UNHELD_TYPES = ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query')
+
+UPDATE_TYPES = ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'callback_query', 'inline_query',
+                'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll', 'poll_answer',
+                'my_chat_member', 'chat_member', 'chat_join_request')
+
+def update_type(update) -> str:
+    """Name of the field an update carries, e.g. 'message' or 'callback_query'"""
+    for field in UPDATE_TYPES:
+        if getattr(update, field, None) is not None:
+            return field
+    return 'other'
+
+def update_user_id(update) -> Optional[int]:
+    """User who sent an update, None for updates without a sender"""
+    for field in ('message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+                  'shipping_query', 'pre_checkout_query'):
+        item = getattr(update, field, None)
+        if item is not None and item.from_user is not None:
+            return item.from_user.id
+    return None
+
+class UpdateDispatcher:
+    """Worker pool that handles updates of one chat in order and different chats in parallel"""
+
+    def __init__(self, process: Callable, workers: int = 4, queue_size: int = 1000, chat_delay: Optional[Callable] = None):
+        # Each chat is pinned to one worker queue, so its updates never overtake each other.
+        # chat_delay(chat_id) -> seconds until that chat can be sent to without waiting on
+        # its flood-limit bucket; a worker sets such a chat's updates aside until then and
+        # serves the other chats of its queue meanwhile, instead of sleeping in the send
+        self.process = process
+        self.chat_delay = chat_delay
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = []
+        self.held = 0  # updates set aside for a rate-limited chat
+
+    def start(self):
+        """Start the worker threads"""
+        for index, work_queue in enumerate(self.queues):
+            thread = threading.Thread(target=self._work, args=(work_queue,), name=f"update-worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info("Update dispatcher started with %s workers", len(self.queues))
+
+    def submit(self, update) -> bool:
+        """Queue an update without blocking; False if its worker queue is full"""
+        return self._put(update_chat_id(update), update)
+
+    def submit_task(self, chat_id: int, task: Callable) -> bool:
+        """Queue a callable on chat_id's worker, ordered with that chat's updates"""
+        return self._put(chat_id, task)
+
+    def _put(self, chat_id: int, item) -> bool:
+        work_queue = self.queues[hash(chat_id) % len(self.queues)]
+        try:
+            work_queue.put_nowait((chat_id, item))
+            return True
+        except queue.Full:
+            return False
+
+    def depth(self) -> int:
+        """Number of updates waiting across all workers, held ones included"""
+        return sum(work_queue.qsize() for work_queue in self.queues) + self.held
+
+    def stop(self, timeout: float = 30):
+        """Let the workers finish everything already queued, then stop them"""
+        if not self.threads:
+            return
+        logger.info("Draining %s queued updates", self.depth())
+        for work_queue in self.queues:
+            work_queue.put(_STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+        logger.info("Update dispatcher stopped")
+
+    def _work(self, work_queue: queue.Queue):
+        held = {}  # chat_id -> deque of that chat's items set aside, in arrival order
+        due = []  # heap of (monotonic time the chat may be sent to again, chat_id)
+        while True:
+            timeout = max(0.0, due[0][0] - time.monotonic()) if due else None
+            try:
+                entry = work_queue.get(timeout=timeout)
+            except queue.Empty:
+                _, chat_id = heapq.heappop(due)
+                self._run_held(work_queue, chat_id, held, due)
+                continue
+            if entry is _STOP:
+                # drain: whatever is still held goes out now, the sender waits on the buckets
+                for chat_id in list(held):
+                    for item in held.pop(chat_id):
+                        self._run(work_queue, item)
+                        self.held -= 1
+                work_queue.task_done()
+                return
+            chat_id, item = entry
+            if chat_id in held and (callable(item) or update_type(item) not in UNHELD_TYPES):
+                held[chat_id].append(item)  # behind the chat's earlier updates
+                self.held += 1
+                continue
+            delay = self._delay(chat_id, item)
+            if delay:
+                held[chat_id] = deque([item])
+                self.held += 1
+                heapq.heappush(due, (time.monotonic() + delay, chat_id))
+                continue
+            self._run(work_queue, item)
+
+    def _delay(self, chat_id: int, item) -> float:
+        if self.chat_delay is None or (not callable(item) and update_type(item) in UNHELD_TYPES):
+            return 0.0
+        return self.chat_delay(chat_id)
+
+    def _run_held(self, work_queue: queue.Queue, chat_id: int, held: dict, due: list):
+        # Run a held chat's items in order until its bucket runs dry again
+        items = held[chat_id]
+        while items:
+            delay = self.chat_delay(chat_id)
+            if delay:
+                heapq.heappush(due, (time.monotonic() + delay, chat_id))
+                return
+            self.held -= 1
+            self._run(work_queue, items.popleft())
+        del held[chat_id]
+
+    def _run(self, work_queue: queue.Queue, update):
+        try:
+            if callable(update):
+                update()
+            else:
+                started = time.perf_counter()
+                try:
+                    self.process(update)
+                finally:
+                    metrics.update_seconds.observe(time.perf_counter() - started, update_type(update))
+        except Exception as e:
+            logger.error("Error processing update %s: %s", getattr(update, 'update_id', None), e)
+        finally:
+            work_queue.task_done()
+
+class UpdatePoller:
+    """Long-polling alternative to the webhook: fetches getUpdates batches and hands each update to submit"""
+
+    def __init__(self, bot, submit: Callable, timeout: int = 30, limit: int = 100, retry_max_delay: float = 60):
+        # submit(update) -> bool; False means "queue full", the poller waits and offers it again
+        self.bot = bot
+        self.submit = submit
+        self.timeout = timeout
+        self.limit = limit
+        self.retry_max_delay = retry_max_delay
+        self.offset = None
+        self._stop = threading.Event()
+
+    def run(self):
+        """Poll until stop() is called"""
+        logger.info("Polling for updates")
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                updates = self.bot.get_updates(offset=self.offset, limit=self.limit, timeout=self.timeout + 5,
+                                               long_polling_timeout=self.timeout)
+            except Exception as e:
+                logger.error("getUpdates failed: %s, retrying in %ss", e, delay)
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.retry_max_delay)
+                continue
+            delay = 1
+            for update in updates:
+                # a full queue stops fetching until the workers catch up; nothing is dropped
+                while not self.submit(update):
+                    if self._stop.wait(0.1):
+                        break
+                else:
+                    self.offset = update.update_id + 1
+                    continue
+                break
+        self._confirm()
+        logger.info("Polling stopped")
+
+    def _confirm(self):
+        # Telegram only forgets updates below offset on the next getUpdates call
+        if self.offset is None:
+            return
+        try:
+            self.bot.get_updates(offset=self.offset, limit=1, timeout=5, long_polling_timeout=0)
+        except Exception as e:
+            logger.warning("Could not confirm updates below %s: %s", self.offset, e)
+
+    def stop(self):
+        self._stop.set()
@@ -3,11 +3,18 @@ Utility functions for the Telegram Store Bot
 """
 
 import re
+import time
 import logging
-from typing import Optional, Union
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+
+from config import BotConfig
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
 class InputValidator:
     """Input validation and sanitization utilities"""
     
@@ -41,7 +48,9 @@ class InputValidator:
         """Validate product number"""
         try:
             product_number = int(product_number)
-            if 10000000 <= product_number <= 99999999:  # 8 digits
+            # Allocated numbers are 8 digits; stores created before the
+            # allocator also hold random numbers below 1000000
+            if 0 <= product_number <= 99999999:
                 return product_number
             return None
         except (ValueError, TypeError):
@@ -124,19 +133,19 @@ class ErrorHandler:
     @staticmethod
     def handle_database_error(error: Exception, operation: str) -> str:
         """Handle database-related errors"""
-        logger.error(f"Database error in {operation}: {error}")
+        logger.error("Database error in %s: %s", operation, error)
         return "Database error occurred. Please try again later."
     
     @staticmethod
     def handle_api_error(error: Exception, api_name: str) -> str:
         """Handle API-related errors"""
-        logger.error(f"API error in {api_name}: {error}")
+        logger.error("API error in %s: %s", api_name, error)
         return f"Error connecting to {api_name}. Please try again later."
     
     @staticmethod
     def handle_user_error(error: Exception, operation: str) -> str:
         """Handle user input errors"""
-        logger.warning(f"User error in {operation}: {error}")
+        logger.warning("User error in %s: %s", operation, error)
         return "Invalid input. Please check your input and try again."
 
 class MessageFormatter:
@@ -175,41 +184,262 @@ class MessageFormatter:
             return f"❌ {error_type}. Please try again or contact support."
         return f"Error: {error_type}"
 
+    @staticmethod
+    def chunk_lines(lines: list, limit: int = BotConfig.MAX_MESSAGE_LENGTH) -> list:
+        """Pack lines into as few messages as possible, each at most limit characters"""
+        chunks = []
+        current = ""
+        for line in lines:
+            # a single line longer than a message is split hard
+            while len(line) > limit:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(line[:limit])
+                line = line[limit:]
+            if current and len(current) + 1 + len(line) > limit:
+                chunks.append(current)
+                current = line
+            else:
+                current = f"{current}\n{line}" if current else line
+        if current:
+            chunks.append(current)
+        return chunks
+
+class TokenBucket:
+    """Thread-safe token bucket: refills at rate tokens/second up to capacity"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        """Add the tokens earned since the last update; caller holds the lock"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take tokens if available right now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+    
+    def delay(self, tokens: float = 1) -> float:
+        """Seconds until tokens would be available, without taking any"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (tokens - self.tokens) / self.rate)
+    
+    def acquire(self, tokens: float = 1) -> float:
+        """Take tokens, sleeping until they are earned; returns seconds waited"""
+        with self._lock:
+            self._refill(time.monotonic())
+            # Going into debt reserves a slot, so concurrent callers queue in order
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class RateLimiter:
+    """Per-user request budgets (per minute and per hour) plus a global budget, memory-bounded"""
+    
+    def __init__(self, per_minute: int, per_hour: int, global_per_second: float, max_users: int = 10000):
+        self.per_minute = per_minute
+        self.per_hour = per_hour
+        self.max_users = max_users
+        self.global_bucket = TokenBucket(global_per_second, global_per_second)
+        # user_id -> [minute tokens, hour tokens, last seen, notified]; least recently seen first
+        self.users = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled_user = 0
+        self.throttled_global = 0
+        self.evictions = 0
+    
+    def check(self, user_id: int) -> bool:
+        """Spend one request from user_id's budgets; False if any budget is exhausted"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self.users.get(user_id)
+            if entry is None:
+                entry = [self.per_minute, self.per_hour, now, False]
+                self.users[user_id] = entry
+                if len(self.users) > self.max_users:
+                    # the least recently seen user has the fullest buckets, forgetting it costs nothing
+                    self.users.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self.users.move_to_end(user_id)
+                elapsed = now - entry[2]
+                entry[0] = min(self.per_minute, entry[0] + elapsed * self.per_minute / 60)
+                entry[1] = min(self.per_hour, entry[1] + elapsed * self.per_hour / 3600)
+                entry[2] = now
+            if entry[0] < 1 or entry[1] < 1:
+                self.throttled_user += 1
+                return False
+            if not self.global_bucket.try_acquire():
+                self.throttled_global += 1
+                return False
+            entry[0] -= 1
+            entry[1] -= 1
+            entry[3] = False
+            self.allowed += 1
+            return True
+    
+    def check_global(self) -> bool:
+        """Spend one request from the global budget only, for updates exempt from per-user budgets"""
+        with self._lock:
+            if not self.global_bucket.try_acquire():
+                self.throttled_global += 1
+                return False
+            self.allowed += 1
+            return True
+    
+    def should_notify(self, user_id: int) -> bool:
+        """True once per throttled streak, so a spammer gets one warning rather than one per update"""
+        with self._lock:
+            entry = self.users.get(user_id)
+            if entry is None or entry[3]:
+                return False
+            entry[3] = True
+            return True
+    
+    def stats(self) -> dict:
+        """Allowed/throttled/eviction counters and tracked users"""
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'throttled_user': self.throttled_user,
+                'throttled_global': self.throttled_global,
+                'evictions': self.evictions,
+                'tracked_users': len(self.users)
+            }
+
 class CacheManager:
-    """Simple in-memory cache manager"""
+    """Thread-safe in-memory LRU cache with per-entry TTL"""
     
-    def __init__(self):
-        self.cache = {}
+    def __init__(self, max_size: int = 1000, default_ttl: int = 300):
+        self.cache = OrderedDict()
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        # Bumped by every invalidation; get_or_load only stores a loaded value
+        # if no invalidation happened while it was loading
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
     
-    def get(self, key: str):
-        """Get value from cache"""
-        return self.cache.get(key)
+    def _lookup(self, key: str):
+        """Return the live value for key or _MISSING; caller holds the lock"""
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+            return _MISSING
+        if time.monotonic() > entry['expires']:
+            del self.cache[key]
+            self.expirations += 1
+            self.misses += 1
+            return _MISSING
+        self.cache.move_to_end(key)
+        self.hits += 1
+        return entry['value']
     
-    def set(self, key: str, value, ttl: int = 300):
-        """Set value in cache with TTL (Time To Live)"""
-        import time
+    def _store(self, key: str, value, ttl: Optional[int]):
+        """Insert value and evict least recently used entries; caller holds the lock"""
         self.cache[key] = {
             'value': value,
-            'expires': time.time() + ttl
+            'expires': time.monotonic() + (self.default_ttl if ttl is None else ttl)
         }
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+    
+    def get(self, key: str, default=None):
+        """Get value from cache, or default if missing or expired"""
+        with self._lock:
+            value = self._lookup(key)
+        return default if value is _MISSING else value
+    
+    def set(self, key: str, value, ttl: Optional[int] = None):
+        """Set value in cache with TTL (Time To Live)"""
+        with self._lock:
+            self._store(key, value, ttl)
+    
+    def get_or_load(self, key: str, loader: Callable, ttl: Optional[int] = None):
+        """Return the cached value, or call loader() and cache its result unless it is None"""
+        with self._lock:
+            value = self._lookup(key)
+            epoch = self._epoch
+        if value is not _MISSING:
+            return value
+        value = loader()
+        if value is not None:
+            with self._lock:
+                if self._epoch == epoch:
+                    self._store(key, value, ttl)
+        return value
+    
+    def delete(self, key: str):
+        """Drop a single entry"""
+        with self._lock:
+            self.cache.pop(key, None)
+            self._epoch += 1
+    
+    def invalidate_prefix(self, prefix: str):
+        """Drop every entry whose key starts with prefix"""
+        with self._lock:
+            for key in [key for key in self.cache if key.startswith(prefix)]:
+                del self.cache[key]
+            self._epoch += 1
+    
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self.cache.clear()
+            self._epoch += 1
     
     def is_expired(self, key: str) -> bool:
         """Check if cache entry is expired"""
-        import time
-        if key not in self.cache:
-            return True
-        return time.time() > self.cache[key]['expires']
+        with self._lock:
+            if key not in self.cache:
+                return True
+            return time.monotonic() > self.cache[key]['expires']
     
     def clear_expired(self):
         """Clear expired cache entries"""
-        import time
-        current_time = time.time()
-        expired_keys = [
-            key for key, data in self.cache.items()
-            if current_time > data['expires']
-        ]
-        for key in expired_keys:
-            del self.cache[key]
+        with self._lock:
+            current_time = time.monotonic()
+            expired_keys = [
+                key for key, data in self.cache.items()
+                if current_time > data['expires']
+            ]
+            for key in expired_keys:
+                del self.cache[key]
+            self.expirations += len(expired_keys)
+    
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.cache),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
 
 # Global cache instance
-cache = CacheManager()
\ No newline at end of file
+cache = CacheManager(BotConfig.CACHE_MAX_SIZE, BotConfig.CACHE_TTL)